@@ -0,0 +1,314 @@
+"""
+This module, `acm_cache.py`, contains functions for caching parsed ACM measurement files as binary arrays.
+
+The module includes the following functions:
+
+- `load_acm_file`: Returns the parsed contents of an ACM file, from the cache if a valid entry exists.
+- `content_hash`: Calculates the content hash of a file.
+- `prune_acm_cache`: Evicts cache entries whose ACM file has been removed or changed.
+
+Each cached ACM file gets a directory in the cache holding the frame data, diode counts and background and
+calibration vectors as .npy files, which are memory mapped on load, and a `meta.json` file recording the path, size,
+modification time and content hash of the ACM file it was parsed from. By default the cache is a `.acm_cache` folder
+next to the ACM file.
+
+This module is part of a larger project aimed at analyzing and correcting dose rate dependencies in ArcCheck measurements.
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+import io_snc
+
+CACHE_DIR_NAME = '.acm_cache'
+CACHE_VERSION = 1
+STALE_WRITE_AGE = 3600  # seconds after which an unfinished entry write is considered abandoned
+PRUNE_INTERVAL = 600  # seconds a cache is not pruned again for after writing an entry
+PRUNE_MARKER_NAME = '.last_pruned'
+
+
+def content_hash(file_path, block_size=1 << 20):
+    """
+    Calculates the content hash of a file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the file.
+    block_size : int, optional
+        The number of bytes read at a time.
+
+    Returns
+    -------
+    str
+        The hexadecimal BLAKE2b digest of the file content.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _entry_dir(cache_dir, file_path):
+    """Returns the cache entry directory of an ACM file, named after a hash of its absolute path."""
+    path_key = hashlib.blake2b(os.path.abspath(file_path).encode('utf-8'), digest_size=12).hexdigest()
+    return os.path.join(cache_dir, path_key)
+
+
+def _read_meta(entry_dir):
+    """Returns the metadata of a cache entry, or None if the entry is missing or unreadable."""
+    try:
+        with open(os.path.join(entry_dir, 'meta.json'), 'r') as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION:
+        return None
+    return meta
+
+
+def _write_meta(entry_dir, meta):
+    """Writes the metadata of a cache entry."""
+    temp_path = os.path.join(entry_dir, 'meta.json.tmp')
+    with open(temp_path, 'w') as file:
+        json.dump(meta, file, indent=2)
+    os.replace(temp_path, os.path.join(entry_dir, 'meta.json'))
+
+
+def _load_entry(entry_dir, meta):
+    """
+    Loads the arrays of a cache entry as DataFrames backed by copy-on-write memory maps.
+
+    Parameters
+    ----------
+    entry_dir : str
+        The cache entry directory.
+    meta : dict
+        The metadata of the cache entry.
+
+    Returns
+    -------
+    tuple
+        A tuple containing three pandas DataFrames: frame_data_df, diode_data_df, bkrnd_and_calibration_df,
+        as returned by `io_snc.parse_acm_file`.
+    """
+    frame_data = np.load(os.path.join(entry_dir, 'frame_data.npy'), mmap_mode='c')
+    diode_data = np.load(os.path.join(entry_dir, 'diode_data.npy'), mmap_mode='c')
+    background = np.load(os.path.join(entry_dir, 'background.npy'))
+    calibration = np.load(os.path.join(entry_dir, 'calibration.npy'))
+
+    frame_data_df = pd.DataFrame(frame_data, columns=meta['frame_columns'], copy=False)
+    diode_data_df = pd.DataFrame(diode_data, columns=meta['diode_columns'], copy=False)
+    bkrnd_and_calibration_df = pd.DataFrame({
+        'Detector Names': meta['detector_names'],
+        'Background': background.tolist(),
+        'Calibration': calibration.tolist()
+    })
+    return frame_data_df, diode_data_df, bkrnd_and_calibration_df
+
+
+def _store_entry(entry_dir, meta, frame_data_df, diode_data_df, bkrnd_and_calibration_df):
+    """
+    Writes the parsed contents of an ACM file to a cache entry, replacing any previous entry.
+
+    Parameters
+    ----------
+    entry_dir : str
+        The cache entry directory.
+    meta : dict
+        The metadata of the ACM file.
+    frame_data_df, diode_data_df, bkrnd_and_calibration_df : pandas.DataFrame
+        The DataFrames returned by `io_snc.parse_acm_file`.
+    """
+    temp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+
+    np.save(os.path.join(temp_dir, 'frame_data.npy'), frame_data_df.to_numpy(dtype=np.float64))
+    np.save(os.path.join(temp_dir, 'diode_data.npy'), diode_data_df.to_numpy(dtype=np.float64))
+    np.save(os.path.join(temp_dir, 'background.npy'), bkrnd_and_calibration_df['Background'].to_numpy(dtype=str))
+    np.save(os.path.join(temp_dir, 'calibration.npy'), bkrnd_and_calibration_df['Calibration'].to_numpy(dtype=str))
+    _write_meta(temp_dir, meta)
+
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(temp_dir, entry_dir)
+
+
+def _as_count_dtype(diode_data_df, dtype):
+    """Returns the diode data converted to the count precision `dtype`, see `io_snc.count_dtype`."""
+    if np.dtype(dtype) == np.float64:
+        return diode_data_df
+    diode_data = diode_data_df.to_numpy()
+    dtype = io_snc.count_dtype(dtype, np.abs(diode_data).max(initial=0))
+    if dtype == diode_data.dtype:
+        return diode_data_df
+    return pd.DataFrame(diode_data.astype(dtype), columns=diode_data_df.columns, copy=False)
+
+
+def _select_frames_and_detectors(frame_data_df, diode_data_df, detectors, frames):
+    """Returns the frames and detectors selected as in `io_snc.parse_acm_file` from fully parsed DataFrames."""
+    rows = np.asarray(io_snc.acm_frame_window(frames, len(frame_data_df)), dtype=np.intp)
+    index = pd.RangeIndex(len(frame_data_df))[rows]
+    if detectors is None:
+        diode_columns = np.arange(diode_data_df.shape[1])
+    else:
+        diode_columns = io_snc.acm_detector_columns(detectors)
+
+    # Only the selected rows and columns are copied out of the memory maps
+    frame_data_df = pd.DataFrame(frame_data_df.to_numpy()[rows], columns=frame_data_df.columns, index=index)
+    diode_data_df = pd.DataFrame(diode_data_df.to_numpy()[np.ix_(rows, diode_columns)],
+                                 columns=diode_data_df.columns[diode_columns], index=index)
+    return frame_data_df, diode_data_df
+
+
+def load_acm_file(file_path, cache_dir=None, dtype=np.float64, detectors=None, frames=None):
+    """
+    Returns the parsed contents of an ACM file, from the cache if a valid entry exists.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the ACM file.
+    cache_dir : str, optional
+        The cache directory. Defaults to a `.acm_cache` folder next to the ACM file.
+    dtype : numpy.dtype or type, optional
+        The type the diode counts are returned in, np.float64 (default) or np.float32, see `io_snc.parse_acm_file`.
+        The cache always stores float64.
+    detectors : iterable of int or str, optional
+        The numbers of the detectors whose accumulated counts are returned, see `io_snc.parse_acm_file`.
+    frames : slice or callable, optional
+        The frames returned, see `io_snc.parse_acm_file`.
+
+    Returns
+    -------
+    tuple
+        A tuple containing three pandas DataFrames: frame_data_df, diode_data_df, bkrnd_and_calibration_df,
+        as returned by `io_snc.parse_acm_file`.
+
+    Notes
+    -----
+    An entry is used without reading the ACM file if its size and modification time are unchanged. Otherwise the
+    content hash is compared, so a file that was only touched or restored from a copy keeps its entry, while a file whose content
+    changed is parsed again and its stale entry replaced. When a new entry is written and the cache was last
+    pruned more than `PRUNE_INTERVAL` seconds ago, entries of ACM files that no longer exist or have changed size are
+    evicted, so a batch of new files prunes the cache once rather than after every file. If the cache cannot be
+    written, the parsed data is still returned.
+
+    With a detector subset or a frame window, only the selected counts are copied out of a valid entry. Without one,
+    only the selection is parsed from the ACM file and no entry is written.
+    """
+    io_snc.count_dtype(dtype, 0)
+    selective = detectors is not None or frames is not None
+
+    def selected(frame_data_df, diode_data_df, bkrnd_and_calibration_df):
+        """Returns the selected frames and detectors of fully parsed DataFrames at the requested precision."""
+        if selective:
+            frame_data_df, diode_data_df = _select_frames_and_detectors(frame_data_df, diode_data_df, detectors,
+                                                                        frames)
+        return frame_data_df, _as_count_dtype(diode_data_df, dtype), bkrnd_and_calibration_df
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(file_path)), CACHE_DIR_NAME)
+
+    stat = os.stat(file_path)
+    entry_dir = _entry_dir(cache_dir, file_path)
+    meta = _read_meta(entry_dir)
+
+    if meta is not None and meta['size'] == stat.st_size:
+        try:
+            if meta['mtime_ns'] == stat.st_mtime_ns:
+                return selected(*_load_entry(entry_dir, meta))
+            if meta['content_hash'] == content_hash(file_path):
+                meta['mtime_ns'] = stat.st_mtime_ns
+                _write_meta(entry_dir, meta)
+                return selected(*_load_entry(entry_dir, meta))
+        except (OSError, ValueError) as e:
+            print(f"Warning: Ignoring unreadable cache entry for {file_path}: {e}")
+
+    if selective:
+        return io_snc.parse_acm_file(file_path, dtype=dtype, detectors=detectors, frames=frames)
+
+    frame_data_df, diode_data_df, bkrnd_and_calibration_df = io_snc.parse_acm_file(file_path)
+
+    meta = {
+        'version': CACHE_VERSION,
+        'path': os.path.abspath(file_path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'content_hash': content_hash(file_path),
+        'frame_columns': frame_data_df.columns.tolist(),
+        'diode_columns': diode_data_df.columns.tolist(),
+        'detector_names': bkrnd_and_calibration_df['Detector Names'].tolist(),
+    }
+    try:
+        _store_entry(entry_dir, meta, frame_data_df, diode_data_df, bkrnd_and_calibration_df)
+        _prune_if_due(cache_dir)
+    except OSError as e:
+        print(f"Warning: Could not write cache entry for {file_path}: {e}")
+
+    return selected(frame_data_df, diode_data_df, bkrnd_and_calibration_df)
+
+
+def _prune_if_due(cache_dir):
+    """Prunes the cache if it was last pruned more than `PRUNE_INTERVAL` seconds ago, recorded by a marker file."""
+    marker_path = os.path.join(cache_dir, PRUNE_MARKER_NAME)
+    try:
+        if time.time() - os.stat(marker_path).st_mtime < PRUNE_INTERVAL:
+            return
+    except OSError:
+        pass  # Never pruned
+    # Mark first, so concurrent writers of the same cache do not all prune it
+    with open(marker_path, 'w'):
+        pass
+    prune_acm_cache(cache_dir)
+
+
+def prune_acm_cache(cache_dir):
+    """
+    Evicts cache entries whose ACM file has been removed or changed.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The cache directory.
+
+    Returns
+    -------
+    int
+        The number of evicted entries.
+
+    Notes
+    -----
+    Entries are evicted if their ACM file no longer exists or has a different size, if their metadata is missing or
+    from another cache version, and if they are writes abandoned for over an hour. Entries whose ACM file only has a
+    new modification time are kept, `load_acm_file` decides on those by content hash.
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    evicted = 0
+    for name in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, name)
+        if not os.path.isdir(entry_dir):
+            continue
+        try:
+            if '.tmp-' in name:
+                if time.time() - os.stat(entry_dir).st_mtime < STALE_WRITE_AGE:
+                    continue  # Possibly still being written by another process
+            else:
+                meta = _read_meta(entry_dir)
+                if meta is not None and os.stat(meta['path']).st_size == meta['size']:
+                    continue
+        except OSError:
+            pass
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        evicted += 1
+    return evicted
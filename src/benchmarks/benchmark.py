@@ -0,0 +1,318 @@
+"""
+This module, `benchmark.py`, contains a benchmark suite of the correction pipeline on synthetic ArcCheck
+measurements.
+
+The module includes the following functions:
+
+- `benchmark_stages`: Returns the benchmarked stages of one measurement.
+- `time_stage`: Times a stage.
+- `peak_memory`: Measures the peak memory a stage allocates.
+- `run_benchmarks`: Runs all stages on synthetic measurements of several lengths.
+- `find_regressions`: Compares benchmark results with a baseline.
+- `main`: Runs the benchmarks from the command line.
+
+Each stage of the pipeline, `io_snc.parse_acm_file`, `io_snc.parse_arrays_from_file`,
+`corrections.apply_jager_corrections`, `io_snc.detector_arrays`, `main.calculate_dose_values` and
+`io_snc.write_snc_txt_file`, is timed on its own and `main.process_file` end to end. The results can be saved as a
+baseline, and a later run compared against it fails if a stage got slower or allocates more memory than the
+tolerance allows, e.g.::
+
+    python src/benchmarks/benchmark.py -n 1000 10000 --save baseline.json
+    python src/benchmarks/benchmark.py -n 1000 10000 --baseline baseline.json --tolerance 0.25
+
+This module is part of a larger project aimed at analyzing and correcting dose rate dependencies in ArcCheck measurements.
+
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Add the src directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import acm_cache
+import corrections
+import io_snc
+import main as pipeline
+import synthetic_data
+
+MEMORY_SLACK = 1 << 20  # bytes of peak memory growth that are never reported as a regression
+
+
+def benchmark_stages(acm_file_path, txt_file_path, output_dir):
+    """
+    Returns the benchmarked stages of one measurement.
+
+    Parameters
+    ----------
+    acm_file_path, txt_file_path : str
+        The paths to the ACM file and its matching TXT file.
+    output_dir : str
+        A folder for the files written by the stages.
+
+    Returns
+    -------
+    dict
+        For each stage name, a tuple of a setup function, run untimed before each run, the stage function and the
+        number of bytes it reads or writes.
+    """
+    def read_txt_file():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return io_snc.parse_snc_txt_file(txt_file_path, typed=True)
+
+    _, counts_accumulated_df, bkrnd_and_calibration_df = io_snc.parse_acm_file(acm_file_path)
+    header_data, array_data = read_txt_file()
+    dose_per_count = float(header_data['Dose per Count'])
+    _, _, dose_rate_df, _ = pipeline.calculate_dose_values(counts_accumulated_df, dose_per_count)
+    written_file_path = os.path.join(output_dir, 'written.txt')
+    io_snc.write_snc_txt_file(array_data, header_data, written_file_path)
+
+    def no_setup():
+        pass
+
+    def reread_txt_file():
+        # Freshly parsed arrays, as the pipeline writes them, have not formatted their values yet
+        new_header_data, new_array_data = read_txt_file()
+        header_data.update(new_header_data)
+        array_data.update(new_array_data)
+
+    def clear_cache():
+        shutil.rmtree(os.path.join(os.path.dirname(acm_file_path), acm_cache.CACHE_DIR_NAME), ignore_errors=True)
+
+    def process_file():
+        with contextlib.redirect_stdout(io.StringIO()):
+            pipeline.process_file(acm_file_path, txt_file_path, 'pr', 'y', None, output_dir)
+
+    return {
+        'parse_acm_file': (no_setup, lambda: io_snc.parse_acm_file(acm_file_path),
+                           os.path.getsize(acm_file_path)),
+        'parse_arrays_from_file': (no_setup, lambda: io_snc.parse_arrays_from_file(txt_file_path),
+                                   os.path.getsize(txt_file_path)),
+        'apply_jager_corrections': (no_setup, lambda: corrections.apply_jager_corrections(
+            counts_accumulated_df, bkrnd_and_calibration_df), None),
+        'detector_arrays': (no_setup, lambda: io_snc.detector_arrays(dose_rate_df), None),
+        'calculate_dose_values': (no_setup, lambda: pipeline.calculate_dose_values(counts_accumulated_df,
+                                                                                   dose_per_count), None),
+        'write_snc_txt_file': (reread_txt_file, lambda: io_snc.write_snc_txt_file(array_data, header_data,
+                                                                                  written_file_path),
+                               os.path.getsize(written_file_path)),
+        'end_to_end': (clear_cache, process_file, os.path.getsize(acm_file_path)),
+    }
+
+
+def time_stage(setup, stage, repeats=3):
+    """
+    Times a stage.
+
+    Parameters
+    ----------
+    setup : callable
+        Run before each run of the stage, untimed.
+    stage : callable
+        The stage.
+    repeats : int, optional
+        The number of timed runs.
+
+    Returns
+    -------
+    tuple of float
+        The shortest wall time and the CPU time of the same run, in seconds.
+    """
+    best = (np.inf, np.inf)
+    for _ in range(repeats):
+        setup()
+        wall, cpu = time.perf_counter(), time.process_time()
+        stage()
+        best = min(best, (time.perf_counter() - wall, time.process_time() - cpu))
+    return best
+
+
+def peak_memory(setup, stage):
+    """
+    Measures the peak memory a stage allocates.
+
+    Parameters
+    ----------
+    setup : callable
+        Run before the stage, not measured.
+    stage : callable
+        The stage.
+
+    Returns
+    -------
+    int
+        The peak number of bytes allocated by Python and NumPy while the stage runs, above what was allocated
+        before it.
+    """
+    setup()
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        stage()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - start
+
+
+def run_benchmarks(frame_counts, repeats=3, data_dir=None, stages=None):
+    """
+    Runs the stages on synthetic measurements of several lengths.
+
+    Parameters
+    ----------
+    frame_counts : list of int
+        The number of frames of each measurement.
+    repeats : int, optional
+        The number of timed runs of each stage.
+    data_dir : str, optional
+        The folder of the synthetic measurements, which are written if missing and kept. Defaults to a temporary
+        folder that is removed afterwards.
+    stages : list of str, optional
+        The stages to run. Defaults to all.
+
+    Returns
+    -------
+    list of dict
+        The 'stage', number of 'frames', 'seconds' (wall), 'cpu_seconds', 'frames_per_s', 'mb_per_s' (None for
+        stages without a file) and 'peak_mb' of each stage and measurement.
+    """
+    temp_dir = tempfile.mkdtemp(prefix='arccheck_benchmark_')
+    data_dir = temp_dir if data_dir is None else data_dir
+    results = []
+    try:
+        for n_frames in frame_counts:
+            name = f"plan_{n_frames}"
+            acm_file_path = os.path.join(data_dir, name + '.acm')
+            txt_file_path = os.path.join(data_dir, name + '.txt')
+            if not (os.path.isfile(acm_file_path) and os.path.isfile(txt_file_path)):
+                synthetic_data.write_measurement(data_dir, n_frames, name)
+
+            output_dir = os.path.join(temp_dir, 'output')
+            os.makedirs(output_dir, exist_ok=True)
+            for stage_name, (setup, stage, n_bytes) in benchmark_stages(acm_file_path, txt_file_path,
+                                                                          output_dir).items():
+                if stages is not None and stage_name not in stages:
+                    continue
+                seconds, cpu_seconds = time_stage(setup, stage, repeats)
+                peak = peak_memory(setup, stage)
+                results.append({
+                    'stage': stage_name,
+                    'frames': n_frames,
+                    'seconds': seconds,
+                    'cpu_seconds': cpu_seconds,
+                    'frames_per_s': n_frames / seconds,
+                    'mb_per_s': n_bytes / 1e6 / seconds if n_bytes else None,
+                    'peak_mb': peak / 1e6,
+                })
+                print(_format_result(results[-1]))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return results
+
+
+def _format_result(result):
+    """Returns a benchmark result as a table row."""
+    mb_per_s = f"{result['mb_per_s']:9.1f}" if result['mb_per_s'] is not None else ' ' * 9
+    return (f"{result['stage']:<24}{result['frames']:>8}{result['seconds']:>10.4f}{result['frames_per_s']:>14.0f}"
+            f"{mb_per_s}{result['peak_mb']:>10.1f}")
+
+
+def find_regressions(results, baseline, tolerance=0.25):
+    """
+    Compares benchmark results with a baseline.
+
+    Parameters
+    ----------
+    results : list of dict
+        The results of `run_benchmarks`.
+    baseline : list of dict
+        Earlier results of `run_benchmarks`.
+    tolerance : float, optional
+        The relative increase of wall time or peak memory over the baseline that is accepted.
+
+    Returns
+    -------
+    list of str
+        A description of each stage and measurement length that got slower or allocates more memory than
+        accepted. Results without a baseline are not compared.
+    """
+    baseline_results = {(result['stage'], result['frames']): result for result in baseline}
+    regressions = []
+    for result in results:
+        reference = baseline_results.get((result['stage'], result['frames']))
+        if reference is None:
+            continue
+        if result['seconds'] > reference['seconds'] * (1 + tolerance):
+            regressions.append(f"{result['stage']} ({result['frames']} frames) took {result['seconds']:.4f} s, "
+                               f"baseline {reference['seconds']:.4f} s")
+        if result['peak_mb'] > reference['peak_mb'] * (1 + tolerance) + MEMORY_SLACK / 1e6:
+            regressions.append(f"{result['stage']} ({result['frames']} frames) peaked at {result['peak_mb']:.1f} MB, "
+                               f"baseline {reference['peak_mb']:.1f} MB")
+    return regressions
+
+
+def main(argv=None):
+    """
+    Runs the benchmarks from the command line.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to `sys.argv[1:]`.
+
+    Returns
+    -------
+    int
+        The exit status: 1 if a regression against the baseline was found, otherwise 0.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the correction pipeline on synthetic ArcCheck data.")
+    parser.add_argument('-n', '--frames', type=int, nargs='+', default=[1000, 10000],
+                        help="The number of frames of each synthetic measurement.")
+    parser.add_argument('-r', '--repeats', type=int, default=3, help="The number of timed runs of each stage.")
+    parser.add_argument('--stages', nargs='+', help="The stages to run. Defaults to all.")
+    parser.add_argument('--data-dir', help="Keep the synthetic measurements in this folder to reuse them.")
+    parser.add_argument('--save', help="Save the results as JSON, e.g. as a baseline.")
+    parser.add_argument('--baseline', help="Compare the results with a baseline saved with --save.")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="The accepted relative increase of time and peak memory over the baseline.")
+    arguments = parser.parse_args(argv)
+
+    print(f"{'stage':<24}{'frames':>8}{'seconds':>10}{'frames/s':>14}{'MB/s':>9}{'peak MB':>10}")
+    results = run_benchmarks(arguments.frames, arguments.repeats, arguments.data_dir, arguments.stages)
+
+    if arguments.save:
+        with open(arguments.save, 'w') as file:
+            json.dump({
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+                'machine': platform.platform(),
+                'results': results,
+            }, file, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline, 'r') as file:
+            baseline = json.load(file)['results']
+        regressions = find_regressions(results, baseline, arguments.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions against {arguments.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+This module, `synthetic_data.py`, contains functions for writing synthetic ArcCheck measurements at production
+scale: ACM files of any number of frames and the matching SNC txt files.
+
+The module includes the following functions:
+
+- `synthetic_measurement`: Simulates the accumulated counts of an arc delivery.
+- `write_acm_file`: Writes a synthetic ACM file.
+- `write_txt_file`: Writes the SNC txt file matching a synthetic ACM file.
+- `write_measurement`: Writes a synthetic ACM file and its matching SNC txt file.
+- `main`: Writes synthetic measurements from the command line.
+
+The delivery is a field rotating around the ArcCheck with a dose rate that changes over the arc, sampled every 50 ms.
+Each detector counts a Poisson number of pulses scaled by its position in the field, so the count rates have the
+range and frame to frame noise of a real VMAT measurement.
+
+This module is part of a larger project aimed at analyzing and correcting dose rate dependencies in ArcCheck measurements.
+
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+# Add the src directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import io_snc
+
+FRAME_TIME_US = 50000  # 50 ms per frame
+PULSE_FREQUENCY = 360  # Hz
+SERIAL_NO = '1234567'
+DOSE_PER_COUNT = 1.2e-4
+
+
+def synthetic_measurement(n_frames, seed=0):
+    """
+    Simulates the accumulated counts of an arc delivery.
+
+    Parameters
+    ----------
+    n_frames : int
+        The number of 50 ms frames.
+    seed : int, optional
+        The seed of the random numbers.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The frame data (frames x 9, without the reference diode), the accumulated counts of the reference diode and
+        the 1386 detectors (frames x 1387), the background and the calibration of the reference diode and the
+        detectors (1387 each).
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = io_snc.detector_grid_indices()
+
+    # Gantry angle over the arc and the azimuth of each detector around the cylinder
+    frames = np.arange(n_frames)
+    gantry_angle = (181 + 358 * frames / max(n_frames - 1, 1)) % 360
+    detector_azimuth = np.radians(cols / 130 * 360)
+    detector_y = (20 - rows) * 0.5  # cm from the centre
+
+    # Dose rate modulation of a VMAT arc, with beam holds
+    dose_rate = 0.55 + 0.45 * np.sin(frames / 97.0) * np.cos(frames / 31.0)
+    dose_rate[rng.random(n_frames) < 0.02] = 0
+    pulses = rng.poisson(PULSE_FREQUENCY * FRAME_TIME_US / 1e6 * dose_rate)
+
+    # Detectors facing the beam entrance and exit inside a 10 cm field count most
+    accumulated = np.zeros((n_frames, io_snc.ACM_N_DIODES + 1))
+    field = np.exp(-(detector_y / 5.0) ** 8)
+    for start in range(0, n_frames, 1024):
+        stop = min(start + 1024, n_frames)
+        angle = np.radians(gantry_angle[start:stop, np.newaxis])
+        facing = 0.35 + 0.65 * np.abs(np.cos(detector_azimuth - angle))
+        expected = pulses[start:stop, np.newaxis] * 1500.0 * (0.03 + field * facing)
+        block = np.empty((stop - start, io_snc.ACM_N_DIODES + 1))
+        block[:, 0] = pulses[start:stop] * 180.0
+        block[:, 1:] = rng.poisson(expected)
+        np.cumsum(block, axis=0, out=block)
+        accumulated[start:stop] = block + (accumulated[start - 1] if start else 0)
+
+    frame_data = np.column_stack([
+        frames + 1,
+        frames * FRAME_TIME_US,
+        frames * FRAME_TIME_US + FRAME_TIME_US,
+        np.cumsum(pulses),
+        np.zeros(n_frames),
+        np.zeros(n_frames),
+        gantry_angle,
+        gantry_angle,
+        np.full(n_frames, 10.0),
+    ])
+    background = rng.integers(0, 4, io_snc.ACM_N_DIODES + 1).astype(float)
+    calibration = rng.normal(1.0, 0.03, io_snc.ACM_N_DIODES + 1)
+    return frame_data, accumulated, background, calibration
+
+
+def write_acm_file(file_path, frame_data, accumulated, background, calibration):
+    """
+    Writes a synthetic ACM file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the ACM file.
+    frame_data, accumulated, background, calibration : numpy.ndarray
+        The measurement, as returned by `synthetic_measurement`.
+    """
+    n_detectors = accumulated.shape[1] - 1
+    preamble = ["ArcCheck ACM file", f"Serial No:\t{SERIAL_NO}", "Firmware Version:\t1.0.0"]
+    preamble += [f"Setting {index}:\t{index}" for index in range(76 - len(preamble))]
+
+    row_format = ('Data:\t%d\t%d\t%d\t%d\t%d\t%d\t%.2f\t%.2f\t%.1f\t%d\t' +
+                  '\t'.join(['%d'] * n_detectors) + '\n')
+
+    with open(file_path, 'w', buffering=1 << 20) as file:
+        file.write('\n'.join(preamble) + '\n')
+        file.write('Detector:\t' + '\t'.join(io_snc.ACM_FRAME_DATA_KEYS) + '\t' +
+                   '\t'.join(str(number) for number in range(1, n_detectors + 1)) + '\n')
+        file.write('Background' + '\t' * 9 + '\t' + '\t'.join('%d' % value for value in background) + '\n')
+        file.write('Calibration' + '\t' * 9 + '\t' + '\t'.join('%.6f' % value for value in calibration) + '\n')
+        for start in range(0, len(accumulated), 256):
+            block = np.column_stack([frame_data[start:start + 256], accumulated[start:start + 256]])
+            file.write((row_format * len(block)) % tuple(block.ravel().tolist()))
+
+
+def write_txt_file(file_path, accumulated, calibration):
+    """
+    Writes the SNC txt file matching a synthetic ACM file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the SNC txt file.
+    accumulated, calibration : numpy.ndarray
+        The accumulated counts and calibration of the measurement, as returned by `synthetic_measurement`.
+    """
+    rows, cols = io_snc.detector_grid_indices()
+    raw_counts = accumulated[-1, 1:] - accumulated[0, 1:]
+    corrected_counts = raw_counts * calibration[1:]
+
+    detector_values = {
+        'Background': np.zeros(io_snc.ACM_N_DIODES),
+        'Calibration Factors': calibration[1:],
+        'Offset': np.zeros(io_snc.ACM_N_DIODES),
+        'Raw Counts': raw_counts,
+        'Corrected Counts': corrected_counts,
+        'Dose Counts': corrected_counts * DOSE_PER_COUNT,
+        'Data Flags': np.zeros(io_snc.ACM_N_DIODES),
+        'Interpolated': corrected_counts,
+        'Dose Interpolated': corrected_counts * DOSE_PER_COUNT,
+        'Corrected Counts (No Angular Correction)': corrected_counts,
+    }
+    header = [
+        f"FileName:\t{os.path.basename(file_path)}", f"Serial No:\t{SERIAL_NO}", "Firmware Version:\t1.0.0",
+        "Diode Type:\tSNC", f"Dose per Count:\t{DOSE_PER_COUNT}", "Energy:\t6 MV", "Rows:\t41", "Cols:\t131",
+        "Date:\t1/1/2024", "Time:\t10:00:00",
+    ]
+
+    column_labels = '\tCOL\t' + '\t'.join(str(number) for number in range(1, 132)) + '\n'
+    x_labels = '\tXcm\t' + '\t'.join('%.2f' % (-32.5 + 0.5 * index) for index in range(131)) + '\n'
+
+    with open(file_path, 'w', buffering=1 << 20) as file:
+        file.write('\n'.join(header) + '\n\n')
+        for array_name in io_snc.SNC_ARRAY_NAMES:
+            grid = np.zeros((41, 131))
+            grid[rows, cols] = detector_values[array_name]
+            file.write(f"{array_name}\nYcm\tROW\n")
+            for row in range(41):
+                row_labels = '%.2f\t%d\t' % (10 - 0.5 * row, 41 - row)
+                file.write(row_labels + '\t'.join('%.3f' % value for value in grid[row]) + '\n')
+            file.write(column_labels + x_labels + '\n')
+
+
+def write_measurement(folder_path, n_frames, name='plan', seed=0):
+    """
+    Writes a synthetic ACM file and its matching SNC txt file.
+
+    Parameters
+    ----------
+    folder_path : str
+        The folder the files are written to.
+    n_frames : int
+        The number of 50 ms frames.
+    name : str, optional
+        The file name of the measurement, without extension.
+    seed : int, optional
+        The seed of the random numbers.
+
+    Returns
+    -------
+    tuple of str
+        The paths of the ACM and TXT files.
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    acm_file_path = os.path.join(folder_path, name + '.acm')
+    txt_file_path = os.path.join(folder_path, name + '.txt')
+
+    frame_data, accumulated, background, calibration = synthetic_measurement(n_frames, seed)
+    write_acm_file(acm_file_path, frame_data, accumulated, background, calibration)
+    write_txt_file(txt_file_path, accumulated, calibration)
+    return acm_file_path, txt_file_path
+
+
+def main(argv=None):
+    """
+    Writes synthetic measurements from the command line.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to `sys.argv[1:]`.
+    """
+    parser = argparse.ArgumentParser(description="Write synthetic ArcCheck ACM files and matching SNC txt files.")
+    parser.add_argument('folder', help="The folder the measurements are written to.")
+    parser.add_argument('-n', '--frames', type=int, nargs='+', default=[1000],
+                        help="The number of frames of each measurement.")
+    parser.add_argument('--seed', type=int, default=0, help="The seed of the random numbers.")
+    arguments = parser.parse_args(argv)
+
+    for index, n_frames in enumerate(arguments.frames):
+        acm_file_path, _ = write_measurement(arguments.folder, n_frames, f"plan_{n_frames}", arguments.seed + index)
+        print(f"Wrote {acm_file_path} ({n_frames} frames).")
+
+
+if __name__ == "__main__":
+    main()
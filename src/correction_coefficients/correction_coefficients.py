@@ -3,72 +3,262 @@ This module, `correction_coefficients.py`, contains functions for calculating an
 
 The module includes the following functions:
 
+- `middle_frame_window`: Gets the accumulated count frames needed for the count rates of the middle frames.
+- `count_rate_statistics`: Calculates the count rate statistics of each detector in the middle frames of an ACM file.
+- `get_count_rate_statistics`: Gets the count rate statistics of the ACM files of a folder, cached and in parallel.
+- `average_counts_per_50ms`: Averages the count rate statistics of a set of diodes per file.
 - `get_pr_data_from_acm_files`: Extracts the average counts/50ms from ACM files in a specified directory.
 - `exponential_fit`: Defines an exponential fitting function for curve fitting.
 - `get_correction_coefficients`: Calculates the correction coefficients based on the average counts/50ms and relative signal values.
+- `fit_correction_family`: Fits the correction coefficients of a folder of PR or DPP measurements.
+- `fit_exponentials`: Fits many independent exponential functions at once with a batched least squares solve.
+- `fit_coefficient_map`: Fits the correction coefficients of each detector of a folder of PR or DPP measurements.
+- `write_coefficient_map`: Writes a coefficient map as a correction model config file.
 - `plot_correction_curve`: Plots the correction curve with the data points and the fitted exponential function.
 - `plot_counts_per_50ms`: Plots the counts per 50ms at different nominal dose rates.
 - `main`: Main function to execute the correction coefficient calculations and plotting.
 
+The count rate statistics of every detector of each ACM file are cached in a `count_rate_statistics.json` file of
+the ACM cache folder, keyed by the size, modification time and content hash of the file. Changing the diode
+selection or the relative signal values only refits the cached statistics, and new or changed files are read in
+parallel worker processes. The PR and DPP coefficients are fitted the same way from their own measurement folders.
+
+Instead of one set of coefficients from the central diodes, `fit_coefficient_map` fits every detector on its own
+calibrated count rates. The 1386 fits are solved together by `fit_exponentials`, implausible fits are replaced by the
+fit of the central diodes, and the resulting (3 x 1386) coefficient map is applied by
+`corrections.apply_jager_corrections` like a single set of coefficients.
+
 This module is part of a larger project aimed at analyzing and correcting dose rate dependencies in ArcCheck measurements.
 
 """
 
+import argparse
+import concurrent.futures
+import json
 import os
 import sys
 
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy.optimize import curve_fit
 
 # Add the src directory to the sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from src import io_snc
+from src import acm_cache
+from src.corrections import calibrated_count_rate
+from src.io_snc import ACM_N_DIODES
+from src.run_manifest import file_fingerprint
+
+# The 12 detectors in the centre of the field whose count rate is averaged
+PR_DIODE_NUMBERS = [758, 759, 760, 761, 692, 693, 694, 695, 626, 627, 628, 629]
+N_MIDDLE_FRAMES = 100
+STATISTICS_FILE_NAME = 'count_rate_statistics.json'
+STATISTICS_VERSION = 2
 
+# The plausibility limits of the fit of each detector of a coefficient map, see `fit_coefficient_map`
+MAP_MIN_RELATIVE_COUNT_RATE = 0.1
+MAP_JCF_RANGE = (0.8, 1.2)
+MAP_MAX_RMS_RESIDUAL = 0.01
 
-def get_pr_data_from_acm_files(pr_measurement_folder):
+
+def middle_frame_window(n_frames, n_middle_frames=N_MIDDLE_FRAMES):
     """
-    Get the average counts/50ms from the ACM files.
+    Get the accumulated count frames needed for the count rates of the middle frames of a measurement.
 
     Parameters
     ----------
-    pr_measurement_folder : str
+    n_frames : int
+        The number of accumulated count frames of the measurement.
+    n_middle_frames : int, optional
+        The number of count rate frames.
+
+    Returns
+    -------
+    slice
+        The accumulated count frames, one more than `n_middle_frames` since the count rates are their differences.
+    """
+    start_frame = (n_frames - 1) // 2 - n_middle_frames // 2
+    return slice(start_frame, start_frame + n_middle_frames + 1)
+
+
+def count_rate_statistics(acm_file_path, cache_dir=None, n_middle_frames=N_MIDDLE_FRAMES):
+    """
+    Calculate the count rate statistics of each detector in the middle frames of an ACM file.
+
+    Parameters
+    ----------
+    acm_file_path : str
+        Path to the ACM file.
+    cache_dir : str, optional
+        The cache directory of the parsed ACM files. Defaults to a `.acm_cache` folder next to the ACM file.
+    n_middle_frames : int, optional
+        The number of count rate frames in the middle of the measurement the statistics are calculated over.
+
+    Returns
+    -------
+    dict
+        The 'mean' and 'std' count rate of each detector in the middle frames as lists, in detector order, and the
+        'calibrated_mean', the mean of the background subtracted and calibrated count rate the corrections are
+        applied to, see `corrections.calibrated_count_rate`.
+    """
+    _, diode_data_df, bkrnd_and_calibration_df = acm_cache.load_acm_file(
+        acm_file_path, cache_dir, frames=lambda n_frames: middle_frame_window(n_frames, n_middle_frames))
+
+    # Ensure the frame data is sorted by time or frame number if necessary
+    diode_data_df.sort_index(inplace=True)
+
+    # Calculate the count rate of the middle frames by differencing the accumulated counts
+    count_rate_df = diode_data_df.diff().iloc[1:]
+
+    # The background and calibration values of the reference detector are dropped, like in the corrections
+    calibrated_count_rates = calibrated_count_rate(
+        diode_data_df.values, bkrnd_and_calibration_df['Background'].values.astype(float)[1:],
+        bkrnd_and_calibration_df['Calibration'].values.astype(float)[1:])
+
+    return {
+        'mean': count_rate_df.mean().tolist(),
+        'std': count_rate_df.std().tolist(),
+        'calibrated_mean': calibrated_count_rates.mean(axis=0).tolist(),
+    }
+
+
+def _read_statistics(statistics_path):
+    """Returns the cached count rate statistics of each ACM file path, or an empty dict if there are none."""
+    try:
+        with open(statistics_path, 'r') as file:
+            statistics = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if statistics.get('version') != STATISTICS_VERSION:
+        return {}
+    return statistics['files']
+
+
+def _write_statistics(statistics_path, cached_statistics):
+    """Writes the cached count rate statistics, replacing the file at once."""
+    os.makedirs(os.path.dirname(statistics_path), exist_ok=True)
+    temp_path = f"{statistics_path}.tmp-{os.getpid()}"
+    with open(temp_path, 'w') as file:
+        json.dump({'version': STATISTICS_VERSION, 'files': cached_statistics}, file)
+    os.replace(temp_path, statistics_path)
+
+
+def get_count_rate_statistics(measurement_folder, cache_dir=None, n_workers=1, n_middle_frames=N_MIDDLE_FRAMES):
+    """
+    Get the count rate statistics of the ACM files of a folder, from the cache where the file is unchanged.
+
+    Parameters
+    ----------
+    measurement_folder : str
         Path to the folder containing ACM files.
+    cache_dir : str, optional
+        The cache directory of the parsed ACM files and their statistics. Defaults to a `.acm_cache` folder in
+        `measurement_folder`.
+    n_workers : int, optional
+        The number of worker processes reading new or changed files. With 1, they are read in this process.
+    n_middle_frames : int, optional
+        The number of count rate frames in the middle of each measurement, see `count_rate_statistics`.
 
     Returns
     -------
-    list of tuple
-        List of tuples containing the file name and the average counts/50ms for each nominal dose rate.
+    dict
+        The statistics returned by `count_rate_statistics` of each ACM file name, in the order of the folder.
     """
-    diode_numbers = np.array([758, 759, 760, 761, 692, 693, 694, 695, 626, 627, 628, 629]).astype(str)
-    counts_per_50ms_list = []
+    if cache_dir is None:
+        cache_dir = os.path.join(measurement_folder, acm_cache.CACHE_DIR_NAME)
+    statistics_path = os.path.join(cache_dir, STATISTICS_FILE_NAME)
+    cached_statistics = _read_statistics(statistics_path)
+
+    statistics, fingerprints, missing = {}, {}, []
+    for acm_file in os.listdir(measurement_folder):
+        acm_file_path = os.path.join(measurement_folder, acm_file)
+        if not os.path.isfile(acm_file_path):
+            continue  # Skip the cache folder
+        key = os.path.abspath(acm_file_path)
+        entry = cached_statistics.get(key)
+        fingerprints[key] = file_fingerprint(acm_file_path, entry['fingerprint'] if entry else None)
+        if entry is not None and entry['fingerprint']['content_hash'] == fingerprints[key]['content_hash'] and \
+                entry['n_middle_frames'] == n_middle_frames:
+            statistics[acm_file] = entry['statistics']
+        else:
+            statistics[acm_file] = None
+            missing.append(acm_file)
+
+    # Read the new and changed files, in parallel worker processes if requested
+    missing_paths = [os.path.join(measurement_folder, acm_file) for acm_file in missing]
+    if n_workers <= 1 or len(missing) <= 1:
+        results = [count_rate_statistics(path, cache_dir, n_middle_frames) for path in missing_paths]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(count_rate_statistics, missing_paths, [cache_dir] * len(missing),
+                                        [n_middle_frames] * len(missing)))
+    statistics.update(zip(missing, results))
+
+    # Replace the entries of this folder, dropping those of removed files, and keep those of other folders
+    folder_path = os.path.abspath(measurement_folder)
+    updated_statistics = {key: entry for key, entry in cached_statistics.items()
+                          if os.path.dirname(key) != folder_path}
+    for key, fingerprint in fingerprints.items():
+        updated_statistics[key] = {'fingerprint': fingerprint, 'n_middle_frames': n_middle_frames,
+                                   'statistics': statistics[os.path.basename(key)]}
+    if updated_statistics != cached_statistics:
+        try:
+            _write_statistics(statistics_path, updated_statistics)
+        except OSError as e:
+            print(f"Warning: Could not write the count rate statistics cache: {e}")
+    return statistics
+
+
+def average_counts_per_50ms(statistics, diode_numbers=PR_DIODE_NUMBERS):
+    """
+    Average the count rate statistics of a set of diodes per file.
 
-    for acm_file in os.listdir(pr_measurement_folder):
-        acm_file_path = os.path.join(pr_measurement_folder, acm_file)
-        frame_data_df, diode_data_df, bkrnd_and_calibration_df = io_snc.parse_acm_file(acm_file_path)
+    Parameters
+    ----------
+    statistics : dict
+        The count rate statistics of each file, from `get_count_rate_statistics`.
+    diode_numbers : list of int, optional
+        The detector numbers whose mean count rates are averaged.
 
-        # Ensure the frame data is sorted by time or frame number if necessary
-        diode_data_df.sort_index(inplace=True)
+    Returns
+    -------
+    list of tuple
+        List of tuples containing the file name and the average counts/50ms for each nominal dose rate, sorted by
+        the counts/50ms.
+    """
+    diode_columns = np.array(diode_numbers, dtype=int) - 1
+    counts_per_50ms_list = [(acm_file, pd.Series(np.asarray(file_statistics['mean'])[diode_columns]).mean())
+                            for acm_file, file_statistics in statistics.items()]
+    return sorted(counts_per_50ms_list, key=lambda x: x[1])
 
-        # Calculate the count rate by differencing the accumulated counts
-        diode_data_diff = diode_data_df.diff().iloc[1:]
 
-        # Grab the count rate from the middle 100 frames of the measurement
-        num_frames = len(diode_data_diff)
-        start_frame = num_frames // 2 - 50
-        end_frame = start_frame + 100
-        middle_frames = diode_data_diff.iloc[start_frame:end_frame]
+def get_pr_data_from_acm_files(pr_measurement_folder, cache_dir=None, n_workers=1):
+    """
+    Get the average counts/50ms from the ACM files.
 
-        # Extract the count rate for the specified diodes in the middle frames
-        count_rate_df = middle_frames.loc[:, diode_numbers]
+    Parameters
+    ----------
+    pr_measurement_folder : str
+        Path to the folder containing ACM files.
+    cache_dir : str, optional
+        The cache directory of the parsed ACM files. Defaults to a `.acm_cache` folder in `pr_measurement_folder`.
+    n_workers : int, optional
+        The number of worker processes reading new or changed files.
 
-        # Calculate the average count rate for the selected diodes
-        avg_count_rate = count_rate_df.mean().mean()
-        counts_per_50ms_list.append((acm_file, avg_count_rate))
+    Returns
+    -------
+    list of tuple
+        List of tuples containing the file name and the average counts/50ms for each nominal dose rate.
 
-    counts_per_50ms_list = sorted(counts_per_50ms_list, key=lambda x: x[1])
-    return counts_per_50ms_list
+    Notes
+    -----
+    The count rates of the detectors in `PR_DIODE_NUMBERS` are averaged over the middle `N_MIDDLE_FRAMES` frames of
+    each measurement, see `get_count_rate_statistics`.
+    """
+    statistics = get_count_rate_statistics(pr_measurement_folder, cache_dir, n_workers)
+    return average_counts_per_50ms(statistics, PR_DIODE_NUMBERS)
 
 
 def exponential_fit(x, a, b, c):
@@ -94,7 +284,7 @@ def exponential_fit(x, a, b, c):
     return a * np.exp(b * x) + c
 
 
-def get_correction_coefficients(counts_per_50ms, relative_signal):
+def get_correction_coefficients(counts_per_50ms, relative_signal, return_covariance=False):
     """
     Calculate the correction coefficients for the dose rate dependency.
 
@@ -104,19 +294,289 @@ def get_correction_coefficients(counts_per_50ms, relative_signal):
         List of tuples containing the file name and the average counts/50ms for each nominal dose rate.
     relative_signal : array_like
         Array of relative signal values corresponding to the nominal dose rates.
+    return_covariance : bool, optional
+        Whether to also return the estimated covariance of the coefficients, e.g. for
+        `uncertainty.corrected_count_sum_intervals`.
 
     Returns
     -------
-    tuple of float
-        The fitted coefficients (a, b, c) for the exponential correction function.
+    tuple of float or tuple
+        The fitted coefficients (a, b, c) for the exponential correction function, and their 3 x 3 covariance as a
+        numpy.ndarray if `return_covariance` is True.
     """
     counts_per_50ms = np.array([data[1] for data in counts_per_50ms])
 
     # Perform the curve fitting
-    popt, _ = curve_fit(exponential_fit, counts_per_50ms, relative_signal)
+    popt, pcov = curve_fit(exponential_fit, counts_per_50ms, relative_signal)
+    if return_covariance:
+        return tuple(popt), pcov
     return tuple(popt)
 
 
+def fit_correction_family(measurement_folder, relative_signal, diode_numbers=PR_DIODE_NUMBERS, cache_dir=None,
+                          n_workers=1, return_covariance=False):
+    """
+    Fit the correction coefficients of a folder of PR or DPP measurements.
+
+    Parameters
+    ----------
+    measurement_folder : str
+        Path to the folder containing the ACM files of the pulse rate or dose per pulse measurements.
+    relative_signal : array_like
+        Array of relative signal values of the measurements, in the order of increasing counts/50ms.
+    diode_numbers : list of int, optional
+        The detector numbers whose count rates are averaged.
+    cache_dir : str, optional
+        The cache directory of the parsed ACM files and their statistics, see `get_count_rate_statistics`.
+    n_workers : int, optional
+        The number of worker processes reading new or changed files.
+    return_covariance : bool, optional
+        Whether to also return the covariance of the coefficients, see `get_correction_coefficients`.
+
+    Returns
+    -------
+    tuple
+        The average counts/50ms of each file, see `average_counts_per_50ms`, and the result of
+        `get_correction_coefficients`.
+
+    Raises
+    ------
+    ValueError
+        If the number of relative signal values differs from the number of measurements.
+
+    Notes
+    -----
+    Only new or changed files are read, so refitting with other relative signal values or diodes takes no longer
+    than the fit itself.
+    """
+    statistics = get_count_rate_statistics(measurement_folder, cache_dir, n_workers)
+    counts_per_50ms = average_counts_per_50ms(statistics, diode_numbers)
+    if len(counts_per_50ms) != len(relative_signal):
+        raise ValueError(f"{len(relative_signal)} relative signal values given for {len(counts_per_50ms)} "
+                         f"measurements in {measurement_folder}.")
+    return counts_per_50ms, get_correction_coefficients(counts_per_50ms, relative_signal, return_covariance)
+
+
+def fit_exponentials(x, y, n_iterations=1000, tolerance=1e-10):
+    """
+    Fit many independent exponential functions y = a * exp(b * x) + c at once with a batched least squares solve.
+
+    Parameters
+    ----------
+    x, y : array_like
+        The data points of each fit, as (fits x points) arrays.
+    n_iterations : int, optional
+        The maximum number of Levenberg-Marquardt iterations.
+    tolerance : float, optional
+        The relative decrease of the residual sum of squares below which a fit has converged.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The (fits x 3) coefficients (a, b, c) of `exponential_fit`, whether each fit converged, and the residual sum
+        of squares of each fit. Fits of fewer than 3 points or of points that do not vary in x do not converge.
+
+    Notes
+    -----
+    The x values of each fit are scaled to at most 1. The starting values are found by variable projection: for a
+    grid of exponential rates b, a and c are solved in closed form for all fits, and the b with the smallest residual
+    is used. All fits are then refined together by Levenberg-Marquardt iterations, each solving a batch of 3 x 3
+    normal equations, with the damping adapted per fit.
+    """
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    y = np.broadcast_to(np.asarray(y, dtype=float), x.shape)
+    n_fits, n_points = x.shape
+
+    scale = np.abs(x).max(axis=1, keepdims=True)
+    scale[scale == 0] = 1
+    u = x / scale
+    degenerate = (n_points < 3) | (np.ptp(u, axis=1) == 0)
+
+    # Starting values by variable projection over a grid of scaled rates
+    rates = np.concatenate([-np.geomspace(20, 0.05, 24), np.geomspace(0.05, 20, 24)])
+    exponentials = np.exp(rates[:, np.newaxis, np.newaxis] * u)
+    exponential_deviation = exponentials - exponentials.mean(axis=2, keepdims=True)
+    y_deviation = y - y.mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a = (exponential_deviation * y_deviation).sum(axis=2) / (exponential_deviation ** 2).sum(axis=2)
+    a = np.nan_to_num(a)
+    c = y.mean(axis=1) - a * exponentials.mean(axis=2)
+    residuals = ((y - a[:, :, np.newaxis] * exponentials - c[:, :, np.newaxis]) ** 2).sum(axis=2)
+    best = np.nanargmin(np.where(np.isfinite(residuals), residuals, np.inf), axis=0)
+    fits = np.arange(n_fits)
+    params = np.column_stack([a[best, fits], rates[best], c[best, fits]])
+
+    def residual_sum(params):
+        exponential = np.exp(params[:, 1:2] * u)
+        residual = y - params[:, 0:1] * exponential - params[:, 2:3]
+        return exponential, residual, (residual ** 2).sum(axis=1)
+
+    exponential, residual, rss = residual_sum(params)
+    damping = np.full(n_fits, 1e-3)
+    converged = degenerate.copy()
+    for _ in range(n_iterations):
+        active = ~converged
+        if not active.any():
+            break
+        jacobian = np.stack([exponential, params[:, 0:1] * u * exponential, np.ones_like(u)], axis=2)[active]
+        normal = np.einsum('fpi,fpj->fij', jacobian, jacobian)
+        gradient = np.einsum('fpi,fp->fi', jacobian, residual[active])
+        diagonal = np.einsum('fii->fi', normal)
+        normal[:, np.arange(3), np.arange(3)] += damping[active, np.newaxis] * diagonal + \
+            1e-12 * diagonal.max(axis=1, keepdims=True) + 1e-300
+        step = np.linalg.solve(normal, gradient[:, :, np.newaxis])[:, :, 0]
+
+        trial = params.copy()
+        trial[active] += step
+        trial_exponential, trial_residual, trial_rss = residual_sum(trial)
+        improved = active & np.isfinite(trial_rss) & (trial_rss <= rss)
+
+        decrease = np.where(improved, rss - trial_rss, 0)
+        params[improved] = trial[improved]
+        exponential[improved], residual[improved] = trial_exponential[improved], trial_residual[improved]
+        converged |= improved & (decrease <= tolerance * np.maximum(rss, np.finfo(float).tiny))
+        rss = np.where(improved, trial_rss, rss)
+        damping = np.where(improved, damping / 3, np.minimum(damping * 3, 1e12))
+        converged |= active & (damping >= 1e12)  # No step decreases the residual any more
+
+    converged &= ~degenerate
+    coefficients = np.column_stack([params[:, 0], params[:, 1] / scale[:, 0], params[:, 2]])
+    return coefficients, converged, rss
+
+
+def fit_coefficient_map(measurement_folder, relative_signal, diode_numbers=PR_DIODE_NUMBERS, cache_dir=None,
+                        n_workers=1, min_relative_count_rate=MAP_MIN_RELATIVE_COUNT_RATE, jcf_range=MAP_JCF_RANGE,
+                        max_rms_residual=MAP_MAX_RMS_RESIDUAL):
+    """
+    Fit the correction coefficients of each detector of a folder of PR or DPP measurements.
+
+    Parameters
+    ----------
+    measurement_folder : str
+        Path to the folder containing the ACM files of the pulse rate or dose per pulse measurements.
+    relative_signal : array_like
+        The relative signal values of the measurements, in the order of increasing counts/50ms of the diodes in
+        `diode_numbers`, either one per measurement or a (measurements x 1386) array with the value of each detector.
+    diode_numbers : list of int, optional
+        The detector numbers whose count rates are averaged to order the measurements and to fit the detectors whose
+        own fit is rejected.
+    cache_dir : str, optional
+        The cache directory of the parsed ACM files and their statistics, see `get_count_rate_statistics`.
+    n_workers : int, optional
+        The number of worker processes reading new or changed files.
+    min_relative_count_rate : float, optional
+        The smallest mean count rate of a detector, relative to that of the diodes in `diode_numbers`, whose own fit
+        is used.
+    jcf_range : tuple of float, optional
+        The range the correction factor of a detector's own fit must stay in, from no counts to its largest measured
+        count rate.
+    max_rms_residual : float, optional
+        The largest root mean square residual of the relative signal of a detector's own fit.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The (3 x 1386) coefficient map with the (a, b, c) of the correction factor JCF = c - a * exp(-b * counts) of
+        each detector, ready for `corrections.apply_jager_corrections`, and whether each detector has its own fit.
+
+    Raises
+    ------
+    ValueError
+        If the number of relative signal values differs from the number of measurements.
+
+    Notes
+    -----
+    Each detector is fitted on its own mean background subtracted and calibrated count rates, the count rates the
+    corrections are applied to, see `fit_exponentials`. A fit is rejected if it does not converge, if the detector
+    counts too little for a meaningful fit, e.g. outside the field, if its correction factor leaves `jcf_range`
+    anywhere the corrections apply it, or if it does not fit the relative signal. Rejected detectors get the
+    coefficients fitted from the calibrated count rates of the diodes in `diode_numbers`, and their number is
+    printed.
+    """
+    statistics = get_count_rate_statistics(measurement_folder, cache_dir, n_workers)
+    counts_per_50ms = average_counts_per_50ms(statistics, diode_numbers)
+    relative_signal = np.asarray(relative_signal, dtype=float)
+    if len(relative_signal) != len(counts_per_50ms):
+        raise ValueError(f"{len(relative_signal)} relative signal values given for {len(counts_per_50ms)} "
+                         f"measurements in {measurement_folder}.")
+
+    # The count rates of each detector (rows) in each measurement (columns), in the order of the relative signal
+    count_rates = np.array([statistics[acm_file]['calibrated_mean'] for acm_file, _ in counts_per_50ms]).T
+    signal = relative_signal.T if relative_signal.ndim == 2 else relative_signal
+    coefficients, converged, rss = fit_exponentials(count_rates, signal)
+
+    # The correction factor a * exp(b * x) + c is monotonic, so it is in range if it is at no counts and at the
+    # largest count rate
+    diode_columns = np.array(diode_numbers, dtype=int) - 1
+    central_count_rates = count_rates[diode_columns].mean(axis=0)
+    with np.errstate(invalid='ignore', over='ignore', divide='ignore'):
+        relative_count_rate = np.mean(count_rates / central_count_rates, axis=1)
+        x_limits = np.column_stack([np.zeros(len(count_rates)), count_rates.max(axis=1)])
+        jcf_limits = exponential_fit(x_limits, coefficients[:, [0]], coefficients[:, [1]], coefficients[:, [2]])
+    plausible = (converged & (relative_count_rate >= min_relative_count_rate) &
+                 np.all((jcf_limits >= jcf_range[0]) & (jcf_limits <= jcf_range[1]), axis=1) &
+                 (np.sqrt(rss / count_rates.shape[1]) <= max_rms_residual))
+
+    if not plausible.all():
+        central_signal = relative_signal if relative_signal.ndim == 1 else \
+            relative_signal[:, diode_columns].mean(axis=1)
+        central_counts_per_50ms = [(acm_file, count_rate)
+                                   for (acm_file, _), count_rate in zip(counts_per_50ms, central_count_rates)]
+        coefficients[~plausible] = get_correction_coefficients(central_counts_per_50ms, central_signal)
+        print(f"{np.count_nonzero(~plausible)} of {plausible.size} detector fits did not converge or were "
+              f"implausible and use the fit of detectors {', '.join(map(str, diode_numbers))}.")
+
+    # Convert from a * exp(b * x) + c to the Jager form c - a * exp(-b * x)
+    coefficient_map = coefficients.T * np.array([-1, -1, 1])[:, np.newaxis]
+    return coefficient_map, plausible
+
+
+def write_coefficient_map(file_path, name, coefficient_map, correction_type='pr', serial_no=None, energy=None,
+                          description=''):
+    """
+    Write a coefficient map as a model of a correction model config file.
+
+    See `correction_models.load_correction_models` for the format.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the config file, e.g. the `correction_models.json` of a batch folder. The other models of an
+        existing file are kept, and a model of the same name is replaced.
+    name : str
+        The name of the correction model.
+    coefficient_map : numpy.ndarray
+        The (3 x 1386) coefficient map, from `fit_coefficient_map`.
+    correction_type : str, optional
+        The correction the coefficients are for, 'pr' or 'dpp'.
+    serial_no, energy : str, optional
+        The ArcCheck serial number and beam energy the model applies to. Defaults to any.
+    description : str, optional
+        A free text description of the model.
+
+    Raises
+    ------
+    ValueError
+        If the coefficient map is not a (3 x 1386) array.
+    """
+    if np.shape(coefficient_map) != (3, ACM_N_DIODES):
+        raise ValueError(f"The coefficient map must have shape (3, {ACM_N_DIODES}), got {np.shape(coefficient_map)}.")
+    a, b, c = np.asarray(coefficient_map, dtype=float).tolist()
+    model = {'name': name, 'type': correction_type, 'a': a, 'b': b, 'c': c, 'description': description}
+    if serial_no is not None:
+        model['serial_no'] = serial_no
+    if energy is not None:
+        model['energy'] = energy
+
+    config = {'models': []}
+    if os.path.isfile(file_path):
+        with open(file_path, 'r') as file:
+            config = json.load(file)
+    config['models'] = [entry for entry in config.get('models', []) if entry.get('name') != name] + [model]
+    with open(file_path, 'w') as file:
+        json.dump(config, file)
+
+
 def plot_correction_curve(counts_per_50ms, relative_signal, a_fit, b_fit, c_fit):
     """
     Plot the correction curve with the data points and the fitted exponential function.
@@ -194,16 +654,57 @@ def plot_counts_per_50ms(counts_per_50ms):
     plt.show()
 
 
-def main():
+def main(argv=None):
     """
     Main function to execute the correction coefficient calculations and plotting.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to `sys.argv[1:]`; without any, the PR coefficients of the
+        commissioning measurements are fitted.
     """
-    pr_measurement_folder = r"P:\02_QA Equipment\02_ArcCheck\05_Commissoning\03_NROAC\Dose Rate Dependence Fix\NRO PR Coefficient"
-    counts_per_50ms = get_pr_data_from_acm_files(pr_measurement_folder)
-    plot_counts_per_50ms(counts_per_50ms)
-    relative_signal = np.array([0.964, 0.971, 0.980, 0.988, 0.994, 0.995, 1.000, 1.000])
-    a_fit, b_fit, c_fit = get_correction_coefficients(counts_per_50ms, relative_signal)
-    plot_correction_curve(counts_per_50ms, relative_signal, a_fit, b_fit, c_fit)
+    parser = argparse.ArgumentParser(description="Fit the PR and DPP correction coefficients of ArcCheck "
+                                                 "measurements.")
+    parser.add_argument('--pr-folder',
+                        default=r"P:\02_QA Equipment\02_ArcCheck\05_Commissoning\03_NROAC\Dose Rate Dependence Fix\NRO PR Coefficient",
+                        help="The folder of the pulse rate measurements.")
+    parser.add_argument('--pr-signal', type=float, nargs='+',
+                        default=[0.964, 0.971, 0.980, 0.988, 0.994, 0.995, 1.000, 1.000],
+                        help="The relative signal of each pulse rate measurement, by increasing counts/50ms.")
+    parser.add_argument('--dpp-folder', help="The folder of the dose per pulse measurements, if any.")
+    parser.add_argument('--dpp-signal', type=float, nargs='+',
+                        help="The relative signal of each dose per pulse measurement, by increasing counts/50ms.")
+    parser.add_argument('--diodes', type=int, nargs='+', default=PR_DIODE_NUMBERS,
+                        help="The detector numbers whose count rates are averaged.")
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help="The number of worker processes reading new or changed files.")
+    parser.add_argument('--no-plots', action='store_true', help="Only print the fitted coefficients.")
+    parser.add_argument('--map', metavar='CONFIG',
+                        help="Also fit the coefficients of each detector and add them as the correction models "
+                             "'pr_map' and 'dpp_map' to this config file, e.g. correction_models.json.")
+    arguments = parser.parse_args(argv)
+    if arguments.dpp_folder and not arguments.dpp_signal:
+        parser.error("--dpp-folder requires --dpp-signal")
+
+    families = [('PR', arguments.pr_folder, arguments.pr_signal)]
+    if arguments.dpp_folder:
+        families.append(('DPP', arguments.dpp_folder, arguments.dpp_signal))
+
+    for name, measurement_folder, signal in families:
+        relative_signal = np.array(signal)
+        counts_per_50ms, (a_fit, b_fit, c_fit) = fit_correction_family(
+            measurement_folder, relative_signal, arguments.diodes, n_workers=arguments.workers)
+        print(f"{name} coefficients: a={a_fit:.6g}, b={b_fit:.6g}, c={c_fit:.6g}")
+        if not arguments.no_plots:
+            plot_counts_per_50ms(counts_per_50ms)
+            plot_correction_curve(counts_per_50ms, relative_signal, a_fit, b_fit, c_fit)
+        if arguments.map:
+            coefficient_map, own_fit = fit_coefficient_map(measurement_folder, relative_signal, arguments.diodes,
+                                                           n_workers=arguments.workers)
+            print(f"{name} coefficient map: {own_fit.sum()} of {own_fit.size} detectors have their own fit")
+            write_coefficient_map(arguments.map, f"{name.lower()}_map", coefficient_map, name.lower(),
+                                  description=f"Per-detector fit of {measurement_folder}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,331 @@
+"""
+This module, `correction_models.py`, contains a registry of named dose rate correction models and functions for
+selecting and evaluating them.
+
+A correction model is a named set of (a, b, c) coefficients of the correction factor JCF = c - a * exp(-b * counts),
+for either the pulse rate ('pr') or the dose per pulse ('dpp') correction, optionally restricted to ArcCheck serial
+numbers and beam energies. The Jager coefficients are registered by default as 'jager_pr' and 'jager_dpp'.
+
+The module includes the following classes and functions:
+
+- `CorrectionModel`: A named set of correction coefficients and the measurements it applies to.
+- `CorrectionModelRegistry`: Holds correction models by name and selects them by the header of a measurement.
+- `default_registry`: Returns a registry holding the Jager pulse rate and dose per pulse models.
+- `load_correction_models`: Loads correction models from a JSON config file.
+- `evaluate_correction_models`: Applies several correction models to one ACM recording in one pass.
+
+A config file holds a list of models, e.g.::
+
+    {
+        "models": [
+            {"name": "nroac_6mv_pr", "type": "pr", "a": 0.041, "b": 4.9e-5, "c": 1.0,
+             "serial_no": "1234567", "energy": "6 MV"}
+        ]
+    }
+
+Each of "a", "b" and "c" can also be a list of 1386 values, one per detector, as written by
+`correction_coefficients.write_coefficient_map`.
+
+This module is part of a larger project aimed at analyzing and correcting dose rate dependencies in ArcCheck measurements.
+
+"""
+
+import json
+
+import numpy as np
+
+import io_snc
+from corrections import JAGER_DPP_COEFFICIENTS, JAGER_PR_COEFFICIENTS, apply_jager_corrections, coefficient_sets
+
+CORRECTION_TYPES = ('pr', 'dpp')
+CONFIG_FILE_NAME = 'correction_models.json'
+
+
+def _normalize_header_value(value):
+    """Returns a header value in the form used to match it, without whitespace and case."""
+    return ''.join(str(value).split()).casefold()
+
+
+def _header_values(values):
+    """Returns the normalized values a model is restricted to, or None if it applies to any value."""
+    if values is None:
+        return None
+    if isinstance(values, str):
+        values = [values]
+    return tuple(_normalize_header_value(value) for value in values)
+
+
+class CorrectionModel:
+    """
+    A named set of correction coefficients and the measurements it applies to.
+
+    Parameters
+    ----------
+    name : str
+        The name of the model.
+    a, b, c : float or list of float
+        The coefficients of the correction factor JCF = c - a * exp(-b * counts), either shared by all detectors or
+        one per detector (1386 values, in detector order), e.g. from a per-detector fit.
+    correction_type : str, optional
+        The correction the coefficients are for, 'pr' or 'dpp'.
+    serial_no : str or list of str, optional
+        The ArcCheck serial numbers the model applies to, as in the 'Serial No' header entry. Defaults to any.
+    energy : str or list of str, optional
+        The beam energies the model applies to, as in the 'Energy' header entry. Defaults to any.
+    description : str, optional
+        A free text description, e.g. where the coefficients come from.
+    """
+
+    def __init__(self, name, a, b, c, correction_type='pr', serial_no=None, energy=None, description=''):
+        if correction_type not in CORRECTION_TYPES:
+            raise ValueError(f"Correction model {name!r} has unknown type {correction_type!r}, "
+                             f"expected one of {CORRECTION_TYPES}.")
+        self.name = name
+        coefficients = np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (a, b, c)))
+        if coefficients[0].ndim > 1 or coefficients[0].size not in (1, io_snc.ACM_N_DIODES):
+            raise ValueError(f"Correction model {name!r} needs single coefficients or {io_snc.ACM_N_DIODES} per "
+                             f"detector, got shape {coefficients[0].shape}.")
+        # A (3,) array of shared coefficients or a (3, detectors) coefficient map
+        self.coefficients = np.array(coefficients)
+        self.correction_type = correction_type
+        self.serial_no = _header_values(serial_no)
+        self.energy = _header_values(energy)
+        self.description = description
+
+    def __repr__(self):
+        if self.coefficients.ndim == 2:
+            a = b = c = f"<{self.coefficients.shape[1]} values>"
+            return (f"CorrectionModel({self.name!r}, a={a}, b={b}, c={c}, "
+                    f"correction_type={self.correction_type!r})")
+        a, b, c = self.coefficients.tolist()
+        return f"CorrectionModel({self.name!r}, a={a!r}, b={b!r}, c={c!r}, correction_type={self.correction_type!r})"
+
+    def matches(self, header_data):
+        """
+        Returns whether the model applies to a measurement.
+
+        Parameters
+        ----------
+        header_data : dict
+            The header of the SNC txt file of the measurement, as returned by `io_snc.parse_snc_txt_file`.
+
+        Returns
+        -------
+        bool
+            True if the serial number and energy of the measurement are among those of the model.
+        """
+        for key, values in (('Serial No', self.serial_no), ('Energy', self.energy)):
+            if values is not None and _normalize_header_value(header_data.get(key, '')) not in values:
+                return False
+        return True
+
+    @property
+    def specificity(self):
+        """int: The number of header entries the model is restricted by."""
+        return (self.serial_no is not None) + (self.energy is not None)
+
+
+class CorrectionModelRegistry:
+    """
+    Holds correction models by name and selects them by the header of a measurement.
+
+    Parameters
+    ----------
+    models : iterable of CorrectionModel, optional
+        The models to register.
+    """
+
+    def __init__(self, models=()):
+        self._models = {}
+        for model in models:
+            self.register(model)
+
+    def __len__(self):
+        return len(self._models)
+
+    def __iter__(self):
+        return iter(self._models.values())
+
+    def __contains__(self, name):
+        return name in self._models
+
+    def register(self, model):
+        """
+        Adds a model to the registry, replacing any model of the same name.
+
+        Parameters
+        ----------
+        model : CorrectionModel
+            The model to add.
+        """
+        self._models.pop(model.name, None)
+        self._models[model.name] = model
+
+    def get(self, name):
+        """
+        Returns a model by name.
+
+        Parameters
+        ----------
+        name : str
+            The name of the model.
+
+        Returns
+        -------
+        CorrectionModel
+            The model.
+        """
+        try:
+            return self._models[name]
+        except KeyError:
+            raise KeyError(f"Unknown correction model {name!r}, available models: {', '.join(self._models)}.")
+
+    def names(self):
+        """
+        Returns the names of the registered models.
+
+        Returns
+        -------
+        list of str
+            The names, in registration order.
+        """
+        return list(self._models)
+
+    def select(self, header_data, correction_type):
+        """
+        Selects the model of a correction type that applies to a measurement.
+
+        Parameters
+        ----------
+        header_data : dict
+            The header of the SNC txt file of the measurement, as returned by `io_snc.parse_snc_txt_file`.
+        correction_type : str
+            The correction, 'pr' or 'dpp'.
+
+        Returns
+        -------
+        CorrectionModel
+            The matching model restricted by the most header entries. Between equally specific models, the one
+            registered last is selected, so models loaded from a config file take precedence over the defaults.
+        """
+        candidates = [model for model in self._models.values()
+                      if model.correction_type == correction_type and model.matches(header_data)]
+        if not candidates:
+            raise KeyError(f"No {correction_type} correction model matches Serial No "
+                           f"{header_data.get('Serial No')!r} and Energy {header_data.get('Energy')!r}.")
+        # max returns the first of equally specific models, so search from the last registered
+        return max(reversed(candidates), key=lambda model: model.specificity)
+
+    def coefficient_matrix(self, names=None):
+        """
+        Returns the coefficients of several models as one array.
+
+        Parameters
+        ----------
+        names : list of str, optional
+            The names of the models. Defaults to all registered models.
+
+        Returns
+        -------
+        numpy.ndarray
+            The (models, 3) array of the (a, b, c) coefficients of each model, or a (models, 3, detectors) array if
+            any model has a coefficient map.
+        """
+        names = self.names() if names is None else names
+        coefficients = coefficient_sets([self.get(name).coefficients for name in names])
+        return coefficients[:, :, 0] if coefficients.shape[2] == 1 else coefficients
+
+
+def default_registry():
+    """
+    Returns a registry holding the Jager pulse rate and dose per pulse models.
+
+    Returns
+    -------
+    CorrectionModelRegistry
+        A new registry with the 'jager_pr' and 'jager_dpp' models, which apply to any measurement.
+    """
+    return CorrectionModelRegistry([
+        CorrectionModel('jager_pr', *JAGER_PR_COEFFICIENTS, correction_type='pr',
+                        description='Jager pulse rate correction'),
+        CorrectionModel('jager_dpp', *JAGER_DPP_COEFFICIENTS, correction_type='dpp',
+                        description='Jager dose per pulse correction'),
+    ])
+
+
+def load_correction_models(file_path, registry=None):
+    """
+    Loads correction models from a JSON config file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the config file, holding a "models" list of objects with the "name", "type" ('pr' or 'dpp'),
+        "a", "b" and "c" of each model and optionally its "serial_no", "energy" and "description".
+    registry : CorrectionModelRegistry, optional
+        The registry to add the models to. Defaults to a new `default_registry()`.
+
+    Returns
+    -------
+    CorrectionModelRegistry
+        The registry with the loaded models added.
+
+    Raises
+    ------
+    ValueError
+        If an entry is missing a required key, e.g. its "type", which is required so that a dose per pulse model is
+        never applied as a pulse rate model.
+    """
+    registry = default_registry() if registry is None else registry
+
+    with open(file_path, 'r') as file:
+        config = json.load(file)
+
+    for entry in config.get('models', []):
+        try:
+            model = CorrectionModel(entry['name'], entry['a'], entry['b'], entry['c'],
+                                    correction_type=entry['type'],
+                                    serial_no=entry.get('serial_no'),
+                                    energy=entry.get('energy'),
+                                    description=entry.get('description', ''))
+        except KeyError as e:
+            raise ValueError(f"Correction model entry {entry} in {file_path} is missing {e}.")
+        registry.register(model)
+
+    return registry
+
+
+def evaluate_correction_models(counts_accumulated_df, bkrnd_and_calibration_df, models, intrinsic_corrections=None,
+                               block_size=1024):
+    """
+    Applies several correction models to one ACM recording in one pass.
+
+    Parameters
+    ----------
+    counts_accumulated_df : pandas.DataFrame
+        The accumulated count values.
+    bkrnd_and_calibration_df : pandas.DataFrame
+        The background and calibration values of the ACM file.
+    models : list of CorrectionModel
+        The models to apply.
+    intrinsic_corrections : numpy.ndarray or io_snc.SncArrayBlock, optional
+        The intrinsic corrections returned by `corrections.get_intrinsic_corrections`.
+    block_size : int, optional
+        The number of frames corrected at a time.
+
+    Returns
+    -------
+    dict
+        The corrected count sums of each model in the format of the SNC txt file, by model name.
+
+    Notes
+    -----
+    The count rate is calculated once and the correction factors of all models are evaluated on it as a single
+    (models x frames x detectors) array operation, see `corrections.jager_corrected_count_sums`, so comparing ten
+    candidate models costs little more than applying one. The frames are summed in the same order however many
+    models share the scratch array, so the sums of each model are identical to applying it on its own.
+    """
+    coefficients = [model.coefficients for model in models]
+    corrected_count_arrays = apply_jager_corrections(counts_accumulated_df, bkrnd_and_calibration_df,
+                                                     intrinsic_corrections, coefficients, block_size)
+    return {model.name: corrected_count_array for model, corrected_count_array in zip(models, corrected_count_arrays)}
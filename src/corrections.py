@@ -4,7 +4,15 @@ This module, `corrections.py`, contains functions for applying various correctio
 The module includes the following functions:
 
 - `get_intrinsic_corrections`: Calculates the Intrinsic Correction array as an element-wise division of Corrected Counts by Raw Counts.
+- `snc_values`: Returns the numeric values of an SNC array block as a float array.
 - `apply_jager_corrections`: Applies Jager pulse rate and dose per pulse corrections to the accumulated count values.
+- `calibrated_count_rate`: Calculates the background subtracted and calibrated count rate from accumulated counts.
+- `pairwise_block_sum`: Sums a range of frames block by block in the same order as one NumPy sum over all of them.
+- `coefficient_sets`: Arranges sets of correction coefficients, shared by all detectors or per detector, as one array.
+- `jager_corrected_count_sums`: Sums the Jager corrected count rates for several sets of coefficients in one pass.
+- `JagerCorrectionAccumulator`: Keeps running per-detector Jager corrected count sums of a recording processed in blocks.
+- `apply_jager_corrections_streaming`: Applies the same corrections to an ACM file, reading its frames in blocks.
+- `follow_jager_corrections`: Follows an ACM file while it is being acquired and corrects the frames as they are appended.
 - `pulse_rate_correction`: Corrects the count values using the Jager pulse rate correction coefficients.
 - `dose_per_pulse_correction`: Corrects the count values using the Jager dose per pulse correction coefficients.
 
@@ -12,10 +20,18 @@ This module is part of a larger project aimed at analyzing and correcting dose r
 
 """
 
+
 import numpy as np
 import pandas as pd
 import io_snc
 
+# Jager correction coefficients (a, b, c) of the correction factor JCF = c - a * exp(-b * counts)
+JAGER_PR_COEFFICIENTS = np.array([0.035, 5.21 * 10 ** -5, 1])
+JAGER_DPP_COEFFICIENTS = np.array([0.0978, 3.33 * 10 ** -5, 1.011])
+
+# The number of values NumPy sums without splitting them pairwise
+NUMPY_PAIRWISE_BLOCK_SIZE = 128
+
 
 def get_intrinsic_corrections(array_data):
     """
@@ -25,10 +41,12 @@ def get_intrinsic_corrections(array_data):
     values, is left unchanged to match other arrays' structures.
 
     Parameters:
-    array_data (dict): A dictionary containing numpy arrays including 'Corrected Counts' and 'Raw Counts'.
+    array_data (dict): A dictionary containing numpy arrays or io_snc.SncArrayBlock objects including
+    'Corrected Counts' and 'Raw Counts'.
 
     Returns:
-    numpy.ndarray: An array of intrinsic corrections, including positional data, or None if an error occurs.
+    numpy.ndarray or io_snc.SncArrayBlock: An array of intrinsic corrections, including positional data, or None if
+    an error occurs. An SncArrayBlock is returned if 'Corrected Counts' is one.
     """
     try:
         corrected_counts = array_data.get('Corrected Counts')
@@ -40,6 +58,12 @@ def get_intrinsic_corrections(array_data):
         if corrected_counts.shape != raw_counts.shape:
             raise ValueError("Shape mismatch: 'Corrected Counts' and 'Raw Counts' arrays must have the same dimensions.")
 
+        if isinstance(corrected_counts, io_snc.SncArrayBlock):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                intrinsic_correction = np.divide(corrected_counts.values, snc_values(raw_counts))
+                intrinsic_correction = np.nan_to_num(intrinsic_correction)
+            return corrected_counts.with_values(intrinsic_correction)
+
         # Exclude the first two columns and last three rows which contain non-numeric positional data
         numeric_corrected = corrected_counts[1:-3, 2:]  # Start from second row for numeric processing
         numeric_raw = raw_counts[1:-3, 2:]  # Apply same row exclusion as numeric_corrected
@@ -71,35 +95,363 @@ def get_intrinsic_corrections(array_data):
         print(f"An error occurred: {e}")
         return None
 
-def apply_jager_corrections(counts_accumulated_df, bkrnd_and_calibration_df, intrinsic_corrections=None):
-    """Apply Jager pulse rate and dose per pulse corrections."""
-    a_pr, b_pr, c_pr = 0.035, 5.21 * 10 ** -5, 1
-    jager_pr_coefficients = np.array([a_pr, b_pr, c_pr])
+def snc_values(array_content):
+    """
+    Returns the numeric values of an SNC array block as a float array.
 
-    a_dpp, b_dpp, c_dpp = 0.0978, 3.33 * 10 ** -5, 1.011
-    jager_dpp_coefficients = np.array([a_dpp, b_dpp, c_dpp])
+    Parameters:
+    array_content (numpy.ndarray or io_snc.SncArrayBlock): The array block, either as parsed by
+    io_snc.parse_arrays_from_file or typed.
+
+    Returns:
+    numpy.ndarray: The 41 x 131 value grid without the positional data.
+    """
+    if isinstance(array_content, io_snc.SncArrayBlock):
+        return array_content.values
+    return np.array(array_content[1:-3, 2:], dtype=float)
 
-    pr_corrected_count_sum = pulse_rate_correction(counts_accumulated_df, bkrnd_and_calibration_df,
-                                                   jager_pr_coefficients)
-    dpp_corrected_count_sum = dose_per_pulse_correction(counts_accumulated_df, bkrnd_and_calibration_df,
-                                                        jager_dpp_coefficients)
 
-    # Create a new DataFrame
-    corrected_count = pd.DataFrame({
-        'pr_corrected_dose_df': pr_corrected_count_sum,
-        'dpp_corrected_dose_df': dpp_corrected_count_sum
-    })
+def apply_jager_corrections(counts_accumulated_df, bkrnd_and_calibration_df, intrinsic_corrections=None,
+                            coefficients=None, block_size=1024, dtype=None):
+    """
+    Apply Jager pulse rate and dose per pulse corrections.
+
+    Parameters:
+    counts_accumulated_df (DataFrame): A pandas DataFrame containing the accumulated count values.
+    bkrnd_and_calibration_df (DataFrame): The background and calibration values of the ACM file.
+    intrinsic_corrections (numpy.ndarray or io_snc.SncArrayBlock, optional): The intrinsic corrections returned by
+    get_intrinsic_corrections.
+    coefficients (list of ndarray or ndarray, optional): The (a, b, c) coefficients of each correction, by default
+    the Jager pulse rate and dose per pulse coefficients, shared by all detectors or as per-detector coefficient
+    maps, see coefficient_sets. See correction_models for named sets of coefficients.
+    block_size (int, optional): The number of frames corrected at a time, which bounds the temporary memory.
+    dtype (numpy.dtype or type, optional): The precision of the count rates and correction factors, np.float64 or
+    np.float32. Defaults to float32 for float32 counts, e.g. from io_snc.parse_acm_file(..., dtype=np.float32), and
+    float64 otherwise. The accumulated counts are differenced in their own precision and the sums are accumulated
+    in float64 either way, so float64 counts too large for float32 can still be corrected in float32.
+
+    Returns:
+    numpy.ndarray: One array of corrected count sums in the format of the SNC txt file per set of coefficients,
+    the PR and then the DPP corrected sums by default.
+
+    Notes:
+    The count rate is calculated, background subtracted and calibrated once on the raw NumPy array and every set of
+    coefficients is evaluated on it, see jager_corrected_count_sums. The blocks of frames are summed in the order of
+    NumPy's pairwise summation (see pairwise_block_sum), so the sums are identical to those of pulse_rate_correction
+    and dose_per_pulse_correction, which sum all frames at once.
+
+    In float32, the count rates are exact as long as they are below 2 ** 24, as the frame-to-frame differences are
+    taken in the precision of the accumulated counts (io_snc.count_dtype keeps counts from 2 ** 24 in float64) one
+    block of frames at a time and only then converted. Calibrating and correcting a count rate rounds it about 5
+    times and the exponential term, at most a / (c - a) of the factor, once more, so with the unit roundoff
+    u = 2 ** -24 each corrected count rate is within (5 + 2 * a / (c - a)) * u of the float64 result, i.e. a relative
+    difference below 4e-7 for the Jager coefficients. Each corrected sum is within the same bound times the sum of
+    the absolute corrected count rates, which equals the sum itself unless count rates are negative.
+    """
+    counts_accumulated = np.asarray(counts_accumulated_df)
+    if dtype is None:
+        dtype = np.float32 if counts_accumulated.dtype == np.float32 else np.float64
+    accumulator = JagerCorrectionAccumulator(bkrnd_and_calibration_df, coefficients, dtype)
+    accumulator.update_recording(counts_accumulated, block_size)
+
+    return accumulator.corrected_count_array(intrinsic_corrections)
 
-    # In the format of the SNC txt file
-    corrected_count_array = io_snc.detector_arrays(corrected_count.T)
 
-    # Apply intrinsic corrections if provided
-    if intrinsic_corrections is not None:
-        numeric_intrinsic = intrinsic_corrections[1:-3, 2:]
-        numeric_intrinsic = np.array(numeric_intrinsic, dtype=float)
-        corrected_count_array *= numeric_intrinsic
+def calibrated_count_rate(counts_accumulated, background_values, calibration_values, previous_counts=None,
+                          dtype=None):
+    """
+    Calculate the background subtracted and calibrated count rate of each frame from accumulated counts.
+
+    Parameters:
+    counts_accumulated (ndarray): The accumulated counts of consecutive frames (frames x detectors).
+    background_values (ndarray): The background value of each detector.
+    calibration_values (ndarray): The calibration value of each detector.
+    previous_counts (ndarray, optional): The accumulated counts of the frame before the first one. If not given,
+    the first frame has no count rate and is dropped, like the first row of DataFrame.diff().
+    dtype (numpy.dtype or type, optional): The float type of the count rate. Defaults to the type of
+    counts_accumulated. The differences are taken in the type of counts_accumulated and then converted.
+
+    Returns:
+    ndarray: The calibrated count rate of each frame and detector, as a new array. With previous_counts, the frames
+    of each detector are contiguous in memory.
+    """
+    if previous_counts is None:
+        count = np.diff(counts_accumulated, axis=0)
+    else:
+        count = np.empty(np.shape(counts_accumulated), dtype=counts_accumulated.dtype, order='F')
+        count[0] = counts_accumulated[0] - previous_counts
+        np.subtract(counts_accumulated[1:], counts_accumulated[:-1], out=count[1:])
+    if dtype is not None:
+        count = count.astype(dtype, copy=False)
+
+    # Subtract the background values and multiply the calibration values
+    count -= background_values
+    count *= calibration_values
+    return count
+
+
+def pairwise_block_sum(start, stop, block_size, block_sum):
+    """
+    Sum a range of frames block by block in the same order as one NumPy sum over all of them.
+
+    Parameters:
+    start, stop (int): The range of frames.
+    block_size (int): The maximum number of frames of a block, at least NUMPY_PAIRWISE_BLOCK_SIZE.
+    block_sum (callable): Returns the sum of the frames from start to stop, e.g. summed with ndarray.sum along a
+    contiguous frame axis.
+
+    Returns:
+    The sum of all blocks.
+
+    Notes:
+    NumPy sums a contiguous axis pairwise: it splits n values into the first n // 2 (rounded down to a multiple of 8)
+    and the rest and adds the sums of the halves. Splitting the range the same way until the blocks are no longer
+    than block_size sums every block as NumPy would within the whole range, so the result is identical to one sum
+    over all frames, with only block_size frames in memory at a time. NumPy does not split 128 values or fewer, so
+    smaller blocks are enlarged to NUMPY_PAIRWISE_BLOCK_SIZE frames.
+    """
+    block_size = max(block_size, NUMPY_PAIRWISE_BLOCK_SIZE)
+    if stop - start <= block_size:
+        return block_sum(start, stop)
+    half = (stop - start) // 2
+    half -= half % 8
+    return (pairwise_block_sum(start, start + half, block_size, block_sum) +
+            pairwise_block_sum(start + half, stop, block_size, block_sum))
+
+
+def coefficient_sets(coefficients):
+    """
+    Arrange sets of correction coefficients, each shared by all detectors or one per detector, as one array.
+
+    Parameters:
+    coefficients (list of ndarray or ndarray): The (a, b, c) coefficients of each correction. A set is either 3
+    values shared by all detectors or a (3 x detectors) coefficient map with the a, b and c of each detector. An
+    ndarray of up to 2 dimensions is read as (corrections x 3), except a single (3 x detectors) map, and a 3D
+    ndarray as (corrections x 3 x detectors).
+
+    Returns:
+    ndarray: A (corrections x 3 x 1) array if all sets are shared by all detectors, otherwise a
+    (corrections x 3 x detectors) array.
+    """
+    try:
+        array = np.asarray(coefficients, dtype=float)
+    except ValueError:
+        array = None  # Shared sets and coefficient maps mixed in a list
+
+    if array is not None and array.ndim == 3:
+        return array
+    if array is not None and array.ndim == 2 and array.shape[0] == 3 and array.shape[1] != 3:
+        return array[np.newaxis]
+    if array is not None:
+        return array.reshape(-1, 3)[:, :, np.newaxis]
+
+    sets = [np.asarray(coefficient_set, dtype=float).reshape(3, -1) for coefficient_set in coefficients]
+    n_detectors = max(coefficient_set.shape[1] for coefficient_set in sets)
+    return np.stack([np.broadcast_to(coefficient_set, (3, n_detectors)) for coefficient_set in sets])
+
+
+def jager_corrected_count_sums(count, coefficients, max_scratch_size=1 << 22):
+    """
+    Sum the Jager corrected count rates of each detector for several sets of coefficients in one pass.
+
+    Parameters:
+    count (ndarray): The calibrated count rate of each frame and detector, from calibrated_count_rate.
+    coefficients (list of ndarray or ndarray): The (a, b, c) coefficients of each correction, e.g. a
+    (corrections x 3) array, or (3 x detectors) coefficient maps with the coefficients of each detector, see
+    coefficient_sets.
+    max_scratch_size (int, optional): The maximum number of values of the scratch array, which bounds the temporary
+    memory when many sets of coefficients are evaluated. At least NUMPY_PAIRWISE_BLOCK_SIZE frames are taken at a
+    time however many sets there are.
+
+    Returns:
+    ndarray: The corrected count sum of each set of coefficients (rows) and detector (columns), in float64.
+
+    Notes:
+    Each correction divides the count rate by JCF = c - a * exp(-b * count). The factors of all sets of coefficients
+    are evaluated together in place in one (corrections x frames x detectors) scratch array, taking as many frames
+    at a time as fit in max_scratch_size and adding the passes with pairwise_block_sum, so the sums do not depend on
+    max_scratch_size. NaN count rates are skipped in the sums like in DataFrame.sum(). The
+    factors are evaluated in the precision of count, float32 or float64, and summed in float64. Coefficient maps are
+    broadcast along the detector axis of the scratch array, so per-detector coefficients cost the same.
+    """
+    coefficients = coefficient_sets(coefficients)
+    dtype = np.float32 if count.dtype == np.float32 else np.float64
+    a, b, c = (coefficients[:, i, np.newaxis, :].astype(dtype) for i in range(3))
+    n_corrections, (n_frames, n_detectors) = len(coefficients), count.shape
+
+    frames_per_pass = max(1, min(n_frames, max(NUMPY_PAIRWISE_BLOCK_SIZE,
+                                               max_scratch_size // max(1, n_corrections * n_detectors))))
+    # Frames are contiguous in the scratch array, so each detector is summed pairwise like DataFrame.sum()
+    scratch_buffer = np.empty((n_corrections, n_detectors, frames_per_pass), dtype=dtype).transpose(0, 2, 1)
+    has_nan = np.isnan(count).any()
+
+    def pass_sum(start, stop):
+        frames = count[start:stop]
+        scratch = scratch_buffer[:, :len(frames)]
+        np.multiply(frames, -b, out=scratch)
+        np.exp(scratch, out=scratch)
+        scratch *= -a
+        scratch += c
+        np.divide(frames, scratch, out=scratch)
+        return np.nansum(scratch, axis=1, dtype=np.float64) if has_nan else scratch.sum(axis=1, dtype=np.float64)
+
+    if n_frames == 0:
+        return np.zeros((n_corrections, n_detectors))
+    return pairwise_block_sum(0, n_frames, frames_per_pass, pass_sum)
+
+
+class JagerCorrectionAccumulator:
+    """
+    Keeps running per-detector Jager corrected count sums of an ACM recording that is processed in blocks of frames.
+
+    Parameters:
+    bkrnd_and_calibration_df (DataFrame): The background and calibration values of the ACM file.
+    coefficients (list of ndarray or ndarray, optional): The (a, b, c) coefficients of each correction, by default
+    the Jager pulse rate and dose per pulse coefficients, see coefficient_sets.
+    dtype (numpy.dtype or type, optional): The precision of the count rates and correction factors, np.float64
+    (default) or np.float32, see apply_jager_corrections.
+
+    Attributes:
+    coefficients (ndarray): The coefficients of each correction, as arranged by coefficient_sets.
+    corrected_count_sums (ndarray): The corrected count sum of each correction (rows) and detector (columns), in
+    float64.
+    n_frames (int): The number of accumulated count frames received so far.
+
+    Notes:
+    The accumulated counts of the last frame of each block are carried over to difference the first frame of the next
+    block, so feeding a recording block by block gives the same sums as correcting it at once, up to the order of
+    the additions. update_recording adds a whole recording in the order of one sum over all its frames.
+    """
+
+    def __init__(self, bkrnd_and_calibration_df, coefficients=None, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.background_values = bkrnd_and_calibration_df['Background'].values.astype(float)[1:].astype(self.dtype)
+        self.calibration_values = bkrnd_and_calibration_df['Calibration'].values.astype(float)[1:].astype(self.dtype)
+        self.coefficients = coefficient_sets([JAGER_PR_COEFFICIENTS, JAGER_DPP_COEFFICIENTS] if coefficients is None
+                                             else coefficients)
+        self.corrected_count_sums = np.zeros((len(self.coefficients), len(self.background_values)))
+        self.n_frames = 0
+        self._last_counts = None
+
+    def update(self, counts_accumulated):
+        """
+        Adds a block of accumulated count frames to the corrected sums.
+
+        Parameters:
+        counts_accumulated (ndarray): The accumulated counts of consecutive frames (frames x detectors).
+        """
+        if len(counts_accumulated) == 0:
+            return
+
+        # Calculate the count rate, the first frame of the recording has no previous frame and is dropped
+        counts_accumulated = np.asarray(counts_accumulated)
+        count = calibrated_count_rate(counts_accumulated, self.background_values, self.calibration_values,
+                                      self._last_counts, self.dtype)
+        self._last_counts = np.array(counts_accumulated[-1])
+        self.n_frames += len(counts_accumulated)
+
+        if len(count):
+            self.corrected_count_sums += jager_corrected_count_sums(count, self.coefficients)
+
+    def update_recording(self, counts_accumulated, block_size=1024):
+        """
+        Adds all accumulated count frames of a recording to the corrected sums, block by block.
+
+        Parameters:
+        counts_accumulated (ndarray): The accumulated counts of consecutive frames (frames x detectors).
+        block_size (int, optional): The number of count rate frames calculated at a time, which bounds the
+        temporary memory.
+
+        Notes:
+        Unlike calling update for each block, the blocks are added in the order of pairwise_block_sum, so the sums
+        of a whole recording are identical to one sum over all its frames.
+        """
+        if len(counts_accumulated) == 0:
+            return
+
+        # Prepend the frame carried over from the last update, the count rates are the differences of the frames
+        counts_accumulated = np.asarray(counts_accumulated)
+        frames = counts_accumulated if self._last_counts is None else \
+            np.concatenate([self._last_counts[np.newaxis], counts_accumulated])
+
+        def block_sum(start, stop):
+            count = calibrated_count_rate(frames[start + 1:stop + 1], self.background_values, self.calibration_values,
+                                          frames[start], self.dtype)
+            return jager_corrected_count_sums(count, self.coefficients)
+
+        if len(frames) > 1:
+            self.corrected_count_sums += pairwise_block_sum(0, len(frames) - 1, block_size, block_sum)
+        self._last_counts = np.array(counts_accumulated[-1])
+        self.n_frames += len(counts_accumulated)
+
+    def corrected_count_array(self, intrinsic_corrections=None):
+        """
+        Returns the corrected count sums in the format of the SNC txt file.
+
+        Parameters:
+        intrinsic_corrections (numpy.ndarray or io_snc.SncArrayBlock, optional): The intrinsic corrections returned
+        by get_intrinsic_corrections.
+
+        Returns:
+        numpy.ndarray: One 41 x 131 array per correction, as returned by apply_jager_corrections.
+        """
+        corrected_count_array = io_snc.detector_arrays(pd.DataFrame(self.corrected_count_sums))
+
+        # Apply intrinsic corrections if provided
+        if intrinsic_corrections is not None:
+            corrected_count_array *= snc_values(intrinsic_corrections)
+
+        return corrected_count_array
+
+
+def apply_jager_corrections_streaming(acm_file_path, intrinsic_corrections=None, block_size=1024):
+    """
+    Apply Jager pulse rate and dose per pulse corrections to an ACM file, reading its frames in blocks.
+
+    Parameters:
+    acm_file_path (str): The path to the ACM file.
+    intrinsic_corrections (numpy.ndarray or io_snc.SncArrayBlock, optional): The intrinsic corrections returned by
+    get_intrinsic_corrections.
+    block_size (int, optional): The number of frames read and corrected at a time.
+
+    Returns:
+    numpy.ndarray: The PR and DPP corrected count sums in the format of the SNC txt file, as returned by
+    apply_jager_corrections.
+
+    Notes:
+    Only the running corrected sum of each detector is kept between blocks, so the peak memory depends on
+    block_size and not on the length of the recording. The blocks are added in sequence, as the length of the
+    recording is not known in advance, so for recordings longer than block_size the sums can differ from
+    apply_jager_corrections in the last digits, by a relative amount of the order of 1e-16 per block.
+    """
+    accumulator = JagerCorrectionAccumulator(io_snc.parse_acm_background_and_calibration(acm_file_path))
+    for _, counts_accumulated in io_snc.iter_acm_data_blocks(acm_file_path, block_size):
+        accumulator.update(counts_accumulated)
+    return accumulator.corrected_count_array(intrinsic_corrections)
+
+
+def follow_jager_corrections(acm_file_path, poll_interval=0.05, idle_timeout=None):
+    """
+    Follow an ACM file while it is being acquired and correct the frames as they are appended.
+
+    Parameters:
+    acm_file_path (str): The path to the ACM file.
+    poll_interval (float, optional): The time in seconds to wait before checking the file again when no new frames
+    were appended.
+    idle_timeout (float, optional): Stop after this many seconds without new frames. By default the file is
+    followed until the caller stops iterating.
+
+    Yields:
+    tuple: The number of frames received so far and the PR and DPP corrected count sums of each detector
+    (2 x 1386), after every batch of newly appended frames.
+    """
+    with io_snc.AcmFollower(acm_file_path) as follower:
+        accumulator = JagerCorrectionAccumulator(follower.read_background_and_calibration(poll_interval,
+                                                                                          idle_timeout))
+        for _, counts_accumulated in follower.follow(poll_interval, idle_timeout):
+            accumulator.update(counts_accumulated)
+            yield accumulator.n_frames, accumulator.corrected_count_sums.copy()
 
-    return corrected_count_array
 
 def pulse_rate_correction(counts_accumulated_df, bkrnd_and_calibration_df, jager_pr_coefficients):
     """
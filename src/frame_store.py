@@ -0,0 +1,173 @@
+"""
+This module, `frame_store.py`, contains a compact store of per-frame detector values with lazy views in the
+SNC Patient array layout.
+
+The module includes the following classes:
+
+- `DetectorFrameStore`: Stores frames as (frames, 1386) detector values and materializes them in the 41x131 SNC
+  Patient layout only when indexed.
+
+This module is part of a larger project aimed at analyzing and correcting dose rate dependencies in ArcCheck measurements.
+
+"""
+
+import numpy as np
+
+import io_snc
+
+SNC_GRID_SHAPE = (41, 131)
+
+
+class DetectorFrameStore:
+    """
+    Stores per-frame detector values compactly and exposes them as the 3D array returned by `io_snc.detector_arrays`.
+
+    Parameters
+    ----------
+    detector_values : pandas.DataFrame or numpy.ndarray
+        The values of each frame (rows) and detector (columns), in acl detector order.
+
+    Notes
+    -----
+    Only 1386 of the 5371 cells of the 41x131 SNC Patient array hold a detector, so the store keeps the frames as a
+    (frames, 1386) array, about a quarter of the memory of the dense array. Indexing the store like the dense array,
+    e.g. `store[frame]`, `store[start:stop]` or `store[start:stop, row_0:row_1, col_0:col_1]`, materializes only the
+    requested frames and window, with zeros in the cells without a detector.
+    """
+
+    def __init__(self, detector_values):
+        self.detector_values = np.asarray(detector_values)[:, :io_snc.ACM_N_DIODES]
+
+    @property
+    def shape(self):
+        """tuple of int: The shape of the equivalent dense array, (frames, 41, 131)."""
+        return (len(self.detector_values),) + SNC_GRID_SHAPE
+
+    @property
+    def ndim(self):
+        """int: The number of dimensions of the equivalent dense array."""
+        return 3
+
+    @property
+    def dtype(self):
+        """numpy.dtype: The data type of the values."""
+        return self.detector_values.dtype
+
+    def __len__(self):
+        return len(self.detector_values)
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[:]
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def __getitem__(self, key):
+        """
+        Returns the frames and window selected by `key` in the SNC Patient layout.
+
+        Parameters
+        ----------
+        key : int, slice or tuple
+            The frames as an integer, slice or index array, optionally followed by the rows and columns of the
+            41x131 array as integers or slices, as for a numpy array.
+
+        Returns
+        -------
+        numpy.ndarray
+            The selected part of the dense array.
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 3:
+            raise IndexError(f"Too many indices: the store is 3-dimensional but {len(key)} were given.")
+        frame_key, row_key, col_key = key + (slice(None),) * (3 - len(key))
+        if not all(isinstance(k, (int, np.integer, slice)) for k in (row_key, col_key)):
+            raise TypeError("Rows and columns must be selected with integers or slices.")
+
+        values = self.detector_values[frame_key]
+        selected_rows = np.arange(SNC_GRID_SHAPE[0])[row_key]
+        selected_cols = np.arange(SNC_GRID_SHAPE[1])[col_key]
+
+        # Position of every grid row and column in the selection, -1 if not selected
+        row_positions = np.full(SNC_GRID_SHAPE[0], -1)
+        row_positions[selected_rows] = np.arange(np.size(selected_rows)).reshape(np.shape(selected_rows))
+        col_positions = np.full(SNC_GRID_SHAPE[1], -1)
+        col_positions[selected_cols] = np.arange(np.size(selected_cols)).reshape(np.shape(selected_cols))
+
+        rows, cols = io_snc.detector_grid_indices()
+        window_rows, window_cols = row_positions[rows], col_positions[cols]
+        inside = (window_rows >= 0) & (window_cols >= 0)
+
+        frames = np.atleast_2d(values)
+        window = np.zeros((len(frames), np.size(selected_rows), np.size(selected_cols)), dtype=frames.dtype)
+        window[:, window_rows[inside], window_cols[inside]] = frames[:, inside]
+
+        # Drop the dimensions that were selected with an integer
+        return window[(0 if values.ndim == 1 else slice(None),
+                       0 if np.ndim(selected_rows) == 0 else slice(None),
+                       0 if np.ndim(selected_cols) == 0 else slice(None))]
+
+    def frame(self, index):
+        """
+        Returns one frame in the SNC Patient layout.
+
+        Parameters
+        ----------
+        index : int
+            The frame index.
+
+        Returns
+        -------
+        numpy.ndarray
+            The 41x131 array of the frame.
+        """
+        return self[index]
+
+    def frames(self, start=None, stop=None, step=None):
+        """
+        Returns a range of frames in the SNC Patient layout.
+
+        Parameters
+        ----------
+        start, stop, step : int, optional
+            The frame range, as for a slice.
+
+        Returns
+        -------
+        numpy.ndarray
+            The (frames, 41, 131) array of the frames.
+        """
+        return self[start:stop:step]
+
+    def window(self, start_row, end_row, start_col, end_col, start=None, stop=None):
+        """
+        Returns a region of interest of a range of frames in the SNC Patient layout.
+
+        Parameters
+        ----------
+        start_row, end_row, start_col, end_col : int
+            The rows and columns of the region in the 41x131 array, end excluded.
+        start, stop : int, optional
+            The frame range. Defaults to all frames.
+
+        Returns
+        -------
+        numpy.ndarray
+            The (frames, end_row - start_row, end_col - start_col) array of the region.
+        """
+        return self[start:stop, start_row:end_row, start_col:end_col]
+
+    def subset(self, start=None, stop=None, step=None):
+        """
+        Returns a store of a range of frames without materializing them.
+
+        Parameters
+        ----------
+        start, stop, step : int, optional
+            The frame range, as for a slice.
+
+        Returns
+        -------
+        DetectorFrameStore
+            A store sharing the values of the selected frames.
+        """
+        return DetectorFrameStore(self.detector_values[start:stop:step])
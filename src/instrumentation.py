@@ -0,0 +1,332 @@
+"""
+This module, `instrumentation.py`, contains optional timing and memory instrumentation of the stages of the
+correction pipeline.
+
+The module includes the following functions:
+
+- `enable`: Starts recording the stages to a JSON-lines report.
+- `disable`: Stops recording.
+- `is_enabled`: Returns whether the stages are recorded.
+- `report_path`: Returns the path of the report.
+- `stage`: Returns a context manager recording one stage.
+- `current_file`: Returns a context manager attributing the stages run inside it to a measurement file.
+- `summarize_report`: Calculates the p50 and p95 of each stage of a report and appends them to it.
+- `format_summary`: Formats a report summary as a table.
+
+Each stage is written as one JSON line with the run, the measurement file, the stage name, the wall and CPU time, the
+resident memory (RSS) of the process at the end of the stage, the peak RSS of the process so far and the input sizes
+the stage reports, e.g.::
+
+    {"type": "stage", "run": "20240131T101500-4711", "file": "plan.acm", "stage": "read_acm", "wall_s": 0.21,
+     "cpu_s": 0.2, "rss_mb": 152.3, "peak_rss_mb": 180.4, "pid": 4711, "sizes": {"bytes": 10293402, "frames": 1000}}
+
+The peak RSS is the peak of the whole life of the process, so in a worker process that corrects several files it
+includes the peaks of the files before; the RSS at the end of each stage is its own. The memory is measured with
+`GetProcessMemoryInfo` on Windows and `getrusage` and `/proc/self/statm` elsewhere; on macOS only the peak is
+measured.
+
+When recording is disabled, `stage` returns a shared no-op context manager, so instrumented code costs a function
+call per stage. The report path and the run id are passed to worker processes in the `ARCCHECK_TIMING_REPORT` and
+`ARCCHECK_TIMING_RUN` environment variables, and every process appends whole lines, so the stages of parallel
+batches end up in the same report under the same run. `summarize_report` only summarizes the records of one run, so
+a report appended to by several runs, e.g. with the environment variable set for interactive runs, is summarized per
+run.
+
+This module is part of a larger project aimed at analyzing and correcting dose rate dependencies in ArcCheck measurements.
+
+"""
+
+import contextlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+if sys.platform == 'win32':
+    import ctypes
+    from ctypes import wintypes
+
+    class _ProcessMemoryCounters(ctypes.Structure):
+        """The PROCESS_MEMORY_COUNTERS structure filled by GetProcessMemoryInfo."""
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    _kernel32 = ctypes.WinDLL('kernel32')
+    _psapi = ctypes.WinDLL('psapi')
+    _kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    _psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(_ProcessMemoryCounters), wintypes.DWORD]
+    _psapi.GetProcessMemoryInfo.restype = wintypes.BOOL
+
+REPORT_ENV_VAR = 'ARCCHECK_TIMING_REPORT'
+RUN_ENV_VAR = 'ARCCHECK_TIMING_RUN'
+
+_report_path = None
+_run_id = None
+_current_file = None
+
+
+def _memory_mb():
+    """Returns the resident memory and the peak resident memory of the process so far in MB, each None if it cannot
+    be measured."""
+    if sys.platform == 'win32':
+        counters = _ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if not _psapi.GetProcessMemoryInfo(_kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return None, None
+        return counters.WorkingSetSize / 1e6, counters.PeakWorkingSetSize / 1e6
+    rss = None
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            rss = int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return rss, None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kibibytes elsewhere
+    return rss, peak / 1e6 if sys.platform == 'darwin' else peak * 1024 / 1e6
+
+
+def _write_record(record):
+    """Appends a record to the report as one line, written at once so that processes do not interleave."""
+    with open(_report_path, 'a') as file:
+        file.write(json.dumps(record) + '\n')
+
+
+class _NullStage:
+    """The context manager returned by `stage` while recording is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, **sizes):
+        """Ignores the sizes."""
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """Records the wall time, CPU time and peak memory of the code run inside it."""
+
+    def __init__(self, name, sizes):
+        self.name = name
+        self.sizes = sizes
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_s, cpu_s = time.perf_counter() - self._wall, time.process_time() - self._cpu
+        rss_mb, peak_rss_mb = _memory_mb()
+        record = {
+            'type': 'stage',
+            'run': _run_id,
+            'file': _current_file,
+            'stage': self.name,
+            'wall_s': wall_s,
+            'cpu_s': cpu_s,
+            'rss_mb': rss_mb,
+            'peak_rss_mb': peak_rss_mb,
+            'pid': os.getpid(),
+            'sizes': self.sizes,
+        }
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        _write_record(record)
+        return False
+
+    def add(self, **sizes):
+        """
+        Adds input sizes to the record of the stage.
+
+        Parameters
+        ----------
+        **sizes : int
+            The sizes, e.g. `frames=1000` or `bytes=10293402`.
+        """
+        self.sizes.update(sizes)
+
+
+def enable(report_path, truncate=True, run_id=None):
+    """
+    Starts recording the stages to a JSON-lines report.
+
+    Parameters
+    ----------
+    report_path : str
+        The path of the report.
+    truncate : bool, optional
+        Whether to start a new report instead of appending to an existing one.
+    run_id : str, optional
+        The run the records are tagged with. Defaults to a new run, named after the time and process id.
+    """
+    global _report_path, _run_id
+    _report_path = os.path.abspath(report_path)
+    _run_id = run_id or f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+    os.environ[REPORT_ENV_VAR] = _report_path
+    os.environ[RUN_ENV_VAR] = _run_id
+    if truncate:
+        open(_report_path, 'w').close()
+
+
+def disable():
+    """
+    Stops recording.
+    """
+    global _report_path, _run_id
+    _report_path = None
+    _run_id = None
+    os.environ.pop(REPORT_ENV_VAR, None)
+    os.environ.pop(RUN_ENV_VAR, None)
+
+
+def is_enabled():
+    """
+    Returns whether the stages are recorded.
+
+    Returns
+    -------
+    bool
+        True if recording is enabled.
+    """
+    return _report_path is not None
+
+
+def report_path():
+    """
+    Returns the path of the report.
+
+    Returns
+    -------
+    str or None
+        The absolute path of the report, or None if recording is disabled.
+    """
+    return _report_path
+
+
+def stage(name, **sizes):
+    """
+    Returns a context manager recording one stage.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage.
+    **sizes : int
+        The input sizes of the stage. More can be added with the `add` method of the returned context manager.
+
+    Returns
+    -------
+    context manager
+        Records the stage when it exits, if recording is enabled.
+    """
+    if _report_path is None:
+        return _NULL_STAGE
+    return _Stage(name, sizes)
+
+
+@contextlib.contextmanager
+def current_file(file):
+    """
+    Returns a context manager attributing the stages run inside it to a measurement file.
+
+    Parameters
+    ----------
+    file : str
+        The name of the measurement file.
+    """
+    global _current_file
+    previous_file, _current_file = _current_file, file
+    try:
+        yield
+    finally:
+        _current_file = previous_file
+
+
+def summarize_report(report_path, percentiles=(50, 95), run_id=None):
+    """
+    Calculates the percentiles of the wall time, CPU time and memory of each stage of one run of a report and
+    appends them to it.
+
+    Parameters
+    ----------
+    report_path : str
+        The path of the report.
+    percentiles : tuple of int, optional
+        The percentiles.
+    run_id : str, optional
+        The run whose records are summarized. Defaults to the current run if recording is enabled, and otherwise
+        to all records of the report.
+
+    Returns
+    -------
+    dict
+        For each stage, the number of records 'n' and the percentiles as e.g. 'wall_s_p50', in the order the stages
+        first appear in the report.
+    """
+    run_id = run_id or _run_id
+    records = {}
+    with open(report_path, 'r') as file:
+        for line in file:
+            record = json.loads(line)
+            if record.get('type') == 'stage' and (run_id is None or record.get('run') == run_id):
+                records.setdefault(record['stage'], []).append(record)
+
+    summary = {}
+    for stage_name, stage_records in records.items():
+        summary[stage_name] = {'n': len(stage_records)}
+        for key in ('wall_s', 'cpu_s', 'rss_mb', 'peak_rss_mb'):
+            values = [record[key] for record in stage_records if record.get(key) is not None]
+            for percentile in percentiles:
+                summary[stage_name][f"{key}_p{percentile}"] = (float(np.percentile(values, percentile))
+                                                               if values else None)
+
+    with open(report_path, 'a') as file:
+        file.write(json.dumps({'type': 'summary', 'run': run_id, 'stages': summary}) + '\n')
+    return summary
+
+
+def format_summary(summary):
+    """
+    Formats a report summary as a table.
+
+    Parameters
+    ----------
+    summary : dict
+        The summary returned by `summarize_report`.
+
+    Returns
+    -------
+    str
+        One line per stage with the number of records, the p50 and p95 wall time, the p95 of the memory at the end
+        of the stage and the p95 of the peak memory of the process.
+    """
+    lines = [f"{'stage':<24}{'n':>6}{'wall p50 s':>12}{'wall p95 s':>12}{'RSS p95 MB':>12}{'peak p95 MB':>13}"]
+    for stage_name, values in summary.items():
+        rss, peak_rss = values.get('rss_mb_p95'), values.get('peak_rss_mb_p95')
+        lines.append(f"{stage_name:<24}{values['n']:>6}{values['wall_s_p50']:>12.4f}{values['wall_s_p95']:>12.4f}"
+                     f"{rss if rss is not None else float('nan'):>12.1f}"
+                     f"{peak_rss if peak_rss is not None else float('nan'):>13.1f}")
+    return '\n'.join(lines)
+
+
+# Worker processes of an instrumented batch record to the same report under the same run, while a process started
+# with only the report path set, e.g. an interactive run, appends a new run
+if os.environ.get(REPORT_ENV_VAR):
+    enable(os.environ[REPORT_ENV_VAR], truncate=False, run_id=os.environ.get(RUN_ENV_VAR))
@@ -5,8 +5,19 @@ The module includes the following functions:
 
 - `parse_arccheck_header`: Parses the header information from an ArcCheck file and returns it as a dictionary.
 - `parse_arrays_from_file`: Parses the array data from an ArcCheck file and returns it as a dictionary.
+- `parse_snc_txt_file`: Parses the header and the array data from an ArcCheck file in a single pass.
+- `SncArrayBlock`: A numeric array block of an SNC txt file, with its values stored as floats.
+- `to_snc_array_block`: Converts an array block parsed by `parse_arrays_from_file` into an `SncArrayBlock`.
 - `write_snc_txt_file`: Writes the array data and header into a .txt file in the same format as it was read.
+- `format_numeric_block`: Formats a 2D array of numbers as tab-delimited text in a single formatting call.
+- `acm_frame_window`: Returns the frames of an ACM file selected by a frame window.
+- `acm_detector_columns`: Returns the diode columns of an ACM file holding a subset of the detectors.
 - `parse_acm_file`: Parses an ACM file and returns the frame data, diode data, and background and calibration data.
+- `parse_acm_background_and_calibration`: Parses the background and calibration data of an ACM file without reading its frames.
+- `iter_acm_data_blocks`: Parses the frames of an ACM file in blocks of a fixed number of frames.
+- `AcmFollower`: Reads the frames of an ACM file that is still being written, such as during an ArcCheck acquisition.
+- `detector_grid_indices`: Returns the position of each detector in the planar array displayed in SNC Patient.
+- `count_dtype`: Returns the data type accumulated counts are stored in at a requested precision.
 - `detector_arrays`: Rearranges the detector data from acl file into the one displayed in SNC Patient.
 - `diode_numbers_in_snc_array`: Reorganizes the detectors numbers in an acl measurement file into the planar array that is displayed in SNC Patient software.
 
@@ -14,9 +25,319 @@ This module is part of a larger project aimed at analyzing and correcting dose r
 
 """
 
+import functools
+import instrumentation
 import numpy as np
 import os
 import pandas as pd
+import time
+
+
+# The frame data columns of the 'Data:' rows of an ACM file, which are followed by the 1386 diode columns
+ACM_FRAME_DATA_KEYS = [
+    'UPDATE#', 'TIMETIC1', 'TIMETIC2', 'PULSES',
+    'STATUS1', 'STATUS2', 'VirtualInclinometer', 'CorrectedAngle', 'FieldSize', 'Reference Diode'
+]
+ACM_N_DIODES = 1386
+
+# The exact names of arrays expected in an SNC txt file
+SNC_ARRAY_NAMES = [
+    'Background', 'Calibration Factors', 'Offset', 'Raw Counts', 'Corrected Counts',
+    'Dose Counts', 'Data Flags', 'Interpolated', 'Dose Interpolated',
+    'Corrected Counts (No Angular Correction)'
+]
+
+
+def _empty_arccheck_header():
+    """Returns the header dictionary of an ArcCheck file with all predefined keys set to None."""
+    return {
+        'FileName': None, 'Firmware Version': None, 'Hardware Revision': None, 'Diode Type': None,
+        'Temperature': None, 'Inclinometer Tilt': None, 'Inclinometer Rotation': None,
+        'Background Threshold': None, 'Measured Cavity Dose': None, 'Date': None, 'Time': None,
+        'Serial No': None, 'Overrange Error': None, 'Cal File': None, 'Dose per Count': None,
+        'Dose Info': None, 'Dose IDDC': None, 'Time': None, 'Orientation': None, 'Rows': None,
+        'Cols': None, 'CAX X': None, 'CAX Y': None, 'Device Position QA': None, 'Shift X': None,
+        'Shift Y': None, 'Shift Z': None, 'Rotation X': None, 'Rotation Y': None, 'Rotation Z': None,
+        'Manufacturer': None, 'Energy': None, 'Plug Present': None, 'Applied Angular': None,
+        'Applied Field Size': None, 'Applied Heterogeneity': None,
+        'Full Header Text': ''
+    }
+
+
+def _parse_header_line(line, header_keys):
+    """
+    Updates the header dictionary with the key and value of a header line.
+
+    Returns
+    -------
+    bool
+        True if the line holds one of the predefined header keys.
+    """
+    key_value = line.split(':')
+    if len(key_value) == 2:
+        key, value = key_value[0].strip(), key_value[1].strip()
+        if key in header_keys:
+            header_keys[key] = value
+            return True
+    return False
+
+
+def _uniform_array(array_content):
+    """Converts the rows of an array block into an object array, padding short rows with None."""
+    if not array_content:
+        return np.empty((0, 0), dtype=object)
+    # Handle conversion by ensuring all rows are the same length
+    max_length = max(len(row) for row in array_content)
+    uniform_content = [row + [None] * (max_length - len(row)) for row in array_content]
+    return np.array(uniform_content, dtype=object)  # Use dtype=object for mixed types
+
+
+class SncArrayBlock:
+    """
+    A numeric array block of an SNC txt file, e.g. 'Corrected Counts', with its values stored as floats.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The value grid, 41 x 131 for an ArcCheck.
+    decimals : numpy.ndarray or int
+        The number of decimals each value is written with, or one number for all values.
+    row_labels : numpy.ndarray
+        The label columns in front of each value row (the Y coordinate and row number), as strings.
+    header_rows : list of list of str
+        The rows above the value grid.
+    footer_rows : list of list of str
+        The rows below the value grid, including the trailing blank row.
+
+    Notes
+    -----
+    The block holds the same content as the None-padded object array returned by `parse_arrays_from_file`, which is
+    `header_rows`, then one row of `row_labels` followed by `values` per grid row, then `footer_rows`. Because every
+    value keeps the number of decimals it was read with, writing the block reproduces the file it was read from.
+    """
+
+    def __init__(self, values, decimals, row_labels, header_rows, footer_rows):
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self.decimals = np.broadcast_to(np.asarray(decimals, dtype=np.int8), self.values.shape)
+        self.row_labels = np.asarray(row_labels, dtype=str)
+        self.header_rows = header_rows
+        self.footer_rows = footer_rows
+        self._grid_text = None
+
+    @property
+    def shape(self):
+        """tuple of int: The shape of the equivalent None-padded object array."""
+        n_rows = len(self.header_rows) + self.values.shape[0] + len(self.footer_rows)
+        return n_rows, self.row_labels.shape[1] + self.values.shape[1]
+
+    @property
+    def row_coordinates(self):
+        """numpy.ndarray: The coordinate of each grid row, from the first label column (cm)."""
+        return self.row_labels[:, 0].astype(float)
+
+    @property
+    def column_coordinates(self):
+        """numpy.ndarray or None: The coordinate of each grid column, from the 'Xcm' footer row (cm)."""
+        for row in self.footer_rows:
+            if row and row[0] == 'Xcm':
+                return np.array(row[1:], dtype=float)
+        return None
+
+    def with_values(self, values, decimals=15):
+        """
+        Returns a copy of the block with new values and the same positional data.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            The new value grid, with the shape of `values`.
+        decimals : numpy.ndarray or int, optional
+            The number of decimals the new values are written with.
+
+        Returns
+        -------
+        SncArrayBlock
+            The new block.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != self.values.shape:
+            raise ValueError(f"Shape mismatch: expected values of shape {self.values.shape}, got {values.shape}.")
+        return SncArrayBlock(values, decimals, self.row_labels, self.header_rows, self.footer_rows)
+
+    def text_rows(self):
+        """
+        Yields the rows of the block as lists of strings, in the order they appear in the file.
+
+        Yields
+        ------
+        list of str
+            The tokens of a row.
+        """
+        yield from self.header_rows
+        for line in self.grid_text().splitlines():
+            yield line.split('\t')
+        yield from self.footer_rows
+
+    def grid_text(self, decimals=None):
+        """
+        Returns the grid rows of the block as text, in the format written to SNC txt files.
+
+        Parameters
+        ----------
+        decimals : int, optional
+            The number of decimals of the values. Defaults to the decimals stored with the block.
+
+        Returns
+        -------
+        str
+            One tab-delimited line per grid row, starting with the row labels.
+
+        Notes
+        -----
+        The text for the stored decimals is kept, so blocks that are written several times, like the unchanged
+        blocks of each corrected variant of a measurement, are only formatted once. Assigning to `values` in place
+        does not reset it, use `with_values` to change the values.
+        """
+        if decimals is not None:
+            return format_numeric_block(self.values, decimals, self.row_labels)
+        if self._grid_text is None:
+            self._grid_text = format_numeric_block(self.values, self.decimals, self.row_labels)
+        return self._grid_text
+
+    def to_object_array(self):
+        """
+        Returns the block as the None-padded object array returned by `parse_arrays_from_file`.
+
+        Returns
+        -------
+        numpy.ndarray
+            The block as an object array of strings.
+        """
+        return _uniform_array([list(row) for row in self.text_rows()])
+
+
+def format_numeric_block(values, decimals, row_labels=None):
+    """
+    Formats a 2D array of numbers as tab-delimited text in a single formatting call.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The numbers to format.
+    decimals : numpy.ndarray or int
+        The number of decimals of each number, or one number for all of them.
+    row_labels : numpy.ndarray, optional
+        Strings written in front of the numbers of each row.
+
+    Returns
+    -------
+    str
+        One line per row, each terminated by a newline. Each number is written like '%.<decimals>f', so the output
+        is the same as formatting the numbers one by one.
+    """
+    values = np.atleast_2d(values)
+    decimals = np.broadcast_to(np.asarray(decimals, dtype=int), values.shape)
+    n_rows, n_columns = values.shape
+
+    # Build one format string for the whole block, with the labels as literal text
+    if (decimals == decimals.flat[0]).all():
+        value_formats = ['\t'.join([f"%.{decimals.flat[0]}f"] * n_columns)] * n_rows
+    else:
+        value_formats = ['\t'.join(f"%.{d}f" for d in row) for row in decimals.tolist()]
+    if row_labels is not None:
+        prefixes = ['\t'.join(labels).replace('%', '%%') + '\t' for labels in np.asarray(row_labels).tolist()]
+        value_formats = [prefix + value_format for prefix, value_format in zip(prefixes, value_formats)]
+    block_format = '\n'.join(value_formats) + '\n'
+
+    return block_format % tuple(values.ravel().tolist())
+
+
+def _format_text_row(row):
+    """Formats a row of tokens the way SNC txt files are written, or returns None for an empty row."""
+    # Only write the row if it contains any non-None values
+    if not any(x is not None for x in row):
+        return None
+    row_data = '\t'.join(str(x) for x in row if x is not None)
+    # Add a tab character before 'COL' and 'Xcm'
+    return row_data.replace('COL', '\tCOL').replace('Xcm', '\tXcm')
+
+
+def _fixed_point_decimals(tokens):
+    """
+    Returns the number of decimals of each token of a string array.
+
+    Parameters
+    ----------
+    tokens : numpy.ndarray
+        The numeric tokens.
+
+    Returns
+    -------
+    numpy.ndarray or None
+        The number of decimals of each token, or None if any token is not a plain fixed-point number of at most 15
+        digits, which are the numbers that '%.*f' formatting of their float value reproduces exactly.
+    """
+    unsigned = np.char.lstrip(tokens, '-')
+    digits = np.char.replace(unsigned, '.', '')
+    lengths = np.char.str_len(unsigned)
+    points = np.char.find(unsigned, '.')
+    n_digits = np.char.str_len(digits)
+
+    plain = (np.char.count(tokens, '-') <= 1) & (lengths - n_digits <= 1) & np.char.isdigit(digits)
+    plain &= (n_digits <= 15) & (points != 0) & (points != lengths - 1)
+    plain &= ~(np.char.startswith(unsigned, '0') & (lengths > 1) & (points != 1))  # No leading zeros
+    if not plain.all():
+        return None
+    return np.where(points < 0, 0, lengths - points - 1).astype(np.int8)
+
+
+def to_snc_array_block(array_content):
+    """
+    Converts an array block parsed by `parse_arrays_from_file` into an `SncArrayBlock`.
+
+    Parameters
+    ----------
+    array_content : numpy.ndarray
+        The None-padded object array of the block.
+
+    Returns
+    -------
+    SncArrayBlock or numpy.ndarray
+        The typed block, or `array_content` unchanged if its grid is not numeric or would not be written back
+        exactly as it was read.
+
+    Notes
+    -----
+    The grid consists of the longest rows of the block, the first two columns of which are row labels. The rows
+    above it become the header rows and the rows below it the footer rows.
+    """
+    rows = [[x for x in row if x is not None] for row in array_content]
+    lengths = [len(row) for row in rows]
+    if not rows or max(lengths) <= 2:
+        return array_content
+
+    n_columns = max(lengths)
+    first = lengths.index(n_columns)
+    last = first
+    while last < len(rows) and lengths[last] == n_columns:
+        last += 1
+    if n_columns in lengths[last:]:
+        return array_content  # The grid is not contiguous
+
+    grid_rows = rows[first:last]
+    tokens = np.array([row[2:] for row in grid_rows], dtype=str)
+    try:
+        values = tokens.astype(np.float64)
+    except ValueError:
+        return array_content
+
+    # Only convert the block if it will be written back exactly as it was read
+    decimals = _fixed_point_decimals(tokens)
+    if decimals is None:
+        return array_content
+    if (decimals == decimals.flat[0]).all():
+        decimals = decimals.flat[0]
+    return SncArrayBlock(values, decimals, [row[:2] for row in grid_rows], rows[:first], rows[last:])
 
 
 def parse_arccheck_header(file_path):
@@ -50,38 +371,20 @@ def parse_arccheck_header(file_path):
         print(f"Error: The file {file_path} does not exist.")
         return None
 
-    header_keys = {
-        'FileName': None, 'Firmware Version': None, 'Hardware Revision': None, 'Diode Type': None,
-        'Temperature': None, 'Inclinometer Tilt': None, 'Inclinometer Rotation': None,
-        'Background Threshold': None, 'Measured Cavity Dose': None, 'Date': None, 'Time': None,
-        'Serial No': None, 'Overrange Error': None, 'Cal File': None, 'Dose per Count': None,
-        'Dose Info': None, 'Dose IDDC': None, 'Time': None, 'Orientation': None, 'Rows': None,
-        'Cols': None, 'CAX X': None, 'CAX Y': None, 'Device Position QA': None, 'Shift X': None,
-        'Shift Y': None, 'Shift Z': None, 'Rotation X': None, 'Rotation Y': None, 'Rotation Z': None,
-        'Manufacturer': None, 'Energy': None, 'Plug Present': None, 'Applied Angular': None,
-        'Applied Field Size': None, 'Applied Heterogeneity': None,
-        'Full Header Text': ''
-    }
+    header_keys = _empty_arccheck_header()
 
     try:
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-
-        full_header_text = ""
+        header_lines = []
         found_header = False
-        for line in lines:
-            if line.strip() == "Background":  # Check for delimiter before appending to header text
-                break
-            full_header_text += line
-            key_value = line.split(':')
-            if len(key_value) == 2:
-                key, value = key_value[0].strip(), key_value[1].strip()
-                if key in header_keys:
-                    header_keys[key] = value
-                    found_header = True
+        with open(file_path, 'r') as file:
+            for line in file:
+                if line.strip() == "Background":  # Check for delimiter before appending to header text
+                    break
+                header_lines.append(line)
+                found_header = _parse_header_line(line, header_keys) or found_header
 
         # Strip the last newline character to clean up the header text
-        header_keys['Full Header Text'] = full_header_text.rstrip()
+        header_keys['Full Header Text'] = ''.join(header_lines).rstrip()
 
         if not found_header:
             print("Warning: No valid header information found.")
@@ -94,7 +397,7 @@ def parse_arccheck_header(file_path):
         return None
 
 
-def parse_arrays_from_file(file_path):
+def parse_arrays_from_file(file_path, typed=False):
     """
     Parses the array data from an ArcCheck file and returns it as a dictionary.
 
@@ -102,6 +405,8 @@ def parse_arrays_from_file(file_path):
     ----------
     file_path : str
         The path to the ArcCheck file.
+    typed : bool, optional
+        Whether to convert numeric arrays into `SncArrayBlock` objects instead of object arrays of strings.
 
     Returns
     -------
@@ -111,7 +416,7 @@ def parse_arrays_from_file(file_path):
     Notes
     -----
     The function reads the file line by line and splits each line at the space character to separate keys and values.
-    The keys are predefined in the `valid_arrays` list. If a key from the file matches a key in `valid_arrays`,
+    The keys are predefined in the `SNC_ARRAY_NAMES` list. If a key from the file matches a key in `SNC_ARRAY_NAMES`,
     the corresponding value is updated in the dictionary.
     """
     array_data = {}
@@ -119,59 +424,137 @@ def parse_arrays_from_file(file_path):
     array_content = []
 
     with open(file_path, 'r') as file:
-        lines = file.readlines()
-
-    # Define the exact names of arrays expected in the file
-    valid_arrays = [
-        'Background', 'Calibration Factors', 'Offset', 'Raw Counts', 'Corrected Counts',
-        'Dose Counts', 'Data Flags', 'Interpolated', 'Dose Interpolated',
-        'Corrected Counts (No Angular Correction)'
-    ]
-
-    for line in lines:
-        line = line.strip()
-        # Check if the line matches any of the valid array names exactly
-        if line in valid_arrays:
-            if current_array is not None:
-                # Handle conversion by ensuring all rows are the same length
-                max_length = max(len(row) for row in array_content)
-                uniform_content = [row + [None] * (max_length - len(row)) for row in array_content]
-                array_data[current_array] = np.array(uniform_content, dtype=object)  # Use dtype=object for mixed types
-            current_array = line
-            array_content = []
-        elif current_array is not None:  # Continue capturing data if we're within an array
-            parsed_line = line.split()
-            array_content.append(parsed_line)
+        for line in file:
+            line = line.strip()
+            # Check if the line matches any of the valid array names exactly
+            if line in SNC_ARRAY_NAMES:
+                if current_array is not None:
+                    array_data[current_array] = _uniform_array(array_content)
+                current_array = line
+                array_content = []
+            elif current_array is not None:  # Continue capturing data if we're within an array
+                parsed_line = line.split()
+                array_content.append(parsed_line)
 
     # Finalize the last array data capture
     if current_array is not None:
-        max_length = max(len(row) for row in array_content)
-        uniform_content = [row + [None] * (max_length - len(row)) for row in array_content]
-        array_data[current_array] = np.array(uniform_content, dtype=object)
+        array_data[current_array] = _uniform_array(array_content)
 
+    if typed:
+        array_data = {name: to_snc_array_block(content) for name, content in array_data.items()}
     return array_data
 
 
-def write_snc_txt_file(array_data, header_data, file_path):
+def parse_snc_txt_file(file_path, array_names=None, typed=False):
+    """
+    Parses the header and the array data from an ArcCheck file in a single pass.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the ArcCheck file.
+    array_names : list of str, optional
+        The arrays to parse, e.g. ['Corrected Counts', 'Raw Counts']. Defaults to all arrays in the file.
+    typed : bool, optional
+        Whether to convert numeric arrays into `SncArrayBlock` objects instead of object arrays of strings.
+
+    Returns
+    -------
+    tuple
+        The header dictionary, as returned by `parse_arccheck_header`, and the array dictionary, as returned by
+        `parse_arrays_from_file` but restricted to `array_names`.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the file does not exist.
+
+    Notes
+    -----
+    The file is read line by line once. Lines of arrays that were not requested are skipped without being split,
+    and reading stops as soon as all requested arrays have been captured.
+    """
+    wanted = set(SNC_ARRAY_NAMES if array_names is None else array_names)
+    header_keys = _empty_arccheck_header()
+    header_lines = []
+    found_header = False
+    in_header = True
+
+    array_data = {}
+    current_array = None
+    array_content = []
+
+    with open(file_path, 'r') as file:
+        for line in file:
+            stripped = line.strip()
+            if in_header:
+                if stripped not in SNC_ARRAY_NAMES:  # The header ends at the first array, normally 'Background'
+                    header_lines.append(line)
+                    found_header = _parse_header_line(line, header_keys) or found_header
+                    continue
+                in_header = False
+
+            if stripped in SNC_ARRAY_NAMES:
+                if current_array is not None:
+                    array_data[current_array] = _uniform_array(array_content)
+                if wanted.issubset(array_data):
+                    current_array = None
+                    break  # Everything requested has been captured
+                current_array = stripped if stripped in wanted else None
+                array_content = []
+            elif current_array is not None:
+                array_content.append(stripped.split())
+
+    # Finalize the last array data capture
+    if current_array is not None:
+        array_data[current_array] = _uniform_array(array_content)
+
+    if typed:
+        array_data = {name: to_snc_array_block(content) for name, content in array_data.items()}
+
+    # Strip the last newline character to clean up the header text
+    header_keys['Full Header Text'] = ''.join(header_lines).rstrip()
+    if not found_header:
+        print("Warning: No valid header information found.")
+    else:
+        print("Header information successfully parsed.")
+
+    return header_keys, array_data
+
+
+def write_snc_txt_file(array_data, header_data, file_path, decimals=None):
     """
     Writes the array data and header into a .txt file in the same format as it was read.
 
     Parameters
     ----------
     array_data : dict
-        Dictionary containing all the array data.
+        Dictionary containing all the array data, as object arrays or `SncArrayBlock` objects.
     header_data : dict
         Dictionary containing all the header information, including 'Full Header Text'.
     file_path : str
         Path to the file where the data should be saved.
+    decimals : int, optional
+        The number of decimals the values of `SncArrayBlock` objects are written with. Defaults to the number of
+        decimals stored with each block, which reproduces the file the block was read from.
+
+    Returns
+    -------
+    bool
+        True if the file was written, False if an error occurred, which is reported.
 
     Notes
     -----
     The function writes the full header text directly from the header_data dictionary.
-    Then it writes each array, skipping None values and using tabs as delimiter.
+    Then it writes each array, skipping None values and using tabs as delimiter. The value grid of an
+    `SncArrayBlock` is formatted in a single call and the text of each array is written to a buffered stream at once.
+    The text is written to a temporary file next to `file_path`, which replaces it only once it is complete, so a
+    failed write never leaves a partial file behind.
     """
+    temp_path = f"{file_path}.tmp-{os.getpid()}"
     try:
-        with open(file_path, 'w') as file:
+        with instrumentation.stage('write_snc_txt_file', arrays=len(array_data)) as write_stage, \
+                open(temp_path, 'w', buffering=1 << 20) as file:
             # Write the full header text directly from the header_data dictionary
             if 'Full Header Text' in header_data:
                 file.write(header_data['Full Header Text'])
@@ -179,21 +562,185 @@ def write_snc_txt_file(array_data, header_data, file_path):
 
             # Write each array, skipping None values and using tabs as delimiter
             for array_name, array_content in array_data.items():
-                file.write(f"{array_name}\n")
-                for row in array_content:
-                    # Only write the row if it contains any non-None values
-                    if any(x is not None for x in row):
-                        row_data = '\t'.join(str(x) for x in row if x is not None)
-                        # Add a tab character before 'COL' and 'Xcm'
-                        row_data = row_data.replace('COL', '\tCOL').replace('Xcm', '\tXcm')
-                        file.write(f"{row_data}\n")
-                file.write("\n")  # Separate arrays by a newline for clarity
+                if isinstance(array_content, SncArrayBlock):
+                    header_rows = [_format_text_row(row) for row in array_content.header_rows]
+                    footer_rows = [_format_text_row(row) for row in array_content.footer_rows]
+                    chunks = [f"{array_name}\n"]
+                    chunks += [f"{row}\n" for row in header_rows if row is not None]
+                    chunks.append(array_content.grid_text(decimals))
+                    chunks += [f"{row}\n" for row in footer_rows if row is not None]
+                else:
+                    rows = [_format_text_row(row) for row in array_content]
+                    chunks = [f"{array_name}\n"] + [f"{row}\n" for row in rows if row is not None]
+                chunks.append("\n")  # Separate arrays by a newline for clarity
+                file.write(''.join(chunks))
+
+            write_stage.add(bytes=file.tell())
+        os.replace(temp_path, file_path)
 
     except Exception as e:
         print(f"An error occurred while writing to file: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
 
+    return True
 
-def parse_acm_file(file_path):
+
+def _find_acm_background_line(lines):
+    """
+    Returns the index of the 'Background' row of an ACM file.
+
+    Parameters
+    ----------
+    lines : iterable of str
+        The lines of the ACM file, in order.
+
+    Returns
+    -------
+    int
+        The 0-based index of the 'Background' row. The data header is the line before it and the 'Calibration' row
+        the line after it.
+
+    Raises
+    ------
+    ValueError
+        If no 'Background' row is found.
+    """
+    for index, line in enumerate(lines):
+        if line.strip().split('\t')[0] == 'Background':
+            return index
+    raise ValueError("No 'Background' row found, the file does not look like an ACM measurement file.")
+
+
+def _read_acm_preamble(file):
+    """
+    Reads the lines of an open ACM file up to and including the 'Calibration' row.
+
+    Parameters
+    ----------
+    file : file object
+        The ACM file, opened in text mode and positioned at its start.
+
+    Returns
+    -------
+    tuple of str
+        The 'Background' and 'Calibration' rows. The file is left positioned at the first row after them.
+    """
+    preamble = []
+    for line in file:
+        preamble.append(line)
+        if line.strip().split('\t')[0] == 'Background':
+            break
+    background_index = _find_acm_background_line(preamble)
+    return preamble[background_index], next(file, '')
+
+
+def _bkrnd_and_calibration_df(background_line, calibration_line):
+    """Returns the DataFrame of the background and calibration values of each detector of an ACM file."""
+    background_data = background_line.strip().split('\t')[10:]  # Skip 'Background' line
+    calibration_data = calibration_line.strip().split('\t')[10:]  # Skip 'Calibration' line
+
+    # Create a DataFrame for Background and Calibration data
+    return pd.DataFrame({
+        'Detector Names': ['Reference Diode'] + [str(i) for i in range(1, ACM_N_DIODES + 1)],
+        'Background': background_data,
+        'Calibration': calibration_data
+    })
+
+
+def count_dtype(dtype, max_count):
+    """
+    Returns the data type accumulated counts are stored in at a requested precision.
+
+    Parameters
+    ----------
+    dtype : numpy.dtype or type
+        The requested floating point type, np.float64 or np.float32.
+    max_count : float
+        The largest accumulated count.
+
+    Returns
+    -------
+    numpy.dtype
+        `dtype` if it represents every integer up to `max_count` exactly, otherwise float64, with a warning. The
+        count rates of such counts can still be corrected in `dtype`, see `corrections.apply_jager_corrections`.
+
+    Raises
+    ------
+    ValueError
+        If `dtype` is not a floating point type.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind != 'f':
+        raise ValueError(f"Unsupported dtype '{dtype}', expected np.float64 or np.float32.")
+    # A float with an n-bit mantissa represents all integers up to 2 ** (n + 1) exactly
+    exact_limit = 2 ** (np.finfo(dtype).nmant + 1)
+    if max_count >= exact_limit:
+        if dtype != np.float64:
+            print(f"Warning: Accumulated counts up to {max_count:.0f} exceed {exact_limit}, the largest count {dtype} "
+                  f"represents exactly. Keeping the accumulated counts in float64.")
+        return np.dtype(np.float64)
+    return dtype
+
+
+def acm_frame_window(frames, n_frames):
+    """
+    Returns the frames of an ACM file selected by a frame window.
+
+    Parameters
+    ----------
+    frames : slice or callable or None
+        A slice of the frame indices, or a callable returning one from the number of frames, e.g.
+        `lambda n: slice(n // 2 - 50, n // 2 + 50)` for the middle 100 frames. None selects all frames.
+    n_frames : int
+        The number of frames of the ACM file.
+
+    Returns
+    -------
+    range
+        The 0-based indices of the selected frames.
+
+    Raises
+    ------
+    TypeError
+        If `frames` is not a slice, or the callable does not return one.
+    """
+    window = frames(n_frames) if callable(frames) else frames
+    if window is None:
+        window = slice(None)
+    if not isinstance(window, slice):
+        raise TypeError(f"The frame window must be a slice, got {type(window).__name__}.")
+    return range(n_frames)[window]
+
+
+def acm_detector_columns(detectors):
+    """
+    Returns the diode columns of an ACM file holding a subset of the detectors.
+
+    Parameters
+    ----------
+    detectors : iterable of int or str
+        The detector numbers, from 1 to 1386, e.g. the diode column names of `parse_acm_file`.
+
+    Returns
+    -------
+    list of int
+        The 0-based index of the diode column of each detector, in the given order.
+
+    Raises
+    ------
+    ValueError
+        If a detector number is out of range.
+    """
+    columns = [int(detector) - 1 for detector in detectors]
+    invalid = [column + 1 for column in columns if not 0 <= column < ACM_N_DIODES]
+    if invalid:
+        raise ValueError(f"Detector numbers must be between 1 and {ACM_N_DIODES}, got {invalid}.")
+    return columns
+
+
+def parse_acm_file(file_path, engine='c', dtype=np.float64, detectors=None, frames=None):
     """
     Parses an ACM file and returns the frame data, diode data, and background and calibration data.
 
@@ -201,73 +748,378 @@ def parse_acm_file(file_path):
     ----------
     file_path : str
         The path to the ACM file.
+    engine : {'c', 'python'}, optional
+        The parser used for the 'Data:' rows. 'c' (default) tokenizes all rows in bulk with the numpy C reader and
+        writes them into a preallocated float array. 'python' splits each row in Python and is kept as a reference.
+    dtype : numpy.dtype or type, optional
+        The type the diode counts are stored in, np.float64 (default) or np.float32, which halves the memory of the
+        diode data. The frame data is always float64. Accumulated counts of 2 ** 24 or more cannot be stored exactly
+        as float32 and are kept as float64, see `count_dtype`.
+    detectors : iterable of int or str, optional
+        The numbers of the detectors whose accumulated counts are returned, in this order. Defaults to all 1386.
+    frames : slice or callable, optional
+        The frames returned, as a slice of the frame indices or a callable returning one from the number of frames,
+        see `acm_frame_window`. Defaults to all frames.
 
     Returns
     -------
     tuple
         A tuple containing three pandas DataFrames: frame_data_df, diode_data_df, bkrnd_and_calibration_df.
 
+    Raises
+    ------
+    ValueError
+        If `engine` is unknown or the file has no 'Background' row.
+
     Notes
     -----
-    The function reads the file line by line and splits each line at the tab character to separate keys and values.
+    The data header is located by scanning for the 'Background' row that follows it instead of assuming it is on
+    line 77. The 'Calibration' row comes next and every later row starting with 'Data:' is a frame.
+
+    With the 'c' engine, only the rows in the frame window and the columns of the selected detectors are converted
+    to numbers. The selected frames keep their frame indices as the index of the DataFrames and the background and
+    calibration data always covers all detectors.
     """
-    frame_data_keys = [
-        'UPDATE#', 'TIMETIC1', 'TIMETIC2', 'PULSES',
-        'STATUS1', 'STATUS2', 'VirtualInclinometer', 'CorrectedAngle', 'FieldSize', 'Reference Diode'
-    ]
-    diode_data_keys = ['Reference Diode'] + [str(i) for i in range(1, 1387)]  # 1386 diodes
+    if engine not in ('c', 'python'):
+        raise ValueError(f"Unknown engine '{engine}', expected 'c' or 'python'.")
+    count_dtype(dtype, 0)
+    diode_columns = None if detectors is None else acm_detector_columns(detectors)
 
-    # Initialize storage for frame data and diode data
-    frame_data = []
-    diode_data = []
+    frame_data_keys = ACM_FRAME_DATA_KEYS
 
     with open(file_path, 'r') as file:
-        lines = file.readlines()
-
-    # Skip to line 77 where the data header starts
-    data_header_index = 76  # 0-based index for line 77
-    data_header = lines[data_header_index].strip().split('\t')
+        if engine == 'c':
+            # Only scan the preamble line by line, the data rows are left in the file for the bulk reader
+            background_line, calibration_line = _read_acm_preamble(file)
+            data_lines = [line for line in file if line.startswith('Data:\t')]
+        else:
+            lines = file.readlines()
+            background_index = _find_acm_background_line(lines)
+            background_line, calibration_line = lines[background_index:background_index + 2]
+            data_lines = lines[background_index + 2:]  # Skip 'Background' and 'Calibration' lines
 
     # Extract Background and Calibration data
-    background_data = lines[data_header_index + 1].strip().split('\t')[10:]  # Skip 'Background' line
-    calibration_data = lines[data_header_index + 2].strip().split('\t')[10:]  # Skip 'Calibration' line
+    bkrnd_and_calibration_df = _bkrnd_and_calibration_df(background_line, calibration_line)
+
+    window = None
+    if engine == 'c':
+        if frames is not None:
+            # Only the rows in the window are tokenized
+            window = acm_frame_window(frames, len(data_lines))
+            data_lines = [data_lines[index] for index in window]
+        frame_data, diode_data = _parse_acm_data_rows(data_lines, len(frame_data_keys), ACM_N_DIODES, dtype=dtype,
+                                                      diode_columns=diode_columns)
+    else:
+        frame_data = []
+        diode_data = []
+
+        # Process each line of data after the headers
+        for line in data_lines:
+            row_data = line.strip().split('\t')
+            if row_data[0] == 'Data:':  # Ensure we are reading a data line
+                # Split frame data and diode data based on the known structure
+                frame_row = row_data[1:len(frame_data_keys) + 1]
+                diode_row = row_data[len(frame_data_keys) + 1:]
+                frame_data.append(frame_row)
+                diode_data.append(diode_row)
+
+        # Convert lists to numpy arrays for easier manipulation later
+        frame_data = np.array(frame_data, dtype=float)
+        diode_data = np.array(diode_data, dtype=float)
+        if frames is not None:
+            window = acm_frame_window(frames, len(frame_data))
+            frame_data, diode_data = frame_data[window], diode_data[window]
+        if diode_columns is not None:
+            diode_data = diode_data[:, diode_columns]
+        diode_data = diode_data.astype(count_dtype(dtype, np.abs(diode_data).max(initial=0)), copy=False)
+
+    if diode_columns is None:
+        diode_data_keys = [str(i) for i in range(1, ACM_N_DIODES + 1)]
+    else:
+        diode_data_keys = [str(column + 1) for column in diode_columns]
+    index = None if window is None else pd.RangeIndex(window.start, window.stop, window.step)
+    frame_data_df = pd.DataFrame(frame_data, columns=frame_data_keys, index=index)
+    diode_data_df = pd.DataFrame(diode_data, columns=diode_data_keys, index=index)
+
+    return frame_data_df, diode_data_df, bkrnd_and_calibration_df
 
-    # Create a DataFrame for Background and Calibration data
-    bkrnd_and_calibration_df = pd.DataFrame({
-        'Detector Names': diode_data_keys,
-        'Background': background_data,
-        'Calibration': calibration_data
-    })
 
-    # Process each line of data after the headers
-    for line in lines[data_header_index + 3:]:  # Skip 'Background' and 'Calibration' lines
-        row_data = line.strip().split('\t')
-        if row_data[0] == 'Data:':  # Ensure we are reading a data line
-            # Split frame data and diode data based on the known structure
-            frame_row = row_data[1:len(frame_data_keys) + 1]
-            diode_row = row_data[len(frame_data_keys) + 1:]
-            frame_data.append(frame_row)
-            diode_data.append(diode_row)
+def parse_acm_background_and_calibration(file_path):
+    """
+    Parses the background and calibration data of an ACM file without reading its frames.
 
-    # Convert lists to numpy arrays for easier manipulation later
-    frame_data = np.array(frame_data, dtype=float)
-    diode_data = np.array(diode_data, dtype=float)
+    Parameters
+    ----------
+    file_path : str
+        The path to the ACM file.
 
-    diode_data_keys = [str(i) for i in range(1, 1387)]  # getting rid of the reference diodo key
-    frame_data_df = pd.DataFrame(frame_data, columns=frame_data_keys)
-    diode_data_df = pd.DataFrame(diode_data, columns=diode_data_keys)
+    Returns
+    -------
+    pandas.DataFrame
+        The bkrnd_and_calibration_df returned by `parse_acm_file`.
+    """
+    with open(file_path, 'r') as file:
+        background_line, calibration_line = _read_acm_preamble(file)
+    return _bkrnd_and_calibration_df(background_line, calibration_line)
 
-    return frame_data_df, diode_data_df, bkrnd_and_calibration_df
+
+def iter_acm_data_blocks(file_path, block_size=1024):
+    """
+    Parses the frames of an ACM file in blocks of a fixed number of frames.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the ACM file.
+    block_size : int, optional
+        The number of frames per block. The last block may be shorter.
+
+    Yields
+    ------
+    tuple of numpy.ndarray
+        The frame data (frames x 10) and the accumulated diode counts (frames x 1386) of a block, with the columns
+        of the frame_data_df and diode_data_df returned by `parse_acm_file`.
+
+    Notes
+    -----
+    Only one block of rows is held in memory at a time, so the memory used does not depend on the recording length.
+    """
+    with open(file_path, 'r') as file:
+        _read_acm_preamble(file)
+        data_lines = []
+        for line in file:
+            if line.startswith('Data:\t'):
+                data_lines.append(line)
+                if len(data_lines) == block_size:
+                    yield _parse_acm_data_rows(data_lines, len(ACM_FRAME_DATA_KEYS), ACM_N_DIODES)
+                    data_lines = []
+        if data_lines:
+            yield _parse_acm_data_rows(data_lines, len(ACM_FRAME_DATA_KEYS), ACM_N_DIODES)
+
+
+class AcmFollower:
+    """
+    Reads the frames of an ACM file that is still being written, such as during an ArcCheck acquisition.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the ACM file.
+
+    Notes
+    -----
+    The file is kept open and each read continues where the previous one stopped, so only newly appended rows are
+    parsed. A row is only parsed once its line ending has been written. Use the follower as a context manager or
+    call `close` when done.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = open(file_path, 'r')
+        self._partial_line = ''
+        self._lines = []
+        self._preamble_read = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the ACM file."""
+        self._file.close()
+
+    def _read_lines(self):
+        """Adds the complete lines appended since the last read to the line queue and returns how many there were."""
+        text = self._partial_line + self._file.read()
+        lines = text.splitlines(keepends=True)
+        if lines and not lines[-1].endswith('\n'):
+            self._partial_line = lines.pop()
+        else:
+            self._partial_line = ''
+        self._lines.extend(lines)
+        return len(lines)
+
+    def _wait(self, poll_interval, idle_timeout, idle_since):
+        """Sleeps for one poll interval, returns False instead if the idle timeout has passed."""
+        if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+            return False
+        time.sleep(poll_interval)
+        return True
+
+    def read_background_and_calibration(self, poll_interval=0.05, idle_timeout=None):
+        """
+        Waits until the 'Background' and 'Calibration' rows have been written and parses them.
+
+        Parameters
+        ----------
+        poll_interval : float, optional
+            The time in seconds between checks of the file.
+        idle_timeout : float, optional
+            Give up after this many seconds without new lines. By default waits indefinitely.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The bkrnd_and_calibration_df returned by `parse_acm_file`.
+
+        Raises
+        ------
+        TimeoutError
+            If the rows have not been written within `idle_timeout`.
+        """
+        idle_since = time.monotonic()
+        while True:
+            if self._read_lines():
+                idle_since = time.monotonic()
+            background_index = next((index for index, line in enumerate(self._lines)
+                                     if line.strip().split('\t')[0] == 'Background'), None)
+            if background_index is not None and len(self._lines) > background_index + 1:
+                background_line, calibration_line = self._lines[background_index:background_index + 2]
+                del self._lines[:background_index + 2]
+                self._preamble_read = True
+                return _bkrnd_and_calibration_df(background_line, calibration_line)
+            if not self._wait(poll_interval, idle_timeout, idle_since):
+                raise TimeoutError(f"No 'Background' and 'Calibration' rows were written to {self.file_path}.")
+
+    def read_new_frames(self):
+        """
+        Parses the frames appended since the last read.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            The frame data (frames x 10) and accumulated diode counts (frames x 1386) of the new frames, which may be
+            empty.
+        """
+        if not self._preamble_read:
+            raise RuntimeError("read_background_and_calibration must be called before reading frames.")
+        self._read_lines()
+        data_lines = [line for line in self._lines if line.startswith('Data:\t')]
+        self._lines = []
+        return _parse_acm_data_rows(data_lines, len(ACM_FRAME_DATA_KEYS), ACM_N_DIODES)
+
+    def follow(self, poll_interval=0.05, idle_timeout=None):
+        """
+        Yields the frames of the file as they are appended.
+
+        Parameters
+        ----------
+        poll_interval : float, optional
+            The time in seconds to wait before checking the file again when no new frames were appended.
+        idle_timeout : float, optional
+            Stop after this many seconds without new frames. By default follows the file indefinitely.
+
+        Yields
+        ------
+        tuple of numpy.ndarray
+            The frame data and accumulated diode counts of each batch of newly appended frames.
+        """
+        idle_since = time.monotonic()
+        while True:
+            frame_data, diode_data = self.read_new_frames()
+            if len(diode_data):
+                idle_since = time.monotonic()
+                yield frame_data, diode_data
+            elif not self._wait(poll_interval, idle_timeout, idle_since):
+                return
+
+
+def _parse_acm_data_rows(data_lines, n_frame_columns, n_diodes, chunk_size=1024, dtype=np.float64,
+                         diode_columns=None):
+    """
+    Tokenizes the 'Data:' rows of an ACM file in bulk with the numpy C reader.
+
+    Parameters
+    ----------
+    data_lines : list of str
+        The raw 'Data:' rows.
+    n_frame_columns : int
+        The number of frame data columns following the 'Data:' label.
+    n_diodes : int
+        The number of diode columns following the frame data columns.
+    chunk_size : int, optional
+        The number of rows tokenized per call of the C reader.
+    dtype : numpy.dtype or type, optional
+        The type of the diode data, see `parse_acm_file`.
+    diode_columns : list of int, optional
+        The 0-based indices of the diode columns to convert. Defaults to all; the other columns are not converted.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The frame data (frames x `n_frame_columns`) and diode data (frames x diodes). In float64 they are views of
+        one preallocated array, otherwise the diode data is a separate array, converted chunk by chunk.
+    """
+    if diode_columns is None:
+        usecols = range(1, n_frame_columns + n_diodes + 1)
+    else:
+        usecols = list(range(1, n_frame_columns + 1)) + [n_frame_columns + 1 + column for column in diode_columns]
+    n_columns = len(usecols)
+    if np.dtype(dtype) == np.float64:
+        values = np.empty((len(data_lines), n_columns), dtype=np.float64)
+
+        for start in range(0, len(data_lines), chunk_size):
+            values[start:start + chunk_size] = np.loadtxt(data_lines[start:start + chunk_size], delimiter='\t',
+                                                          usecols=usecols, dtype=np.float64, ndmin=2)
+
+        return values[:, :n_frame_columns], values[:, n_frame_columns:]
+
+    frame_data = np.empty((len(data_lines), n_frame_columns), dtype=np.float64)
+    diode_data = np.empty((len(data_lines), n_columns - n_frame_columns), dtype=dtype)
+
+    for start in range(0, len(data_lines), chunk_size):
+        chunk = np.loadtxt(data_lines[start:start + chunk_size], delimiter='\t', usecols=usecols, dtype=np.float64,
+                           ndmin=2)
+        diode_chunk = chunk[:, n_frame_columns:]
+        chunk_dtype = count_dtype(diode_data.dtype, np.abs(diode_chunk).max(initial=0))
+        if chunk_dtype != diode_data.dtype:
+            # The earlier chunks are exact and converted back without loss, the rows after them are not filled yet
+            wider_diode_data = np.empty(diode_data.shape, dtype=chunk_dtype)
+            wider_diode_data[:start] = diode_data[:start]
+            diode_data = wider_diode_data
+        frame_data[start:start + chunk_size] = chunk[:, :n_frame_columns]
+        diode_data[start:start + chunk_size] = diode_chunk
+
+    return frame_data, diode_data
+
+
+@functools.lru_cache(maxsize=None)
+def detector_grid_indices():
+    """
+    Returns the position of each detector in the planar array that is displayed in SNC Patient software.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The row and column indices in the 41x131 array of detectors 1 to 1386, in order.
+
+    Notes
+    -----
+    Detector 1 is in the bottom left corner. The detectors fill every second column of every second row from left
+    to right and from the bottom row upwards. The mapping is computed once and the returned arrays are read-only.
+    """
+    numbers = np.arange(ACM_N_DIODES)
+    rows = 40 - 2 * (numbers // 66)  # Start from the last row, move upwards in steps of 2
+    cols = 2 * (numbers % 66)  # Start from the first column, move right in steps of 2
+    rows.flags.writeable = False
+    cols.flags.writeable = False
+    return rows, cols
 
 
-def detector_arrays(acl_detectors):
+def detector_arrays(acl_detectors, out=None):
     """
     Rearranges the detector data from acl file into the one displayed in SNC Patient.
 
     Parameters
     ----------
-    acl_detectors : pandas.DataFrame
-        The measurement data arranged in acl formal.
+    acl_detectors : pandas.DataFrame or numpy.ndarray
+        The measurement data arranged in acl formal, one row per frame and one column per detector.
+    out : numpy.ndarray, optional
+        A preallocated (frames, 41, 131) array to write the result to. Defaults to a new float32 array for float32
+        data and a float64 array otherwise. Only the detector positions are written, the other cells are left as they
+        are, so a buffer created with np.zeros can be reused for every call.
 
     Returns
     -------
@@ -276,28 +1128,20 @@ def detector_arrays(acl_detectors):
 
     Notes
     -----
-    The function initializes a 3D numpy array with zeros and fills it with the detector data.
-    """
-    # Initialize a 3D numpy array with zeros
-    arrays = np.zeros((len(acl_detectors), 41, 131))
-
-    for row_index in range(len(acl_detectors)):
-        # Extract the counts for the current row
-        current_row_counts = acl_detectors.iloc[row_index].values
-
-        # Initialize the detector number to match the DataFrame's column indexing
-        number = 1
-        for row in range(40, -1, -2):  # Start from the last row, move upwards in steps of 2
-            for col in range(0, 131, 2):  # Start from the first column, move right in steps of 2
-                if number <= 1386:
-                    # Assign the count value corresponding to the detector number
-                    arrays[row_index, row, col] = current_row_counts[
-                        number - 1]  # Adjust for 0-based indexing in the array
-                    number += 1
-                else:
-                    break  # Stop if the number exceeds 1386
+    All frames are scattered into the array with a single fancy-indexing assignment using the cached detector
+    positions of `detector_grid_indices`.
+    """
+    values = np.asarray(acl_detectors)[:, :ACM_N_DIODES]
+    if out is None:
+        # Initialize a 3D numpy array with zeros, in float32 for float32 values and otherwise in float64
+        out = np.zeros((len(values), 41, 131), dtype=np.float32 if values.dtype == np.float32 else np.float64)
+    elif out.shape != (len(values), 41, 131):
+        raise ValueError(f"Shape mismatch: out must have shape {(len(values), 41, 131)}, got {out.shape}.")
 
-    return arrays
+    rows, cols = detector_grid_indices()
+    out[:, rows, cols] = values
+
+    return out
 
 
 def diode_numbers_in_snc_array():
@@ -314,24 +1158,11 @@ def diode_numbers_in_snc_array():
     -----
     The function creates an initial array of size 41x131 filled with zeros and fills every second row and column with detector numbers.
     """
-    # Step 1: Read the acl file and extract the detector numbers
-    # This step is dependent on the format of the acl file and is not shown here
-
-    # Step 2: Create an initial array of size 41x131 filled with zeros
-    array = np.zeros((41, 131))
+    # Create an initial array of size 41x131 filled with zeros
+    array = np.zeros((41, 131), dtype=int)
 
-    # Step 3: Fill every second row and column with detector numbers
-    # Starting from the bottom left corner (which in array indexing is the last row, first column)
-    number = 1
-    for row in range(40, -1, -2):  # Start from the last row, move upwards in steps of 2
-        for col in range(0, 131, 2):  # Start from the first column, move right in steps of 2
-            if number <= 1386:
-                array[row, col] = number
-                number += 1
-            else:
-                break  # Stop if the number exceeds 1386
+    # Fill every second row and column with detector numbers, starting from the bottom left corner
+    rows, cols = detector_grid_indices()
+    array[rows, cols] = np.arange(1, ACM_N_DIODES + 1)
 
-    array = array.astype(int)
     return array
-
-
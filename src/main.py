@@ -9,17 +9,41 @@ Functions:
 - calculate_dose_values: Calculates dose values and dose rate values.
 - snc_format_array: Formats the array to be compatible with the SNC measured txt file.
 - get_user_input: Gets user input for batch folder path and correction type.
-- main: Main function to process ACM files and apply corrections.
+- load_folder_correction_models: Loads the correction models of a batch folder.
+- corrected_file_path: Gets the path of the corrected TXT file of a measurement.
+- duplicate_output_paths: Gets the corrected file paths that several measurements would be written to.
+- process_file: Processes one ACM file and writes the corrected TXT file.
+- process_pairs: Processes ACM and TXT file pairs, optionally in parallel worker processes.
+- batch_folder_pairs: Gets the ACM and TXT file pairs of a batch folder.
+- process_batch: Processes all ACM files of a batch folder, optionally in parallel worker processes.
+- read_manifest: Reads the ACM and TXT file pairs listed in a manifest file.
+- select_file_pairs: Gets the file pairs selected by folders, glob patterns, ACM files and manifests.
+- print_timing_summary: Summarizes and prints the stage timings of the run, if recorded.
+- parse_arguments: Parses the command line arguments.
+- main: Main function to process ACM files and apply corrections, from the command line or interactively.
 """
 
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import glob
+import io
 import os
+import sys
 import numpy as np
+import acm_cache
+import correction_models
+import instrumentation
 import io_snc
 import plots
+import run_manifest
 from corrections import apply_jager_corrections, get_intrinsic_corrections
+from frame_store import DetectorFrameStore
 
 
-def apply_corrections(counts_accumulated_df, bkrnd_and_calibration_df, include_intrinsic_corrections, array_data):
+def apply_corrections(counts_accumulated_df, bkrnd_and_calibration_df, include_intrinsic_corrections, array_data,
+                      header_data=None, registry=None, dtype=None):
     """
     Apply corrections based on user input.
 
@@ -33,24 +57,45 @@ def apply_corrections(counts_accumulated_df, bkrnd_and_calibration_df, include_i
         Whether to include intrinsic corrections ('y' or 'n').
     array_data : numpy.ndarray
         Array data.
+    header_data : dict, optional
+        Header data of the SNC txt file, used to select the correction models by 'Serial No' and 'Energy'.
+        Defaults to the Jager coefficients.
+    registry : correction_models.CorrectionModelRegistry, optional
+        The correction models to select from. Defaults to `correction_models.default_registry()`.
+    dtype : numpy.dtype or type, optional
+        The precision of the count rates and corrections, np.float64 or np.float32. Defaults to the precision of the
+        accumulated counts, see `corrections.apply_jager_corrections`.
 
     Returns
     -------
     numpy.ndarray
-        Corrected count array.
+        Corrected count array, the PR and then the DPP corrected counts.
+
+    Notes
+    -----
+    Accumulated counts too large for float32 are kept in float64 by `io_snc.parse_acm_file`, but with
+    `dtype=np.float32` their count rates are still corrected in float32.
     """
     if include_intrinsic_corrections == 'y':
-        intrinsic_corrections = get_intrinsic_corrections(array_data)
+        with instrumentation.stage('intrinsic_corrections'):
+            intrinsic_corrections = get_intrinsic_corrections(array_data)
     else:
         intrinsic_corrections = None
 
-    corrected_count_array = apply_jager_corrections(counts_accumulated_df, bkrnd_and_calibration_df,
-                                                    intrinsic_corrections)
+    registry = correction_models.default_registry() if registry is None else registry
+    header_data = {} if header_data is None else header_data
+    coefficients = [registry.select(header_data, correction_type).coefficients
+                    for correction_type in correction_models.CORRECTION_TYPES]
+
+    with instrumentation.stage('jager_corrections', frames=len(counts_accumulated_df),
+                               detectors=counts_accumulated_df.shape[1], models=len(coefficients)):
+        corrected_count_array = apply_jager_corrections(counts_accumulated_df, bkrnd_and_calibration_df,
+                                                        intrinsic_corrections, coefficients, dtype=dtype)
 
     return corrected_count_array
 
 
-def read_files(acml_path, txt_path):
+def read_files(acml_path, txt_path, use_cache=True, cache_dir=None, dtype=np.float64):
     """
     Read and parse ACM and TXT files.
 
@@ -60,25 +105,39 @@ def read_files(acml_path, txt_path):
         Path to the ACM file.
     txt_path : str
         Path to the TXT file.
+    use_cache : bool, optional
+        Whether to load the ACM file through the binary cache of `acm_cache` instead of parsing its text.
+    cache_dir : str, optional
+        The cache directory. Defaults to a `.acm_cache` folder next to the ACM file.
+    dtype : numpy.dtype or type, optional
+        The type of the accumulated counts, np.float64 (default) or np.float32, see `io_snc.parse_acm_file`.
 
     Returns
     -------
     tuple
         DataFrames and arrays with parsed data.
     """
-    frame_data_df, counts_accumulated_df, bkrnd_and_calibration_df = io_snc.parse_acm_file(acml_path)
-    header_data = io_snc.parse_arccheck_header(txt_path)
-    array_data = io_snc.parse_arrays_from_file(txt_path)
+    with instrumentation.stage('read_acm', cached=use_cache, bytes=os.path.getsize(acml_path)) as read_stage:
+        if use_cache:
+            frame_data_df, counts_accumulated_df, bkrnd_and_calibration_df = acm_cache.load_acm_file(acml_path,
+                                                                                                   cache_dir, dtype)
+        else:
+            frame_data_df, counts_accumulated_df, bkrnd_and_calibration_df = io_snc.parse_acm_file(acml_path,
+                                                                                                   dtype=dtype)
+        read_stage.add(frames=len(counts_accumulated_df), dtype=str(counts_accumulated_df.to_numpy().dtype))
+    with instrumentation.stage('read_txt', bytes=os.path.getsize(txt_path)):
+        header_data, array_data = io_snc.parse_snc_txt_file(txt_path, typed=True)
     return frame_data_df, counts_accumulated_df, bkrnd_and_calibration_df, header_data, array_data
 
 
-def generate_plots(dose_rate_arrays, dose_df, dose_rate_df, dose_accumulated_df, startframe, endframe, detector_number):
+def generate_plots(dose_rate_arrays, dose_df, dose_rate_df, dose_accumulated_df, startframe, endframe, detector_number,
+                   quick_look=False, frames_per_projection=100, animation_step=10):
     """
     Generate plots and animations.
 
     Parameters
     ----------
-    dose_rate_arrays : numpy.ndarray
+    dose_rate_arrays : numpy.ndarray or frame_store.DetectorFrameStore
         Dose rate arrays.
     dose_df : pandas.DataFrame
         DataFrame with dose data.
@@ -92,6 +151,15 @@ def generate_plots(dose_rate_arrays, dose_df, dose_rate_df, dose_accumulated_df,
         Ending frame.
     detector_number : int
         Detector number.
+    quick_look : bool, optional
+        Instead of animating all frames of the whole array, only animate the frames between `startframe` and
+        `endframe` in the 31x15 window around `detector_number`, and save static images of the maximum dose rate of
+        each detector over the whole delivery and of the maximum and mean dose rate of every
+        `frames_per_projection` frames in the window.
+    frames_per_projection : int, optional
+        The number of frames of each projection in quick look mode.
+    animation_step : int, optional
+        Animate every `animation_step`-th frame of the window in quick look mode.
     """
     xn, yn = 31, 15
     diode_numbers_in_snc_array = io_snc.diode_numbers_in_snc_array()
@@ -113,10 +181,32 @@ def generate_plots(dose_rate_arrays, dose_df, dose_rate_df, dose_accumulated_df,
     selected_X = X[start_col:end_col]
     selected_Y = Y[start_row:end_row]
 
+    if quick_look:
+        plots.plot_dose_rate_map(plots.frame_projections(dose_rate_arrays, len(dose_rate_arrays))[0],
+                                 'Maximum dose rate (cGy/min)', f'max_dose_rate_detector_{detector_number}.png')
+        extent = (selected_X[0], selected_X[-1], selected_Y[-1], selected_Y[0])
+        stop_frame = startframe + len(selected_dose_rate_arrays)
+        first_frames = range(startframe, stop_frame, frames_per_projection)
+        for statistic in ('max', 'mean'):
+            projections = plots.frame_projections(selected_dose_rate_arrays, frames_per_projection, statistic)
+            titles = [f"{statistic.capitalize()} {frame * plots.FRAME_INTERVAL_MS}-"
+                      f"{min(frame + frames_per_projection, stop_frame) * plots.FRAME_INTERVAL_MS} ms"
+                      for frame in first_frames]
+            plots.plot_projection_sheet(projections, titles, f'dose_rate_{statistic}_per_{frames_per_projection}'
+                                                             f'_frames_{xn}x{yn}_detector_{detector_number}.png')
+        plots.plot_dose_rate_map(plots.frame_projections(selected_dose_rate_arrays, len(selected_dose_rate_arrays))[0],
+                                 f'Maximum dose rate (cGy/min), frames {startframe}-{stop_frame}',
+                                 f'max_dose_rate_{xn}x{yn}_detector_{detector_number}.png', extent=extent)
+        # The window needs little resolution, which keeps the animation to a fraction of a second
+        plots.create_animation(selected_dose_rate_arrays, xn, yn, detector_number, step=animation_step, dpi=40,
+                               extent=extent, frame_offset=startframe)
+        return
+
     plots.create_animation(dose_rate_arrays, xn, yn, detector_number)
     plots.scatter_cumulative_dose(dose_rate_df[startframe:endframe], dose_accumulated_df[startframe:endframe],
                                   detector_number)
-    plots.bar_doserate_histogram(dose_df, dose_rate_df, [630, 610, 590, 570, 550])
+    spectrum = plots.dose_rate_spectrum(dose_df, dose_rate_df)
+    plots.bar_doserate_histogram(dose_df, dose_rate_df, [630, 610, 590, 570, 550], spectrum=spectrum)
 
 
 def calculate_dose_values(counts_accumulated_df, dose_per_count):
@@ -133,7 +223,8 @@ def calculate_dose_values(counts_accumulated_df, dose_per_count):
     Returns
     -------
     tuple
-        DataFrames with dose values and dose rate values.
+        DataFrames with dose values and dose rate values, and the dose rate values in the SNC Patient layout as a
+        frame_store.DetectorFrameStore.
     """
 
     dose_accumulated_df = counts_accumulated_df * dose_per_count  # cGy
@@ -148,14 +239,14 @@ def calculate_dose_values(counts_accumulated_df, dose_per_count):
     time_interval = 50 / 60000  # in minutes
     dose_rate_df = dose_df / time_interval  # cGy/min
 
-    # Create a ndarray of detector arrays arranged in the SNC Patient display configuration
-    # Each array represents a frame of the detector array at a specific time point
-    dose_rate_arrays = io_snc.detector_arrays(dose_rate_df)
+    # Create a store of detector arrays arranged in the SNC Patient display configuration
+    # Each array represents a frame of the detector array at a specific time point and is materialized when indexed
+    dose_rate_arrays = DetectorFrameStore(dose_rate_df)
 
     return dose_df, dose_accumulated_df, dose_rate_df, dose_rate_arrays
 
 
-def snc_format_array(corrected_count_array, formatted_counts):
+def snc_format_array(corrected_count_array, formatted_counts, decimals=15):
     """
     Formats the array to be compatible with the SNC measured txt file.
 
@@ -163,16 +254,22 @@ def snc_format_array(corrected_count_array, formatted_counts):
     ----------
     corrected_count_array : numpy.ndarray
         The array containing corrected dose values.
-    formatted_counts : numpy.ndarray
+    formatted_counts : numpy.ndarray or io_snc.SncArrayBlock
         The array containing the counts with positional data directly from measured file.
+    decimals : int, optional
+        The number of decimals the corrected values are written with. The default of 15 gives 16 digits.
 
     Returns
     -------
-    numpy.ndarray
+    numpy.ndarray or io_snc.SncArrayBlock
         Corrected values in format ready for insertion into SNC txt file.
     """
-    # Convert corrected_array values to strings with 16 digits
-    corrected_array_str = np.array([["{:.15f}".format(value) for value in row] for row in corrected_count_array])
+    if isinstance(formatted_counts, io_snc.SncArrayBlock):
+        return formatted_counts.with_values(corrected_count_array, decimals=decimals)
+
+    # Convert corrected_array values to strings in one formatting call
+    corrected_text = io_snc.format_numeric_block(corrected_count_array, decimals)
+    corrected_array_str = np.array([line.split('\t') for line in corrected_text.splitlines()])
 
     # Insert corrected_dose_array_str into new_dose_counts while preserving positional data
     formatted_counts[1:42, 2:133] = corrected_array_str
@@ -202,58 +299,527 @@ def get_user_input():
     return batch_folder_path, correction_type, include_intrinsic_corrections
 
 
-def main():
+def load_folder_correction_models(folder_path):
     """
-    Main function to process ACM files and apply corrections.
+    Load the correction models of a batch folder.
+
+    Parameters
+    ----------
+    folder_path : str
+        The batch folder.
+
+    Returns
+    -------
+    correction_models.CorrectionModelRegistry
+        The default models, plus the models of the `correction_models.json` file of the folder if it has one.
     """
-    batch_folder_path, correction_type, include_intrinsic_corrections = get_user_input()
+    # Correction models for other linacs or diode batches can be added in a config file in the batch folder
+    models_file_path = os.path.join(folder_path, correction_models.CONFIG_FILE_NAME)
+    if os.path.isfile(models_file_path):
+        return correction_models.load_correction_models(models_file_path)
+    return correction_models.default_registry()
 
-    for file in os.listdir(batch_folder_path):
-        if file.endswith(".acm"):
-            print(f"Processing file: {file}")
-            acm_file_path = os.path.join(batch_folder_path, file)
-            txt_file_path = os.path.join(batch_folder_path, file[:-4] + ".txt")
 
-            if not os.path.isfile(txt_file_path):
-                print(f"Matching .txt file for {file} not found. Skipping this file.")
-                continue
+def corrected_file_path(txt_file_path, correction_type, include_intrinsic_corrections, output_dir=None):
+    """
+    Get the path of the corrected TXT file of a measurement.
 
+    Parameters
+    ----------
+    txt_file_path : str
+        Path to the measured TXT file.
+    correction_type : str
+        The correction, 'pr' or 'dpp'.
+    include_intrinsic_corrections : str
+        Whether intrinsic corrections are included ('y' or 'n').
+    output_dir : str, optional
+        The folder the corrected file is written to. Defaults to the folder of the TXT file.
+
+    Returns
+    -------
+    str
+        The TXT file path with a '_corrected_<correction_type>[_intrinsic]' suffix.
+    """
+    file_name_suffix_intrinsic = '_intrinsic' if include_intrinsic_corrections == 'y' else ''
+    write_file_path = txt_file_path[:-4] + '_corrected_' + correction_type + file_name_suffix_intrinsic + '.txt'
+    if output_dir is not None:
+        write_file_path = os.path.join(output_dir, os.path.basename(write_file_path))
+    return write_file_path
+
+
+def duplicate_output_paths(file_pairs, correction_type, include_intrinsic_corrections, output_dir=None):
+    """
+    Get the corrected file paths that several measurements would be written to.
+
+    Parameters
+    ----------
+    file_pairs : list of tuple
+        The (ACM file path, TXT file path) of each measurement.
+    correction_type, include_intrinsic_corrections, output_dir
+        The correction and output folder, see `corrected_file_path`.
+
+    Returns
+    -------
+    dict
+        The ACM file paths of each corrected file path shared by more than one measurement, e.g. measurements of
+        different folders with the same name written to one output folder.
+    """
+    acm_file_paths = {}
+    for acm_file_path, txt_file_path in file_pairs:
+        output_file_path = corrected_file_path(txt_file_path, correction_type, include_intrinsic_corrections,
+                                               output_dir)
+        acm_file_paths.setdefault(os.path.normcase(os.path.abspath(output_file_path)), []).append(acm_file_path)
+    return {output_file_path: paths for output_file_path, paths in acm_file_paths.items() if len(paths) > 1}
+
+
+def process_file(acm_file_path, txt_file_path, correction_type, include_intrinsic_corrections, registry=None,
+                 output_dir=None, dtype=np.float64):
+    """
+    Process one ACM file and write the corrected SNC txt file.
+
+    Parameters
+    ----------
+    acm_file_path : str
+        Path to the ACM file.
+    txt_file_path : str
+        Path to the matching TXT file.
+    correction_type : str
+        The correction to write, 'pr' or 'dpp'.
+    include_intrinsic_corrections : str
+        Whether to include intrinsic corrections ('y' or 'n').
+    registry : correction_models.CorrectionModelRegistry, optional
+        The correction models to select from. Defaults to `correction_models.default_registry()`.
+    output_dir : str, optional
+        The folder the corrected file is written to. Defaults to the folder of the TXT file.
+    dtype : numpy.dtype or type, optional
+        The precision of the counts and corrections, np.float64 (default) or np.float32, which halves their memory.
+        See `corrections.apply_jager_corrections` for the difference of the float32 results.
+
+    Returns
+    -------
+    str
+        'processed', 'skipped' if the matching TXT file is missing, or 'failed' if an error occurred, including
+        writing the corrected file, which is reported and does not stop the batch.
+    """
+    file = os.path.basename(acm_file_path)
+    print(f"Processing file: {file}")
+
+    if not os.path.isfile(txt_file_path):
+        print(f"Matching .txt file for {file} not found. Skipping this file.")
+        return 'skipped'
+
+    with instrumentation.current_file(file), instrumentation.stage('process_file'):
+        try:
+            (frame_data_df,
+             counts_accumulated_df,
+             bkrnd_and_calibration_df,
+             header_data,
+             array_data) = read_files(acm_file_path, txt_file_path, dtype=dtype)
+
+            corrected_count_array = apply_corrections(counts_accumulated_df,
+                                                      bkrnd_and_calibration_df,
+                                                      include_intrinsic_corrections,
+                                                      array_data,
+                                                      header_data,
+                                                      registry,
+                                                      dtype)
+
+            array_data_to_write = array_data.copy()
+
+            with instrumentation.stage('snc_format_array'):
+                corrected_counts = corrected_count_array[0] if correction_type == 'pr' else corrected_count_array[1]
+                array_data_to_write['Corrected Counts'] = snc_format_array(corrected_counts,
+                                                                           array_data_to_write['Corrected Counts'])
+
+            write_file_path = corrected_file_path(txt_file_path, correction_type, include_intrinsic_corrections,
+                                                  output_dir)
+            if output_dir is not None:
+                os.makedirs(output_dir, exist_ok=True)
+
+            if not io_snc.write_snc_txt_file(array_data_to_write, header_data, write_file_path):
+                return 'failed'
+
+        except FileNotFoundError:
+            print(f"File {file} not found.")
+            return 'failed'
+        except Exception as e:
+            print(f"An error occurred while processing {file}: {str(e)}")
+            return 'failed'
+
+        return 'processed'
+
+
+def _process_file_captured(*args):
+    """Runs `process_file` in a worker process and returns its status together with the text it printed."""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        status = process_file(*args)
+    return status, output.getvalue()
+
+
+def _process_file_isolated(*args):
+    """Runs `process_file` in its own worker process, reporting the file as failed if the process dies."""
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            return executor.submit(_process_file_captured, *args).result()
+        except concurrent.futures.process.BrokenProcessPool as e:
+            file = os.path.basename(args[0])
+            return 'failed', (f"Processing file: {file}\n"
+                              f"An error occurred while processing {file}: {str(e)}\n")
+
+
+def process_pairs(file_pairs, correction_type, include_intrinsic_corrections, registry=None, n_workers=1,
+                  output_dir=None, incremental=True, dtype=np.float64):
+    """
+    Process ACM and TXT file pairs, optionally in parallel worker processes.
+
+    Parameters
+    ----------
+    file_pairs : list of tuple
+        The (ACM file path, TXT file path) of each measurement.
+    correction_type : str
+        The correction to write, 'pr' or 'dpp'.
+    include_intrinsic_corrections : str
+        Whether to include intrinsic corrections ('y' or 'n').
+    registry : correction_models.CorrectionModelRegistry, optional
+        The correction models to select from. Defaults to the models of the folder of each ACM file, see
+        `load_folder_correction_models`.
+    n_workers : int, optional
+        The number of worker processes. With 1, the files are processed one after another in this process.
+    output_dir : str, optional
+        The folder the corrected files are written to. Defaults to the folder of each TXT file.
+    incremental : bool, optional
+        Whether to skip files whose corrected file was written by a previous run from the same inputs, see
+        `run_manifest`. Processed files are recorded in the run manifest of their output folder either way.
+    dtype : numpy.dtype or type, optional
+        The precision of the counts and corrections, see `process_file`.
+
+    Returns
+    -------
+    dict
+        The status returned by `process_file` of each ACM file path, or 'unchanged' for skipped files, in
+        processing order.
+
+    Raises
+    ------
+    ValueError
+        If several measurements would be written to the same corrected file, see `duplicate_output_paths`. Their
+        files would overwrite each other and share one entry of the run manifest, so none are processed.
+
+    Notes
+    -----
+    Worker processes print nothing themselves; the output of each file is collected and printed in the order of
+    the files once it is done, so the log and output files are the same as for a serial run. If a worker process
+    dies, e.g. running out of memory, the unfinished files are rerun in a process each, so only the file that
+    caused it is reported as failed.
+    """
+    duplicates = duplicate_output_paths(file_pairs, correction_type, include_intrinsic_corrections, output_dir)
+    if duplicates:
+        raise ValueError(f"{len(duplicates)} corrected files would be written by several measurements, e.g. "
+                         f"{next(iter(duplicates))}.")
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    folder_registries = {}
+    args = []
+    for acm_file_path, txt_file_path in file_pairs:
+        if registry is None:
+            folder_path = os.path.dirname(acm_file_path)
+            if folder_path not in folder_registries:
+                folder_registries[folder_path] = load_folder_correction_models(folder_path)
+            pair_registry = folder_registries[folder_path]
+        else:
+            pair_registry = registry
+        args.append((acm_file_path, txt_file_path, correction_type, include_intrinsic_corrections, pair_registry,
+                     output_dir, dtype))
+
+    # Fingerprint the inputs of each file to skip those corrected by a previous run with the same inputs
+    manifests, fingerprints = {}, []
+    for acm_file_path, txt_file_path, _, _, pair_registry, _, _ in args:
+        output_file_path = corrected_file_path(txt_file_path, correction_type, include_intrinsic_corrections,
+                                               output_dir)
+        output_folder = os.path.dirname(output_file_path)
+        if output_folder not in manifests:
+            manifests[output_folder] = run_manifest.RunManifest(output_folder)
+        fingerprint, up_to_date = manifests[output_folder].fingerprint(
+            output_file_path, acm_file_path, txt_file_path, correction_type, include_intrinsic_corrections,
+            pair_registry, dtype)
+        fingerprints.append('unchanged' if incremental and up_to_date else fingerprint)
+
+    results = {}
+
+    def finish(file_args, fingerprint, status):
+        """Records a processed file in the run manifest of its output folder, once its corrected file is written."""
+        results[file_args[0]] = status
+        if status == 'processed' and fingerprint is not None:
+            output_file_path = corrected_file_path(file_args[1], correction_type, include_intrinsic_corrections,
+                                                   output_dir)
             try:
-                (frame_data_df,
-                 counts_accumulated_df,
-                 bkrnd_and_calibration_df,
-                 header_data,
-                 array_data) = read_files(acm_file_path, txt_file_path)
+                manifests[os.path.dirname(output_file_path)].record(output_file_path, fingerprint)
+            except OSError as e:
+                print(f"Warning: Could not update the run manifest for {os.path.basename(file_args[0])}: {e}")
+
+    def report_unchanged(file_args):
+        """Reports a file skipped as unchanged since the last run."""
+        file = os.path.basename(file_args[0])
+        print(f"Processing file: {file}")
+        print(f"{file} and its parameters are unchanged since the last run. Skipping this file.")
+        results[file_args[0]] = 'unchanged'
+
+    if n_workers <= 1:
+        for file_args, fingerprint in zip(args, fingerprints):
+            if fingerprint == 'unchanged':
+                report_unchanged(file_args)
+            else:
+                finish(file_args, fingerprint, process_file(*file_args))
+        return results
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [None if fingerprint == 'unchanged' else executor.submit(_process_file_captured, *file_args)
+                   for file_args, fingerprint in zip(args, fingerprints)]
+        for file_args, fingerprint, future in zip(args, fingerprints, futures):
+            if future is None:
+                report_unchanged(file_args)
+                continue
+            try:
+                status, output = future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                # A worker died and took the pool down, rerun the unfinished files one process each
+                status, output = _process_file_isolated(*file_args)
+            print(output, end='')
+            finish(file_args, fingerprint, status)
+
+    return results
 
-                if include_intrinsic_corrections == 'y':
-                    file_name_suffix_intrinsic = '_intrinsic'
-                else:
-                    file_name_suffix_intrinsic = ''
 
-                corrected_count_array = apply_corrections(counts_accumulated_df,
-                                                          bkrnd_and_calibration_df,
-                                                          include_intrinsic_corrections,
-                                                          array_data)
+def batch_folder_pairs(batch_folder_path):
+    """
+    Get the ACM and TXT file pairs of a batch folder.
 
-                array_data_to_write = array_data.copy()
+    Parameters
+    ----------
+    batch_folder_path : str
+        The folder containing the ACM files and their matching TXT files.
 
-                if correction_type == 'pr':
-                    array_data_to_write['Corrected Counts'] = snc_format_array(corrected_count_array[0],
-                                                                               array_data_to_write['Corrected Counts'])
-                else:
-                    array_data_to_write['Corrected Counts'] = snc_format_array(corrected_count_array[1],
-                                                                               array_data_to_write['Corrected Counts'])
+    Returns
+    -------
+    list of tuple
+        The (ACM file path, TXT file path) of each .acm file in the folder, the TXT file having the same name.
+    """
+    return [(os.path.join(batch_folder_path, file), os.path.join(batch_folder_path, file[:-4] + ".txt"))
+            for file in os.listdir(batch_folder_path) if file.endswith(".acm")]
 
-                write_file_path = (txt_file_path[:-4] + '_corrected_' + correction_type +
-                                   file_name_suffix_intrinsic + '.txt')
 
-                io_snc.write_snc_txt_file(array_data_to_write, header_data, write_file_path)
+def process_batch(batch_folder_path, correction_type, include_intrinsic_corrections, registry=None, n_workers=1):
+    """
+    Process all ACM files of a batch folder, optionally in parallel worker processes.
 
-            except FileNotFoundError:
-                print(f"File {file} not found.")
-            except Exception as e:
-                print(f"An error occurred while processing {file}: {str(e)}")
+    Parameters
+    ----------
+    batch_folder_path : str
+        The folder containing the ACM files and their matching TXT files.
+    correction_type : str
+        The correction to write, 'pr' or 'dpp'.
+    include_intrinsic_corrections : str
+        Whether to include intrinsic corrections ('y' or 'n').
+    registry : correction_models.CorrectionModelRegistry, optional
+        The correction models to select from. Defaults to the models of the batch folder.
+    n_workers : int, optional
+        The number of worker processes, see `process_pairs`.
+
+    Returns
+    -------
+    dict
+        The status returned by `process_file` of each ACM file path, in processing order.
+    """
+    return process_pairs(batch_folder_pairs(batch_folder_path), correction_type, include_intrinsic_corrections,
+                         registry, n_workers)
+
+
+def read_manifest(manifest_path):
+    """
+    Read the ACM and TXT file pairs listed in a manifest file.
+
+    Parameters
+    ----------
+    manifest_path : str
+        Path to the manifest, a text file with one measurement per line: the ACM file path, optionally followed by
+        a comma and the TXT file path. Relative paths are relative to the folder of the manifest, and empty lines
+        and lines starting with '#' are ignored.
+
+    Returns
+    -------
+    list of tuple
+        The (ACM file path, TXT file path) of each measurement. Without a TXT file path, the TXT file next to
+        the ACM file with the same name is used.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    file_pairs = []
+    with open(manifest_path, 'r', newline='') as file:
+        for row in csv.reader(file):
+            row = [path.strip() for path in row]
+            if not row or not row[0] or row[0].startswith('#'):
+                continue
+            acm_file_path = os.path.join(manifest_dir, row[0])
+            txt_file_path = os.path.join(manifest_dir, row[1]) if len(row) > 1 and row[1] else \
+                acm_file_path[:-4] + ".txt"
+            file_pairs.append((acm_file_path, txt_file_path))
+    return file_pairs
+
+
+def select_file_pairs(inputs, manifest_paths=()):
+    """
+    Get the ACM and TXT file pairs selected by folders, glob patterns, ACM files and manifests.
+
+    Parameters
+    ----------
+    inputs : list of str
+        Batch folders, whose .acm files are all selected, ACM file paths or glob patterns matching either.
+    manifest_paths : list of str, optional
+        Manifest files, see `read_manifest`.
+
+    Returns
+    -------
+    list of tuple
+        The (ACM file path, TXT file path) of each selected measurement, in the order given, each ACM file once.
+    """
+    file_pairs = []
+    for path in inputs:
+        matches = sorted(glob.glob(path, recursive=True)) if glob.has_magic(path) else [path]
+        if not matches:
+            print(f"No files match {path}.")
+        for match in matches:
+            if os.path.isdir(match):
+                file_pairs.extend(batch_folder_pairs(match))
+            elif match.endswith(".acm"):
+                file_pairs.append((match, match[:-4] + ".txt"))
+            elif not glob.has_magic(path):
+                print(f"{match} is neither a folder nor an .acm file. Skipping it.")
+    for manifest_path in manifest_paths:
+        file_pairs.extend(read_manifest(manifest_path))
+
+    selected_pairs, seen = [], set()
+    for acm_file_path, txt_file_path in file_pairs:
+        if os.path.abspath(acm_file_path) not in seen:
+            seen.add(os.path.abspath(acm_file_path))
+            selected_pairs.append((acm_file_path, txt_file_path))
+    return selected_pairs
+
+
+def print_timing_summary():
+    """
+    Summarize and print the stage timings of the run, if they are recorded with `instrumentation`.
+    """
+    if instrumentation.is_enabled():
+        summary = instrumentation.summarize_report(instrumentation.report_path())
+        print(f"Stage timings written to {instrumentation.report_path()}:")
+        print(instrumentation.format_summary(summary))
+
+
+def parse_arguments(argv=None):
+    """
+    Parse the command line arguments.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The arguments. Defaults to `sys.argv[1:]`.
+
+    Returns
+    -------
+    argparse.Namespace
+        The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Apply Jager dose rate corrections to ArcCheck ACM files and write corrected SNC txt files. "
+                    "Without arguments, the folder and options are asked for interactively.")
+    parser.add_argument('inputs', nargs='*',
+                        help="Batch folders, .acm files or glob patterns (quoted, e.g. 'plans/**/*.acm'). The "
+                             "matching .txt file of each .acm file must have the same name.")
+    parser.add_argument('-m', '--manifest', action='append', default=[],
+                        help="A manifest file listing 'acm_path[,txt_path]' per line. Can be given several times.")
+    parser.add_argument('-c', '--correction', choices=['pr', 'dpp'], required=True,
+                        help="The correction to write: pulse rate (pr) or dose per pulse (dpp).")
+    parser.add_argument('-i', '--intrinsic', action='store_true',
+                        help="Re-apply the intrinsic corrections of the measured txt file.")
+    parser.add_argument('-o', '--output-dir',
+                        help="The folder the corrected files are written to. Defaults to next to each .txt file.")
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help="The number of worker processes. Defaults to 1.")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="Reprocess all files, also those unchanged since the last run according to the run "
+                             "manifest of the output folder.")
+    parser.add_argument('--precision', choices=['float64', 'float32'], default='float64',
+                        help="The precision of the counts and corrections. float32 halves their memory and differs "
+                             "from float64 by less than 1e-6 relative. Defaults to float64.")
+    parser.add_argument('--timing-report',
+                        help="Record the wall time, CPU time and peak memory of each stage of each file to this "
+                             "JSON-lines file and print the p50 and p95 of each stage at the end.")
+    parser.add_argument('--models',
+                        help="A correction models config file. Defaults to the correction_models.json of each "
+                             "batch folder, if any, and otherwise the Jager coefficients.")
+    arguments = parser.parse_args(argv)
+    if not arguments.inputs and not arguments.manifest:
+        parser.error("no input folders, files or manifests given")
+    if arguments.workers < 1:
+        parser.error("--workers must be at least 1")
+    return arguments
+
+
+def main(argv=None):
+    """
+    Main function to process ACM files and apply corrections.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments, see `parse_arguments`. Defaults to `sys.argv[1:]`; without any, the batch
+        folder and options are asked for with `get_user_input`.
+
+    Returns
+    -------
+    int
+        The exit status: 0 if all measurements were processed, unchanged since the last run or skipped for a
+        missing TXT file, 1 if any failed or none were found, and 2 if several measurements would be written to
+        the same corrected file, in which case none are processed.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+
+    if not argv:
+        batch_folder_path, correction_type, include_intrinsic_corrections = get_user_input()
+        results = process_batch(batch_folder_path, correction_type, include_intrinsic_corrections)
+        print_timing_summary()
+        return 1 if 'failed' in results.values() else 0
+
+    arguments = parse_arguments(argv)
+    if arguments.timing_report:
+        instrumentation.enable(arguments.timing_report)
+    try:
+        file_pairs = select_file_pairs(arguments.inputs, arguments.manifest)
+        registry = correction_models.load_correction_models(arguments.models) if arguments.models else None
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+
+    include_intrinsic_corrections = 'y' if arguments.intrinsic else 'n'
+    duplicates = duplicate_output_paths(file_pairs, arguments.correction, include_intrinsic_corrections,
+                                        arguments.output_dir)
+    if duplicates:
+        for output_file_path, acm_file_paths in duplicates.items():
+            print(f"Error: {', '.join(acm_file_paths)} would all be written to {output_file_path}.")
+        print("No files were processed. Give each measurement a unique name or write them to separate folders.")
+        return 2
+
+    results = process_pairs(file_pairs, arguments.correction, include_intrinsic_corrections, registry,
+                            arguments.workers, arguments.output_dir, not arguments.force, np.dtype(arguments.precision))
+
+    statuses = list(results.values())
+    print(f"Processed {statuses.count('processed')} of {len(statuses)} files, "
+          f"skipped {statuses.count('skipped')}, unchanged {statuses.count('unchanged')}, "
+          f"failed {statuses.count('failed')}.")
+    print_timing_summary()
+    return 1 if not statuses or 'failed' in statuses else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,88 +1,367 @@
+import concurrent.futures
+import os
+
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from matplotlib.animation import FuncAnimation
-from matplotlib.colors import ListedColormap, BoundaryNorm
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import ListedColormap, BoundaryNorm, to_rgb
+from matplotlib.figure import Figure
 import pandas as pd
+from PIL import Image
+
+from frame_store import DetectorFrameStore
+
+DOSE_RATE_COLORS = ["dodgerblue", "deepskyblue", "turquoise", "springgreen", "seagreen"]
+DOSE_RATE_BOUNDARIES = [0, 50, 100, 150, 300, np.inf]
+FRAME_INTERVAL_MS = 50
+
+# Fixed GIF palette: the dose rate colors, then grays for the axes, labels and their anti-aliasing
+_PALETTE = np.vstack([(np.array([to_rgb(color) for color in DOSE_RATE_COLORS]) * 255).round(),
+                      np.repeat(np.linspace(0, 255, 256 - len(DOSE_RATE_COLORS)).round()[:, np.newaxis], 3, axis=1)]
+                     ).astype(np.uint8)
+
+
+def animation_frame_indices(n_frames, start=None, stop=None, step=1):
+    """
+    Returns the frames an animation renders.
+
+    Parameters:
+    n_frames (int): The number of frames of the recording.
+    start, stop (int, optional): The frame range, as for a slice. Defaults to all frames.
+    step (int, optional): Render every step-th frame of the range.
+
+    Returns:
+    range: The frame indices.
+    """
+    if step < 1:
+        raise ValueError(f"The frame step must be at least 1, got {step}.")
+    return range(n_frames)[start:stop:step]
 
-def create_animation(detector_arrays, xn, yn, detector_number):
+
+def _dose_rate_cmap_norm():
+    """Returns the colormap and norm of the dose rate intervals; cells without dose rate are transparent."""
+    cmap = ListedColormap(DOSE_RATE_COLORS)
+    cmap.set_bad(alpha=0)
+    return cmap, BoundaryNorm(DOSE_RATE_BOUNDARIES, cmap.N, clip=True)
+
+
+class _FrameRenderer:
+    """
+    Draws the figure of an animation once and then renders frames by only updating the pixel data of its image.
+
+    Parameters:
+    grid_shape (tuple of int): The (rows, columns) of the frames.
+    dpi (int): The resolution of the rendered frames.
+    extent (tuple of float, optional): The (left, right, bottom, top) of the frames in cm. Defaults to the
+    SNC Patient array, -32.5 to 32.5 cm by 10 to -10 cm.
+    """
+
+    def __init__(self, grid_shape, dpi, extent=None):
+        cmap, norm = _dose_rate_cmap_norm()
+        self.figure = Figure(figsize=(20, 10), dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        n_rows, n_cols = grid_shape
+        self.image = self.ax.imshow(np.ma.masked_all(grid_shape), cmap=cmap, norm=norm, interpolation='nearest',
+                                    interpolation_stage='rgba', extent=(0, n_cols, n_rows, 0), animated=True)
+
+        # Customizing the tick labels to fit the spatial dimensions
+        left, right, bottom, top = (-32.5, 32.5, -10, 10) if extent is None else extent
+        self.ax.set_xticks(np.linspace(0, n_cols, num=11))
+        self.ax.set_yticks(np.linspace(0, n_rows, num=5))
+        self.ax.set_xticklabels([f"{x:g}" for x in np.linspace(left, right, num=11)])
+        self.ax.set_yticklabels([f"{y:g}" for y in np.linspace(top, bottom, num=5)])
+        self.ax.set_xlabel('X (cm)')
+        self.ax.set_ylabel('Y (cm)')
+        self.title = self.ax.set_title(' ', animated=True)
+
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.palette = Image.new('P', (1, 1))
+        self.palette.putpalette(_PALETTE.tobytes())
+
+    def render(self, frame, title):
+        """
+        Renders one frame.
+
+        Parameters:
+        frame (ndarray): The 2D dose rate array of the frame; cells equal to 0 are not colored.
+        title (str): The title of the frame.
+
+        Returns:
+        PIL.Image.Image: The rendered frame with the palette of the GIF.
+        """
+        self.canvas.restore_region(self.background)
+        self.image.set_data(np.ma.masked_equal(frame, 0))
+        self.title.set_text(title)
+        self.ax.draw_artist(self.image)
+        for spine in self.ax.spines.values():
+            self.ax.draw_artist(spine)
+        self.ax.draw_artist(self.title)
+        rgba = Image.frombuffer('RGBA', self.canvas.get_width_height(), self.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+        return rgba.convert('RGB').quantize(palette=self.palette, dither=Image.Dither.NONE)
+
+
+def _render_animation_chunk(frames, frame_numbers, dpi, extent, png_path_pattern):
+    """
+    Renders a chunk of animation frames, in a worker process when rendering in parallel.
+
+    Parameters:
+    frames (ndarray or DetectorFrameStore): The frames of the chunk.
+    frame_numbers (list of int): The frame index of each frame in the recording, for the titles and file names.
+    dpi (int): The resolution of the rendered frames.
+    extent (tuple of float or None): The extent of the frames in cm, see `_FrameRenderer`.
+    png_path_pattern (str or None): If given, the frames are written as PNG files with this pattern formatted with
+    the frame index, instead of being returned.
+
+    Returns:
+    list: The rendered frames as PIL images, or the paths of the written PNG files.
+    """
+    renderer = _FrameRenderer(frames.shape[1:], dpi, extent)
+    rendered = []
+    for i, frame_number in enumerate(frame_numbers):
+        image = renderer.render(frames[i], f'Time: {frame_number * FRAME_INTERVAL_MS} ms')
+        if png_path_pattern is None:
+            rendered.append(image)
+        else:
+            file_path = png_path_pattern.format(frame_number)
+            image.save(file_path)
+            rendered.append(file_path)
+    return rendered
+
+
+def create_animation(detector_arrays, xn, yn, detector_number, start=None, stop=None, step=1, n_workers=1,
+                     file_path=None, dpi=80, extent=None, frame_offset=0):
     """
     Create an animation of the dose rate over time in the SNC Patient detector array display arrangement.
 
     Parameters:
-    detector_arrays (ndarray): A 3D numpy array representing the dose rate at each time point.
+    detector_arrays (ndarray or DetectorFrameStore): A 3D numpy array, or a frame_store.DetectorFrameStore,
+    representing the dose rate at each time point. Only the rendered frames are materialized.
+    xn, yn, detector_number (int): The window size and detector named in the default file name.
+    start, stop (int, optional): The frame range to render, as for a slice. Defaults to all frames.
+    step (int, optional): Render every step-th frame; the GIF still plays in real time.
+    n_workers (int, optional): The number of worker processes rendering chunks of frames in parallel.
+    file_path (str, optional): The output file. A '.gif' file is written as an animated GIF; for a '.png' file, each
+    frame is written as a PNG file named after it with the frame index appended, e.g. 'animation_00042.png'.
+    Defaults to 'diff_dose_animation_selected_{xn}x{yn}_detector_{detector_number}.gif'.
+    dpi (int, optional): The resolution of the frames of the 20 x 10 inch figure.
+    extent (tuple of float, optional): The (left, right, bottom, top) of the frames in cm, for the tick labels.
+    Defaults to the extent of the full SNC Patient array.
+    frame_offset (int, optional): The frame index of the first frame of `detector_arrays` in the recording, e.g.
+    the start frame of an extracted window, for the titles and file names.
 
     Returns:
-    None
+    list of str: The paths of the written files.
+
+    Notes:
+    The figure is drawn once; each frame only updates the pixel data of its image and title and is copied into a
+    GIF with a fixed palette by Pillow, so no ImageMagick is needed.
     """
+    if file_path is None:
+        file_path = f'diff_dose_animation_selected_{xn}x{yn}_detector_{detector_number}.gif'
+    root, extension = os.path.splitext(file_path)
+    if extension.lower() not in ('.gif', '.png'):
+        raise ValueError(f"Animations are written as .gif or .png files, got {file_path}.")
+    png_path_pattern = root + '_{:05d}' + extension if extension.lower() == '.png' else None
+
+    frame_numbers = animation_frame_indices(detector_arrays.shape[0], start, stop, step)
+    if len(frame_numbers) == 0:
+        raise ValueError("The frame range of the animation is empty.")
+
+    # Contiguous chunks of frames, one per worker
+    n_chunks = max(1, min(n_workers, len(frame_numbers)))
+    bounds = np.linspace(0, len(frame_numbers), n_chunks + 1).astype(int)
+    chunks = [frame_numbers[bounds[i]:bounds[i + 1]] for i in range(n_chunks)]
+    chunk_frame_numbers = [[frame_offset + frame for frame in chunk] for chunk in chunks]
+
+    def chunk_frames(chunk):
+        if isinstance(detector_arrays, DetectorFrameStore):
+            return detector_arrays.subset(chunk.start, chunk.stop, chunk.step)
+        return np.asarray(detector_arrays[chunk.start:chunk.stop:chunk.step])
+
+    if n_chunks == 1:
+        rendered = _render_animation_chunk(chunk_frames(chunks[0]), chunk_frame_numbers[0], dpi, extent,
+                                           png_path_pattern)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_chunks) as executor:
+            futures = [executor.submit(_render_animation_chunk, chunk_frames(chunk), numbers, dpi, extent,
+                                       png_path_pattern) for chunk, numbers in zip(chunks, chunk_frame_numbers)]
+            rendered = [item for future in futures for item in future.result()]
+
+    if png_path_pattern is not None:
+        return rendered
+    # Pillow's optimize pass compares every pixel of consecutive frames, which takes longer than rendering them
+    rendered[0].save(file_path, save_all=True, append_images=rendered[1:], duration=FRAME_INTERVAL_MS * step,
+                     loop=0, optimize=False)
+    return [file_path]
+
+
+def frame_projections(detector_arrays, frames_per_projection, statistic='max'):
+    """
+    Reduce each group of consecutive frames to its maximum or mean dose rate.
 
-    def update(frame):
-        ax.clear()  # Clear the current axes
-        mask = detector_arrays[frame] == 0
-        sns.heatmap(detector_arrays[frame], cmap=cmap, norm=norm, cbar=False, mask=mask, square=True, ax=ax,
-                    xticklabels=50, yticklabels=50)
-        ax.set_xticks(xticks)
-        ax.set_yticks(yticks)
-        ax.set_xticklabels(xticklabels)
-        ax.set_yticklabels(yticklabels)
-        ax.set_xlabel('X (cm)')
-        ax.set_ylabel('Y (cm)')
-        ax.set_title(f'Time: {frame * 50} ms')
+    Parameters:
+    detector_arrays (ndarray or DetectorFrameStore): The frames, e.g. the dose rate arrays or a window of them.
+    frames_per_projection (int): The number of frames of each group; the last group may be shorter.
+    statistic (str, optional): 'max' or 'mean'.
 
-    plt.ioff()  # Turn off interactive mode
+    Returns:
+    ndarray or DetectorFrameStore: One frame per group, of the same type as `detector_arrays`. A store is reduced
+    on its (frames, 1386) detector values without materializing the frames.
+    """
+    is_store = isinstance(detector_arrays, DetectorFrameStore)
+    values = detector_arrays.detector_values if is_store else np.asarray(detector_arrays)
+    if frames_per_projection < 1:
+        raise ValueError(f"A projection needs at least 1 frame, got {frames_per_projection}.")
+    starts = np.arange(0, len(values), frames_per_projection)
+
+    if statistic == 'max':
+        projections = np.maximum.reduceat(values, starts, axis=0)
+    elif statistic == 'mean':
+        group_sizes = np.diff(np.append(starts, len(values)))
+        projections = np.add.reduceat(values, starts, axis=0) / group_sizes.reshape((-1,) + (1,) * (values.ndim - 1))
+    else:
+        raise ValueError(f"Unknown statistic '{statistic}', expected 'max' or 'mean'.")
+    return DetectorFrameStore(projections) if is_store else projections
+
+
+def plot_dose_rate_map(dose_rate_array, title, file_path, dpi=80, extent=None):
+    """
+    Save one dose rate array, e.g. the maximum dose rate of a whole delivery, as a static image.
 
-    # Prepare the custom colormap
-    colors = ["dodgerblue", "deepskyblue", "turquoise", "springgreen", "seagreen"]  # Define the colors for the colormap
-    cmap = ListedColormap(colors)
+    Parameters:
+    dose_rate_array (ndarray): The 2D dose rate array; cells equal to 0 are not colored.
+    title (str): The title of the image.
+    file_path (str): The path of the image, e.g. a '.png' file.
+    dpi (int, optional): The resolution of the 20 x 10 inch figure.
+    extent (tuple of float, optional): The extent of the array in cm, see `create_animation`.
 
-    # Prepare the custom norm
-    boundaries = [0, 50, 100, 150, 300, np.inf]  # Define the boundaries for the colors
-    norm = BoundaryNorm(boundaries, cmap.N, clip=True)
+    Returns:
+    None
+    """
+    _FrameRenderer(np.shape(dose_rate_array), dpi, extent).render(dose_rate_array, title).save(file_path)
 
-    # Set up the figure and axis for the animation
-    fig, ax = plt.subplots(figsize=(20, 10))
 
-    # Customizing the tick labels to fit the spatial dimensions
-    xticks = np.linspace(0, detector_arrays.shape[2], num=11)
-    yticks = np.linspace(0, detector_arrays.shape[1], num=5)
-    xticklabels = [f"{x - 32.5}" for x in np.linspace(0, 65, num=11)]
-    yticklabels = [f"{10 - x * 10}" for x in np.linspace(0, 2, num=5)]
+def plot_projection_sheet(projections, titles, file_path, n_columns=6, dpi=80):
+    """
+    Save frame projections, e.g. from `frame_projections`, side by side as one static image.
 
-    # Create the animation
-    anim = FuncAnimation(fig, update, frames=detector_arrays.shape[0], interval=50)
+    Parameters:
+    projections (ndarray): The (projections, rows, columns) dose rate arrays; cells equal to 0 are not colored.
+    titles (list of str): The title of each projection.
+    file_path (str): The path of the image, e.g. a '.png' file.
+    n_columns (int, optional): The number of projections per row of the sheet.
+    dpi (int, optional): The resolution of the sheet.
 
-    # Save the animation
-    anim.save(f'diff_dose_animation_selected_{xn}x{yn}_detector_{detector_number}.gif', dpi=80, writer='imagemagick')
+    Returns:
+    None
 
-    plt.close()  # Close the plot to prevent it from displaying statically
+    Notes:
+    The projections are tiled into one image with a gap of 2 cells between them, which draws much faster than
+    one axes per projection.
+    """
+    projections = np.asarray(projections)
+    n_projections, height, width = projections.shape
+    n_columns = min(n_columns, n_projections)
+    n_rows = -(-n_projections // n_columns)
+    gap = 2
+    tile_height, tile_width = height + 2 * gap, width + gap  # Room for the title above each projection
+
+    sheet = np.zeros((n_rows * tile_height, n_columns * tile_width - gap))
+    for i, projection in enumerate(projections):
+        row, col = divmod(i, n_columns)
+        sheet[row * tile_height + 2 * gap:(row + 1) * tile_height, col * tile_width:col * tile_width + width] = \
+            projection
+
+    cmap, norm = _dose_rate_cmap_norm()
+    scale = 12 / sheet.shape[1]  # inches per cell of a 12 inch wide sheet
+    figure = Figure(figsize=(12, max(1, sheet.shape[0] * scale)), dpi=dpi)
+    FigureCanvasAgg(figure)
+    ax = figure.add_axes((0, 0, 1, 1))
+    ax.imshow(np.ma.masked_equal(sheet, 0), cmap=cmap, norm=norm, interpolation='nearest', aspect='auto')
+    for i, title in enumerate(titles):
+        row, col = divmod(i, n_columns)
+        ax.text(col * tile_width, row * tile_height + 1.5 * gap, title, fontsize=8, va='bottom')
+    ax.set_axis_off()
+    figure.savefig(file_path)
+
+
+def dose_rate_bin_labels(bin_edges=DOSE_RATE_BOUNDARIES):
+    """
+    Returns the labels of dose rate bins, e.g. '0-50' and '>300'.
 
-def bar_doserate_histogram(dose_df, dose_rate_df, detector_names):
-    all_data = []
-    boundaries = [0, 50, 100, 150, 300, np.inf]
-    labels = ['0-50', '50-100', '100-150', '150-300', '>300']
+    Parameters:
+    bin_edges (list of float, optional): The bin edges.
 
-    for detector_name in detector_names:
-        dose_detector = dose_df.iloc[:, detector_name]
-        dose_rate_detector = dose_rate_df.iloc[:, detector_name]
+    Returns:
+    list of str: One label per bin.
+    """
+    return [f'>{low:g}' if np.isinf(high) else f'{low:g}-{high:g}' for low, high in zip(bin_edges[:-1], bin_edges[1:])]
 
-        # Create a new column for the dose rate bins
-        dose_rate_bins = pd.cut(dose_rate_detector, bins=boundaries, labels=labels, include_lowest=True)
 
-        # Create a new DataFrame with the dose, dose rate bins, and detector index
-        df = pd.DataFrame({
-            'Dose': dose_detector,
-            'Dose Rate Interval': dose_rate_bins,
-            'Detector Names': detector_name  # Change 'Detector' to 'Detector Names'
-        })
-        all_data.append(df)
+def dose_rate_spectrum(dose_df, dose_rate_df, bin_edges=DOSE_RATE_BOUNDARIES):
+    """
+    Calculate the dose delivered in each dose rate bin by every detector.
 
-    all_data_df = pd.concat(all_data)
+    Parameters:
+    dose_df (pd.DataFrame or ndarray): The dose of each frame (rows) and detector (columns), from
+    `main.calculate_dose_values`.
+    dose_rate_df (pd.DataFrame or ndarray): The dose rate of each frame and detector, of the same shape.
+    bin_edges (list of float, optional): The increasing bin edges. Like `pd.cut(..., include_lowest=True)`, the bins
+    include their upper edge and the first bin also its lower edge.
 
-    # Group the data by 'Detector Names' and 'Dose Rate Interval' and calculate the sum of 'Dose' for each group
-    grouped_data = all_data_df.groupby(['Detector Names', 'Dose Rate Interval'])['Dose'].sum().reset_index()
+    Returns:
+    ndarray: The (detectors x bins) dose sums. Frames with a dose rate outside the bins or NaN are not counted.
 
-    # Define your colors
-    colors = ["dodgerblue", "deepskyblue", "turquoise", "springgreen", "seagreen"]  # Use the blue-green spectrum colors
+    Notes:
+    The bin of every frame and detector is found with one `np.searchsorted` and the doses are summed with one
+    `np.bincount` over (detector, bin) indices, so the whole array takes a single pass.
+    """
+    dose = np.asarray(dose_df, dtype=float)
+    dose_rate = np.asarray(dose_rate_df, dtype=float)
+    bin_edges = np.asarray(bin_edges, dtype=float)
+    if dose.shape != dose_rate.shape:
+        raise ValueError(f"The dose {dose.shape} and dose rate {dose_rate.shape} must have the same shape.")
+    if len(bin_edges) < 2 or np.any(np.diff(bin_edges) <= 0):
+        raise ValueError("The bin edges must be at least 2 increasing values.")
+
+    n_bins = len(bin_edges) - 1
+    bins = np.searchsorted(bin_edges, dose_rate, side='left') - 1
+    bins[dose_rate == bin_edges[0]] = 0
+    counted = (bins >= 0) & (bins < n_bins) & ~np.isnan(dose)
+
+    n_detectors = dose.shape[1]
+    detector_bins = np.arange(n_detectors) * n_bins + bins
+    spectrum = np.bincount(detector_bins[counted], weights=dose[counted], minlength=n_detectors * n_bins)
+    return spectrum.reshape(n_detectors, n_bins)
+
+
+def bar_doserate_histogram(dose_df, dose_rate_df, detector_names, spectrum=None, bin_edges=DOSE_RATE_BOUNDARIES):
+    """
+    Create a bar plot of the dose delivered in each dose rate interval by a few detectors.
+
+    Parameters:
+    dose_df (pd.DataFrame): DataFrame containing the dose values.
+    dose_rate_df (pd.DataFrame): DataFrame containing the dose rate values.
+    detector_names (list of int): The indices of the detectors to plot.
+    spectrum (ndarray, optional): The dose rate spectrum of all detectors from `dose_rate_spectrum`, if already
+    calculated. Defaults to calculating it from `dose_df` and `dose_rate_df`.
+    bin_edges (list of float, optional): The dose rate intervals of the spectrum.
+
+    Returns:
+    None
+    """
+    if spectrum is None:
+        spectrum = dose_rate_spectrum(dose_df, dose_rate_df, bin_edges)
+    labels = dose_rate_bin_labels(bin_edges)
+
+    grouped_data = pd.DataFrame({
+        'Detector Names': np.repeat(detector_names, len(labels)),
+        'Dose Rate Interval': pd.Categorical(np.tile(labels, len(detector_names)), categories=labels),
+        'Dose': spectrum[detector_names].ravel(),
+    })
 
     # Create the bar plot
     bar_plot = sns.barplot(
@@ -90,7 +369,7 @@ def bar_doserate_histogram(dose_df, dose_rate_df, detector_names):
         x='Detector Names',
         y='Dose',
         hue='Dose Rate Interval',
-        palette=colors,  # Use the list of colors directly
+        palette=DOSE_RATE_COLORS if len(labels) == len(DOSE_RATE_COLORS) else 'crest',
         edgecolor=".3",
         linewidth=.5,
     )
@@ -101,6 +380,7 @@ def bar_doserate_histogram(dose_df, dose_rate_df, detector_names):
     plt.savefig('stacked_histogram.png')
     plt.show()
 
+
 def scatter_cumulative_dose(dose_rate_df, dose_accumulated_df, detector_name):
     """
     Create a seaborn scatter plot with dose accumulated in the y-axis and time in the x-axis.
@@ -0,0 +1,237 @@
+"""
+This module, `run_manifest.py`, contains a record of the measurements a batch run has corrected, so that reruns
+can skip measurements whose inputs and correction parameters have not changed.
+
+The module includes the following classes and functions:
+
+- `RunManifest`: The record of the corrected files of an output folder.
+- `tool_version`: Returns a version of the correction code, changing whenever its source changes.
+- `file_fingerprint`: Returns the size, modification time and content hash of a file.
+- `models_hash`: Returns a hash of the correction models of a registry.
+- `run_fingerprint`: Returns the fingerprint of the inputs and parameters of correcting one measurement.
+
+The manifest is a `.run_manifest.json` file in the output folder with one entry per corrected file, recording the
+fingerprints of its ACM and TXT files, the correction type, intrinsic flag, a hash of the correction models and the
+precision it was written with and the tool version. An entry is written as soon as its file is done, so an interrupted batch resumes where it
+stopped.
+
+This module is part of a larger project aimed at analyzing and correcting dose rate dependencies in ArcCheck measurements.
+
+"""
+
+import functools
+import hashlib
+import json
+import os
+import stat
+
+import numpy as np
+
+from acm_cache import content_hash
+
+MANIFEST_FILE_NAME = '.run_manifest.json'
+MANIFEST_VERSION = 1
+
+# Modules whose source determines the corrected files
+TOOL_MODULES = ('acm_cache.py', 'correction_models.py', 'corrections.py', 'io_snc.py', 'main.py')
+
+
+@functools.lru_cache(maxsize=None)
+def tool_version():
+    """
+    Returns a version of the correction code, changing whenever its source changes.
+
+    Returns
+    -------
+    str
+        The hexadecimal BLAKE2b digest of the source of the modules listed in `TOOL_MODULES`.
+    """
+    digest = hashlib.blake2b(digest_size=12)
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    for module in TOOL_MODULES:
+        with open(os.path.join(src_dir, module), 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def file_fingerprint(file_path, previous=None):
+    """
+    Returns the size, modification time and content hash of a file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the file.
+    previous : dict, optional
+        A previous fingerprint of the file, whose content hash is reused if the size and modification time are
+        unchanged, so unchanged files are not read again.
+
+    Returns
+    -------
+    dict
+        The 'size', 'mtime_ns' and 'content_hash' of the file.
+    """
+    file_stat = os.stat(file_path)
+    if previous is not None and previous.get('size') == file_stat.st_size and \
+            previous.get('mtime_ns') == file_stat.st_mtime_ns:
+        return dict(previous)
+    return {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, 'content_hash': content_hash(file_path)}
+
+
+def models_hash(registry):
+    """
+    Returns a hash of the correction models of a registry.
+
+    Parameters
+    ----------
+    registry : correction_models.CorrectionModelRegistry
+        The correction models.
+
+    Returns
+    -------
+    str
+        The hexadecimal BLAKE2b digest of the name, type, header selection and coefficients of every model, so the
+        manifest entries stay small even for per-detector coefficient maps.
+    """
+    digest = hashlib.blake2b(digest_size=12)
+    for model in registry:
+        coefficients = np.asarray(model.coefficients, dtype=np.float64)
+        digest.update(json.dumps([model.name, model.correction_type, model.serial_no, model.energy,
+                                  coefficients.shape]).encode())
+        digest.update(coefficients.tobytes())
+    return digest.hexdigest()
+
+
+def run_fingerprint(acm_file_path, txt_file_path, correction_type, include_intrinsic_corrections, registry,
+                    previous=None, dtype=np.float64):
+    """
+    Returns the fingerprint of the inputs and parameters of correcting one measurement.
+
+    Parameters
+    ----------
+    acm_file_path, txt_file_path : str
+        The paths to the ACM file and its matching TXT file.
+    correction_type : str
+        The correction, 'pr' or 'dpp'.
+    include_intrinsic_corrections : str
+        Whether intrinsic corrections are included ('y' or 'n').
+    registry : correction_models.CorrectionModelRegistry
+        The correction models the correction is selected from.
+    previous : dict, optional
+        The previous fingerprint of the measurement, whose content hashes are reused for unchanged files.
+    dtype : numpy.dtype or type, optional
+        The precision of the correction.
+
+    Returns
+    -------
+    dict
+        The fingerprint, as stored in the run manifest.
+    """
+    previous = previous or {}
+    return {
+        'acm': file_fingerprint(acm_file_path, previous.get('acm')),
+        'txt': file_fingerprint(txt_file_path, previous.get('txt')),
+        'correction_type': correction_type,
+        'include_intrinsic_corrections': include_intrinsic_corrections,
+        'models': models_hash(registry),
+        'dtype': np.dtype(dtype).name,
+        'tool_version': tool_version(),
+    }
+
+
+def _same_inputs(fingerprint, previous):
+    """Returns whether two fingerprints record the same file contents and parameters."""
+    return all(fingerprint[key]['content_hash'] == previous[key]['content_hash'] for key in ('acm', 'txt')) and \
+        all(fingerprint[key] == previous.get(key) for key in fingerprint if key not in ('acm', 'txt'))
+
+
+class RunManifest:
+    """
+    The record of the corrected files of an output folder.
+
+    Parameters
+    ----------
+    folder_path : str
+        The output folder. The manifest is read from its `.run_manifest.json` file, if any.
+
+    Notes
+    -----
+    The entries are keyed by the name of the corrected file, so each corrected file must be written from one
+    measurement per run; `main.process_pairs` rejects measurements that would share one.
+    """
+
+    def __init__(self, folder_path):
+        self.file_path = os.path.join(folder_path, MANIFEST_FILE_NAME)
+        self.entries = {}
+        try:
+            with open(self.file_path, 'r') as file:
+                manifest = json.load(file)
+            if manifest.get('version') == MANIFEST_VERSION:
+                self.entries = manifest['entries']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def fingerprint(self, output_file_path, acm_file_path, txt_file_path, correction_type,
+                    include_intrinsic_corrections, registry, dtype=np.float64):
+        """
+        Returns the current fingerprint of a measurement and whether its corrected file is up to date.
+
+        Parameters
+        ----------
+        output_file_path : str
+            The path of the corrected file.
+        acm_file_path, txt_file_path, correction_type, include_intrinsic_corrections, registry, dtype
+            The inputs and parameters of the correction, see `run_fingerprint`.
+
+        Returns
+        -------
+        tuple
+            The fingerprint, or None if an input file cannot be read, and True if the corrected file exists
+            unchanged and was written from the same inputs and parameters.
+        """
+        entry = self.entries.get(os.path.basename(output_file_path))
+        previous = entry['inputs'] if entry else None
+        try:
+            fingerprint = run_fingerprint(acm_file_path, txt_file_path, correction_type,
+                                          include_intrinsic_corrections, registry, previous, dtype)
+        except OSError:
+            return None, False
+
+        if entry is None or not _same_inputs(fingerprint, previous):
+            return fingerprint, False
+        try:
+            output_stat = os.stat(output_file_path)
+        except OSError:
+            return fingerprint, False
+        up_to_date = (stat.S_ISREG(output_stat.st_mode) and
+                      output_stat.st_size == entry['output']['size'] and
+                      output_stat.st_mtime_ns == entry['output']['mtime_ns'])
+        return fingerprint, up_to_date
+
+    def record(self, output_file_path, fingerprint):
+        """
+        Records a corrected file and writes the manifest.
+
+        Parameters
+        ----------
+        output_file_path : str
+            The path of the corrected file, which must have been written completely.
+        fingerprint : dict
+            The fingerprint of the inputs and parameters it was written from, from `fingerprint`.
+
+        Raises
+        ------
+        OSError
+            If the corrected file does not exist or is not a regular file; nothing is recorded.
+        """
+        output_stat = os.stat(output_file_path)
+        if not stat.S_ISREG(output_stat.st_mode):
+            raise OSError(f"{output_file_path} is not a file")
+        self.entries[os.path.basename(output_file_path)] = {
+            'inputs': fingerprint,
+            'output': {'size': output_stat.st_size, 'mtime_ns': output_stat.st_mtime_ns},
+        }
+        temp_path = f"{self.file_path}.tmp-{os.getpid()}"
+        with open(temp_path, 'w') as file:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, file, indent=2)
+        os.replace(temp_path, self.file_path)
@@ -0,0 +1,264 @@
+"""
+This module, `uncertainty.py`, contains functions for propagating the uncertainty of fitted correction coefficients
+to the corrected counts of ArcCheck measurements by Monte Carlo sampling.
+
+The module includes the following functions:
+
+- `fit_to_jager_coefficients`: Converts coefficients fitted with `correction_coefficients.exponential_fit` and their
+  covariance to the (a, b, c) of the Jager correction factor.
+- `sample_coefficients`: Draws (a, b, c) samples from a multivariate normal distribution.
+- `count_rate_weights`: Spreads the calibrated count rates of each detector over a grid of count rates.
+- `corrected_count_sum_samples`: Calculates the corrected count sum of each detector for many coefficient samples.
+- `corrected_count_sum_intervals`: Calculates per-detector confidence intervals of the corrected count sums.
+
+This module is part of a larger project aimed at analyzing and correcting dose rate dependencies in ArcCheck measurements.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from corrections import calibrated_count_rate, jager_corrected_count_sums
+
+
+def fit_to_jager_coefficients(popt, pcov=None):
+    """
+    Converts fitted correction curve coefficients to the (a, b, c) of the Jager correction factor.
+
+    Parameters
+    ----------
+    popt : array_like
+        The coefficients (a, b, c) of the curve a * exp(b * x) + c, as returned by
+        `correction_coefficients.get_correction_coefficients`.
+    pcov : array_like, optional
+        The 3 x 3 covariance of the fitted coefficients.
+
+    Returns
+    -------
+    numpy.ndarray or tuple
+        The coefficients (a, b, c) of JCF = c - a * exp(-b * x), and their covariance if `pcov` is given.
+    """
+    # The fitted a and b are the negated Jager a and b
+    signs = np.array([-1.0, -1.0, 1.0])
+    coefficients = signs * np.asarray(popt, dtype=float)
+    if pcov is None:
+        return coefficients
+    return coefficients, np.asarray(pcov, dtype=float) * np.outer(signs, signs)
+
+
+def sample_coefficients(coefficients, covariance, n_samples, seed=None):
+    """
+    Draws (a, b, c) samples from a multivariate normal distribution.
+
+    Parameters
+    ----------
+    coefficients : array_like
+        The mean (a, b, c) coefficients.
+    covariance : array_like
+        The 3 x 3 covariance of the coefficients.
+    n_samples : int
+        The number of samples.
+    seed : int or numpy.random.Generator, optional
+        The seed or generator of the random numbers, for reproducible samples.
+
+    Returns
+    -------
+    numpy.ndarray
+        The (n_samples, 3) array of the sampled coefficients.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.multivariate_normal(np.asarray(coefficients, dtype=float), np.asarray(covariance, dtype=float),
+                                   size=n_samples, method='eigh')
+
+
+def _iter_count_rate_blocks(counts_accumulated, background_values, calibration_values, block_size):
+    """Yields the calibrated count rates of consecutive blocks of frames."""
+    previous_counts = None
+    for start in range(0, len(counts_accumulated), block_size):
+        block = counts_accumulated[start:start + block_size]
+        count = calibrated_count_rate(block, background_values, calibration_values, previous_counts)
+        previous_counts = block[-1]
+        if len(count):
+            yield count
+
+
+def count_rate_weights(count_blocks, grid):
+    """
+    Spreads the calibrated count rates of each detector over a grid of count rates.
+
+    Parameters
+    ----------
+    count_blocks : iterable of numpy.ndarray
+        The calibrated count rates of consecutive blocks of frames (frames x detectors).
+    grid : numpy.ndarray
+        The evenly spaced grid of count rates, covering all count rates.
+
+    Returns
+    -------
+    numpy.ndarray
+        The (detectors, grid points) weights W such that the sum of a smooth function g over the frames of a
+        detector d is approximately W[d] @ g(grid), from linear interpolation of g between the grid points.
+        NaN count rates get no weight, so they are skipped like in DataFrame.sum().
+
+    Raises
+    ------
+    ValueError
+        If there are no count rates, e.g. of a recording of fewer than 2 frames.
+    """
+    n_grid = len(grid)
+    spacing = grid[1] - grid[0]
+    weights = None
+
+    for count in count_blocks:
+        n_detectors = count.shape[1]
+        if weights is None:
+            weights = np.zeros(n_detectors * n_grid)
+
+        position = (count - grid[0]) / spacing
+        valid = ~np.isnan(position)
+        position = np.clip(position[valid], 0, n_grid - 1)
+        lower = np.minimum(position.astype(np.intp), n_grid - 2)
+        fraction = position - lower
+
+        # Flat index of the lower grid point of each count rate in the (detectors, grid points) weights
+        detector = np.broadcast_to(np.arange(n_detectors), count.shape)[valid]
+        index = detector * n_grid + lower
+        weights += np.bincount(index, weights=1 - fraction, minlength=weights.size)
+        weights += np.bincount(index + 1, weights=fraction, minlength=weights.size)
+
+    if weights is None:
+        raise ValueError("No count rates to spread over the grid.")
+    return weights.reshape(-1, n_grid)
+
+
+def _corrected_count_rate(grid, coefficients):
+    """Returns the Jager corrected count rate x / (c - a * exp(-b * x)) at the grid points for each coefficient set."""
+    a, b, c = (coefficients[:, i, np.newaxis] for i in range(3))
+    return grid / (c - a * np.exp(-b * grid))
+
+
+def corrected_count_sum_samples(counts_accumulated_df, bkrnd_and_calibration_df, coefficient_samples,
+                                nominal_coefficients=None, n_grid=1024, sample_chunk_size=1000, block_size=1024):
+    """
+    Calculates the Jager corrected count sum of each detector for many coefficient samples.
+
+    Parameters
+    ----------
+    counts_accumulated_df : pandas.DataFrame
+        The accumulated count values.
+    bkrnd_and_calibration_df : pandas.DataFrame
+        The background and calibration values of the ACM file.
+    coefficient_samples : numpy.ndarray
+        The (samples, 3) array of (a, b, c) coefficients, e.g. from `sample_coefficients`.
+    nominal_coefficients : array_like, optional
+        The nominal (a, b, c) coefficients, whose sums are calculated exactly. Defaults to the mean of the samples.
+    n_grid : int, optional
+        The number of grid points the corrected count rate is evaluated at for each sample.
+    sample_chunk_size : int, optional
+        The number of samples evaluated at a time, which bounds the temporary memory.
+    block_size : int, optional
+        The number of frames read at a time.
+
+    Returns
+    -------
+    tuple
+        The (samples, detectors) array of corrected count sums of each sample, the exact corrected count sum of
+        each detector for the nominal coefficients and the relative error of the grid approximation of the nominal
+        sums for each detector. A recording of fewer than 2 frames, or of only NaN count rates, has no count rates,
+        so all its sums and errors are zero, like the sum of no frames in DataFrame.sum().
+
+    Notes
+    -----
+    Correcting every frame for every sample would evaluate samples x frames x detectors exponentials. Instead the
+    count rates are spread once over a grid by `count_rate_weights`, and the corrected sums of a chunk of samples
+    are a single matrix product of the corrected count rates at the grid points and the weights. Each sample sum
+    is the exact nominal sum plus the difference between the sample and nominal grid approximations, so the
+    interpolation error mostly cancels and is bounded by the reported error of the nominal sums.
+    """
+    background_values = bkrnd_and_calibration_df['Background'].values.astype(float)[1:]
+    calibration_values = bkrnd_and_calibration_df['Calibration'].values.astype(float)[1:]
+    counts_accumulated = np.asarray(counts_accumulated_df, dtype=float)
+    coefficient_samples = np.asarray(coefficient_samples, dtype=float).reshape(-1, 3)
+    if nominal_coefficients is None:
+        nominal_coefficients = coefficient_samples.mean(axis=0)
+    nominal_coefficients = np.asarray(nominal_coefficients, dtype=float).reshape(1, 3)
+
+    def count_blocks():
+        return _iter_count_rate_blocks(counts_accumulated, background_values, calibration_values, block_size)
+
+    # First pass: range of the count rates and exact nominal sums
+    low, high = np.inf, -np.inf
+    nominal_sums = np.zeros(len(background_values))
+    for count in count_blocks():
+        low, high = min(low, np.nanmin(count)), max(high, np.nanmax(count))
+        nominal_sums += jager_corrected_count_sums(count, nominal_coefficients)[0]
+    if not np.isfinite(low):
+        return np.zeros((len(coefficient_samples), len(background_values))), nominal_sums, \
+            np.zeros(len(background_values))
+    if high <= low:
+        high = low + 1
+
+    # Second pass: weights of the count rates on the grid
+    grid = np.linspace(low, high, n_grid)
+    weights_t = np.ascontiguousarray(count_rate_weights(count_blocks(), grid).T)
+
+    nominal_grid_sums = _corrected_count_rate(grid, nominal_coefficients) @ weights_t
+    offset = nominal_sums - nominal_grid_sums[0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        grid_error = np.abs(offset / nominal_sums)
+
+    sample_sums = np.empty((len(coefficient_samples), len(background_values)))
+    for start in range(0, len(coefficient_samples), sample_chunk_size):
+        samples = coefficient_samples[start:start + sample_chunk_size]
+        np.matmul(_corrected_count_rate(grid, samples), weights_t, out=sample_sums[start:start + len(samples)])
+    sample_sums += offset
+
+    return sample_sums, nominal_sums, grid_error
+
+
+def corrected_count_sum_intervals(counts_accumulated_df, bkrnd_and_calibration_df, coefficients, covariance,
+                                  n_samples=5000, confidence=0.95, seed=None, **kwargs):
+    """
+    Calculates per-detector confidence intervals of the Jager corrected count sums.
+
+    Parameters
+    ----------
+    counts_accumulated_df : pandas.DataFrame
+        The accumulated count values.
+    bkrnd_and_calibration_df : pandas.DataFrame
+        The background and calibration values of the ACM file.
+    coefficients : array_like
+        The (a, b, c) coefficients of the correction, e.g. from `fit_to_jager_coefficients`.
+    covariance : array_like
+        The 3 x 3 covariance of the coefficients.
+    n_samples : int, optional
+        The number of Monte Carlo samples of the coefficients.
+    confidence : float, optional
+        The confidence level of the intervals.
+    seed : int or numpy.random.Generator, optional
+        The seed or generator of the random numbers, for reproducible intervals.
+    **kwargs
+        Passed to `corrected_count_sum_samples`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per detector, indexed by detector name, with the 'Nominal' corrected count sum, the 'Mean' and
+        'Std' of the sampled sums, the 'Lower' and 'Upper' bounds of the central confidence interval and the
+        relative 'Grid Error' of the sampled sums.
+    """
+    samples = sample_coefficients(coefficients, covariance, n_samples, seed)
+    sample_sums, nominal_sums, grid_error = corrected_count_sum_samples(
+        counts_accumulated_df, bkrnd_and_calibration_df, samples, nominal_coefficients=coefficients, **kwargs)
+
+    tail = (1 - confidence) / 2
+    lower, upper = np.quantile(sample_sums, [tail, 1 - tail], axis=0)
+
+    return pd.DataFrame({
+        'Nominal': nominal_sums,
+        'Mean': sample_sums.mean(axis=0),
+        'Std': sample_sums.std(axis=0, ddof=1),
+        'Lower': lower,
+        'Upper': upper,
+        'Grid Error': grid_error,
+    }, index=bkrnd_and_calibration_df['Detector Names'].values[1:])
@@ -0,0 +1,29 @@
+"""
+Shared fixtures of the tests: the src folder on the import path and synthetic ArcCheck measurements.
+"""
+
+import os
+import sys
+
+import pytest
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, SRC_DIR)
+
+from benchmarks import synthetic_data  # noqa: E402
+import io_snc  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def long_measurement(tmp_path_factory):
+    """
+    A synthetic measurement of more frames than one correction block, parsed.
+
+    Returns
+    -------
+    tuple
+        The path of the ACM file, its accumulated counts and its background and calibration DataFrame.
+    """
+    acm_file_path, _ = synthetic_data.write_measurement(str(tmp_path_factory.mktemp('long')), 2500, seed=1)
+    _, counts_accumulated_df, bkrnd_and_calibration_df = io_snc.parse_acm_file(acm_file_path)
+    return acm_file_path, counts_accumulated_df, bkrnd_and_calibration_df
@@ -0,0 +1,115 @@
+"""
+Tests of following an ACM file while it is acquired, with a local writer process standing in for the ArcCheck.
+"""
+
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+
+import corrections
+import io_snc
+
+# Copies a finished ACM file to the followed file in the given chunks of bytes, flushing and pausing after each, so
+# the follower sees partial lines, a header split between the Background and Calibration rows and growing data
+WRITER = """
+import sys, time
+source_path, target_path, split_points = sys.argv[1], sys.argv[2], [int(point) for point in sys.argv[3:]]
+with open(source_path, 'rb') as source:
+    content = source.read()
+with open(target_path, 'ab') as target:
+    for start, stop in zip([0] + split_points, split_points + [len(content)]):
+        target.write(content[start:stop])
+        target.flush()
+        time.sleep(0.03)
+"""
+
+
+def _split_points(content, n_chunks=40):
+    """Returns byte offsets that split the header inside the Calibration row and the data rows mid-line."""
+    calibration_start = content.index(b'\nCalibration') + 1
+    data_start = content.index(b'\nData:') + 1
+    # Stop inside the Calibration row, then between its label and values, then in the middle of data rows
+    header_points = [calibration_start + 5, calibration_start + 20]
+    data_points = np.linspace(data_start, len(content), n_chunks, endpoint=False)[1:].astype(int) + 7
+    return header_points + [int(point) for point in data_points]
+
+
+def _start_writer(source_path, target_path):
+    """Starts the writer process appending the source ACM file to the followed file in chunks."""
+    with open(source_path, 'rb') as file:
+        split_points = _split_points(file.read())
+    open(target_path, 'w').close()
+    return subprocess.Popen([sys.executable, '-c', WRITER, source_path, target_path] +
+                            [str(point) for point in split_points])
+
+
+def test_follow_matches_batch_corrections(long_measurement, tmp_path):
+    """The sums of a file followed while it is written in partial lines equal those of correcting it at once."""
+    acm_file_path, counts_accumulated_df, bkrnd_and_calibration_df = long_measurement
+    followed_path = str(tmp_path / 'acquiring.acm')
+    writer = _start_writer(acm_file_path, followed_path)
+    try:
+        updates = list(corrections.follow_jager_corrections(followed_path, poll_interval=0.01, idle_timeout=1.0))
+    finally:
+        writer.wait(timeout=30)
+
+    assert writer.returncode == 0
+    assert len(updates) > 10
+    n_frames, corrected_count_sums = updates[-1]
+    assert n_frames == len(counts_accumulated_df)
+    assert [frames for frames, _ in updates] == sorted(frames for frames, _ in updates)
+
+    accumulator = corrections.JagerCorrectionAccumulator(bkrnd_and_calibration_df)
+    accumulator.update_recording(counts_accumulated_df.values)
+    np.testing.assert_allclose(corrected_count_sums, accumulator.corrected_count_sums, rtol=1e-12)
+
+
+def test_follower_parses_only_complete_lines(long_measurement, tmp_path):
+    """A half-written row is not parsed until its line ending is written."""
+    acm_file_path, counts_accumulated_df, _ = long_measurement
+    with open(acm_file_path, 'rb') as file:
+        content = file.read()
+    second_row = content.index(b'\nData:', content.index(b'\nData:') + 1) + 1
+    followed_path = tmp_path / 'acquiring.acm'
+    followed_path.write_bytes(content[:second_row + 40])
+
+    with io_snc.AcmFollower(str(followed_path)) as follower:
+        follower.read_background_and_calibration(idle_timeout=0)
+        _, diode_data = follower.read_new_frames()
+        assert len(diode_data) == 1
+
+        with open(followed_path, 'ab') as file:
+            file.write(content[second_row + 40:content.index(b'\n', second_row) + 1])
+        _, diode_data = follower.read_new_frames()
+        assert len(diode_data) == 1
+        np.testing.assert_array_equal(diode_data[0], counts_accumulated_df.values[1])
+
+
+def test_background_and_calibration_idle_timeout(long_measurement, tmp_path):
+    """Waiting for the Background and Calibration rows gives up after the idle timeout."""
+    acm_file_path, _, _ = long_measurement
+    with open(acm_file_path, 'rb') as file:
+        content = file.read()
+    followed_path = tmp_path / 'acquiring.acm'
+    followed_path.write_bytes(content[:content.index(b'\nCalibration') + 1])
+
+    with io_snc.AcmFollower(str(followed_path)) as follower:
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            follower.read_background_and_calibration(poll_interval=0.01, idle_timeout=0.2)
+        assert time.monotonic() - start < 5
+
+
+def test_follow_stops_after_idle_timeout(long_measurement):
+    """Following a file that is no longer written yields all its frames and stops after the idle timeout."""
+    acm_file_path, counts_accumulated_df, _ = long_measurement
+    with io_snc.AcmFollower(acm_file_path) as follower:
+        follower.read_background_and_calibration(idle_timeout=0)
+        start = time.monotonic()
+        batches = list(follower.follow(poll_interval=0.01, idle_timeout=0.2))
+        assert time.monotonic() - start < 5
+
+    assert sum(len(diode_data) for _, diode_data in batches) == len(counts_accumulated_df)
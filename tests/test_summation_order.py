@@ -0,0 +1,46 @@
+"""
+Regression tests of the summation order of the Jager corrections: correcting a recording block by block, or several
+models at once, gives the same sums bit for bit as the original corrections that sum all frames at once.
+"""
+
+import numpy as np
+import pytest
+
+import correction_models
+import corrections
+
+
+@pytest.mark.parametrize('block_size', [1024, 100, 7])
+def test_block_sums_identical_to_one_sum(long_measurement, block_size):
+    """The sums of a recording of more frames than a block equal the pandas sums of the original corrections."""
+    _, counts_accumulated_df, bkrnd_and_calibration_df = long_measurement
+    accumulator = corrections.JagerCorrectionAccumulator(bkrnd_and_calibration_df)
+    accumulator.update_recording(counts_accumulated_df.values, block_size)
+
+    pr_sums = corrections.pulse_rate_correction(counts_accumulated_df, bkrnd_and_calibration_df,
+                                                corrections.JAGER_PR_COEFFICIENTS)
+    dpp_sums = corrections.dose_per_pulse_correction(counts_accumulated_df, bkrnd_and_calibration_df,
+                                                     corrections.JAGER_DPP_COEFFICIENTS)
+    np.testing.assert_array_equal(accumulator.corrected_count_sums[0], pr_sums.values)
+    np.testing.assert_array_equal(accumulator.corrected_count_sums[1], dpp_sums.values)
+
+
+def test_pairwise_block_sum_identical_to_numpy_sum():
+    """Summing blocks with pairwise_block_sum reproduces the pairwise summation of one NumPy sum."""
+    values = np.random.default_rng(0).random(10007) * 1e4
+    block_sum = lambda start, stop: values[start:stop].sum()  # noqa: E731
+    for block_size in (1, 8, 100, 1024, 4096):
+        assert corrections.pairwise_block_sum(0, len(values), block_size, block_sum) == values.sum()
+
+
+def test_models_evaluated_together_identical_to_each_alone(long_measurement):
+    """The sums of each of several models evaluated in one pass equal those of applying the model on its own."""
+    _, counts_accumulated_df, bkrnd_and_calibration_df = long_measurement
+    models = [correction_models.CorrectionModel(f"model_{index}", 0.035 * scale, 5.21e-5 * scale, 1 + 0.01 * index)
+              for index, scale in enumerate([0.5, 1, 1.5, 2, 3])]
+
+    together = correction_models.evaluate_correction_models(counts_accumulated_df, bkrnd_and_calibration_df, models)
+    for model in models:
+        alone = correction_models.evaluate_correction_models(counts_accumulated_df, bkrnd_and_calibration_df,
+                                                             [model])
+        np.testing.assert_array_equal(together[model.name], alone[model.name])